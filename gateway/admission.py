@@ -0,0 +1,279 @@
+"""
+路由准入控制
+限制每个路由的并发请求数，超出部分进入有界等待队列；
+队列已满或预计无法在截止时间内完成的请求直接拒绝，避免在下游模型服务中无限排队
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import math
+import time
+import weakref
+from collections import deque
+from functools import wraps
+from typing import Dict, Any, Optional
+
+from quart import Response, request
+from quart.wrappers.response import IterableBody
+from shared.response_models import APIResponse
+from shared.metrics import get_metrics_registry
+from config import ADMISSION_CONTROL_ENABLED, ADMISSION_DEFAULTS, ADMISSION_ROUTES
+
+
+ADMISSION_REJECTIONS = get_metrics_registry().counter(
+    'gateway_admission_rejections_total', '准入控制拒绝的请求数', ('route', 'reason')
+)
+ADMISSION_QUEUE_WAIT = get_metrics_registry().histogram(
+    'gateway_admission_queue_wait_seconds', '获得准入前的排队耗时(秒)', ('route',)
+)
+
+
+class AdmissionRejected(Exception):
+    """请求未获准入"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        self.message = message
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class AdmissionController:
+    """单个路由的准入控制器"""
+
+    def __init__(self, name: str, max_in_flight: int, max_queue: int, deadline: float, wait_window: int = 1000):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.deadline = deadline
+
+        self._in_flight = 0
+        self._waiters = deque()
+        # 平均处理耗时(秒)的指数滑动平均，用于估算排队时间
+        self._avg_service_time: Optional[float] = None
+        self._waits = deque(maxlen=wait_window)
+
+        # 统计信息
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_deadline = 0
+        self._queue_timeouts = 0
+        self._max_wait = 0.0
+
+    def _estimated_wait(self, position: int) -> float:
+        """估算排在第 position 位的请求需要等待的时间(秒)"""
+        if self._avg_service_time is None:
+            return 0.0
+        return math.ceil(position / self.max_in_flight) * self._avg_service_time
+
+    def _retry_after(self, wait: float) -> int:
+        return max(int(math.ceil(wait)), 1)
+
+    async def acquire(self, deadline: Optional[float] = None):
+        """
+        获取执行名额
+
+        队列已满时抛出429，预计排队加处理时间超过截止时间时抛出503，均带建议重试时间。
+        """
+        deadline = self.deadline if deadline is None else min(deadline, self.deadline)
+
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            self._admit(0.0)
+            return
+
+        position = len(self._waiters) + 1
+        estimated_wait = self._estimated_wait(position)
+        if len(self._waiters) >= self.max_queue:
+            self._rejected_queue_full += 1
+            ADMISSION_REJECTIONS.labels(self.name, 'queue_full').inc()
+            raise AdmissionRejected("请求过多，请稍后重试", 429, self._retry_after(estimated_wait))
+
+        service_time = self._avg_service_time or 0.0
+        if estimated_wait + service_time > deadline:
+            self._rejected_deadline += 1
+            ADMISSION_REJECTIONS.labels(self.name, 'deadline').inc()
+            raise AdmissionRejected("服务繁忙，预计无法在截止时间内完成", 503, self._retry_after(estimated_wait))
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start_time = time.perf_counter()
+        try:
+            # 等到剩余时间不足以完成处理时放弃排队
+            await asyncio.wait_for(waiter, timeout=max(deadline - service_time, 0.0))
+        except asyncio.TimeoutError:
+            self._remove_waiter(waiter)
+            self._queue_timeouts += 1
+            ADMISSION_REJECTIONS.labels(self.name, 'queue_timeout').inc()
+            raise AdmissionRejected("服务繁忙，排队超时", 503, self._retry_after(self._estimated_wait(len(self._waiters))))
+        except asyncio.CancelledError:
+            self._remove_waiter(waiter)
+            # 名额已转交但请求被取消时，归还名额
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+
+        self._admit(time.perf_counter() - start_time)
+
+    def _admit(self, wait: float):
+        self._admitted += 1
+        self._waits.append(wait)
+        self._max_wait = max(self._max_wait, wait)
+        ADMISSION_QUEUE_WAIT.labels(self.name).observe(wait)
+
+    def _remove_waiter(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def release(self, service_time: float):
+        """释放执行名额并记录本次处理耗时(秒)"""
+        if self._avg_service_time is None:
+            self._avg_service_time = service_time
+        else:
+            self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        self._release_slot()
+
+    def _release_slot(self):
+        """名额直接转交给队首等待者，没有等待者时归还"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取准入控制统计"""
+        waits = sorted(self._waits)
+        p95 = waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else 0.0
+        return {
+            'in_flight': self._in_flight,
+            'queued': len(self._waiters),
+            'max_in_flight': self.max_in_flight,
+            'max_queue': self.max_queue,
+            'admitted': self._admitted,
+            'rejected_queue_full': self._rejected_queue_full,
+            'rejected_deadline': self._rejected_deadline,
+            'queue_timeouts': self._queue_timeouts,
+            'avg_service_time_ms': round(self._avg_service_time * 1000, 2) if self._avg_service_time is not None else None,
+            'queue_wait': {
+                'avg_ms': round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                'p95_ms': round(p95 * 1000, 2),
+                'max_ms': round(self._max_wait * 1000, 2)
+            }
+        }
+
+
+class AdmissionSlot:
+    """
+    已获得的准入名额，用于处理函数返回后仍在发送响应体的流式路由
+
+    release 可重复调用，名额只释放一次。
+    """
+
+    def __init__(self, controller: AdmissionController):
+        self.controller = controller
+        self.start_time = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if self._released:
+            return
+        self._released = True
+        self.controller.release(time.perf_counter() - self.start_time)
+
+
+# 全局控制器实例，按路由名索引
+_admission_controllers: Dict[str, AdmissionController] = {}
+
+
+def get_admission_controller(route_name: str) -> AdmissionController:
+    """获取路由的准入控制器，首次使用时创建"""
+    controller = _admission_controllers.get(route_name)
+    if controller is None:
+        controller = AdmissionController(route_name, **{**ADMISSION_DEFAULTS, **ADMISSION_ROUTES.get(route_name, {})})
+        _admission_controllers[route_name] = controller
+    return controller
+
+
+def get_admission_stats() -> Dict[str, Dict[str, Any]]:
+    """获取所有路由的准入控制统计"""
+    return {route_name: get_admission_controller(route_name).get_stats() for route_name in ADMISSION_ROUTES}
+
+
+def rejection_response(e: AdmissionRejected):
+    """未获准入时的响应，带建议重试时间"""
+    return APIResponse.error(
+        message=e.message,
+        code=e.status_code
+    ).to_dict(), e.status_code, {'Retry-After': str(e.retry_after)}
+
+
+def request_deadline() -> Optional[float]:
+    """客户端可通过 X-Request-Timeout 请求头(秒)缩短截止时间"""
+    value = request.headers.get('X-Request-Timeout')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def _release_after_body(response, slot: AdmissionSlot) -> bool:
+    """
+    响应体边收边发时，把名额的释放推迟到响应体发送完毕(或客户端断开)之后，返回是否已接管释放
+
+    响应体开始发送前客户端即断开时包装的生成器从未运行，由生成器被回收时释放名额。
+    """
+    if not isinstance(response, Response) or not isinstance(response.response, IterableBody):
+        return False
+    body = response.response.iter
+
+    async def iterate():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            try:
+                await body.aclose()
+            finally:
+                slot.release()
+
+    wrapped = iterate()
+    weakref.finalize(wrapped, slot.release)
+    response.response = IterableBody(wrapped)
+    return True
+
+
+def admission_control(route_name: str):
+    """
+    路由准入控制装饰器
+
+    名额在处理函数返回时释放；返回边收边发的响应时在响应体发送完毕后才释放，处理耗时包含发送时间。
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not ADMISSION_CONTROL_ENABLED:
+                return await func(*args, **kwargs)
+
+            controller = get_admission_controller(route_name)
+            try:
+                await controller.acquire(request_deadline())
+            except AdmissionRejected as e:
+                return rejection_response(e)
+
+            slot = AdmissionSlot(controller)
+            streaming = False
+            try:
+                response = await func(*args, **kwargs)
+                streaming = _release_after_body(response, slot)
+                return response
+            finally:
+                if not streaming:
+                    slot.release()
+        return wrapper
+    return decorator
@@ -1,45 +1,77 @@
 """
 API网关主应用
 统一的入口点，负责路由转发到各个微服务
+
+基于asyncio的ASGI应用：下游调用全部为非阻塞IO，少量线程即可承载大量并发请求
 """
 import os
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask
-from flask_cors import CORS
+from quart import Quart
+from quart_cors import cors
+from shared.metrics import register_quart_metrics
+from shared.tracing import register_quart_tracing
 from routes import api
-from config import GATEWAY_PORT, CORS_ORIGINS, MAX_CONTENT_LENGTH, UPLOAD_FOLDER
+from proxy import close_service_proxies
+from health import get_health_prober
+from config import GATEWAY_PORT, GATEWAY_WORKERS, CORS_ORIGINS, MAX_CONTENT_LENGTH, UPLOAD_FOLDER
 
 
 def create_app():
-    """创建Flask应用"""
-    app = Flask(__name__)
-    
+    """创建Quart应用"""
+    app = Quart(__name__)
+
     # 基础配置
     app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-    
+
     # 创建上传目录
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-    
+
     # CORS配置
-    CORS(app, origins=CORS_ORIGINS, supports_credentials=True)
-    
+    app = cors(app, allow_origin=CORS_ORIGINS, allow_credentials=True)
+
     # 注册蓝图
     app.register_blueprint(api)
     
+    # 请求指标，GET /metrics
+    register_quart_metrics(app, 'gateway')
+    
+    # 请求ID与链路追踪
+    register_quart_tracing(app, 'gateway')
+
+    @app.before_serving
+    async def startup():
+        """启动后台健康探测"""
+        get_health_prober().start()
+
+    @app.after_serving
+    async def shutdown():
+        """停止健康探测并关闭下游服务连接池"""
+        await get_health_prober().stop()
+        await close_service_proxies()
+
     return app
 
 
+# ASGI入口: hypercorn app:app --bind 0.0.0.0:8000 --workers N
+app = create_app()
+
+
 if __name__ == '__main__':
-    app = create_app()
+    from hypercorn.config import Config as HypercornConfig
+    from hypercorn.run import run
+
     print(f"[启动] API网关启动在端口 {GATEWAY_PORT}")
     print(f"[状态] 访问服务状态: http://localhost:{GATEWAY_PORT}/services/status")
     print(f"[健康] 健康检查: http://localhost:{GATEWAY_PORT}/health")
-    
-    app.run(
-        host='0.0.0.0',
-        port=GATEWAY_PORT,
-        debug=True
-    ) 
\ No newline at end of file
+    print(f"[指标] Prometheus指标: http://localhost:{GATEWAY_PORT}/metrics")
+
+    hypercorn_config = HypercornConfig()
+    hypercorn_config.application_path = 'app:app'
+    hypercorn_config.bind = [f"0.0.0.0:{GATEWAY_PORT}"]
+    hypercorn_config.workers = GATEWAY_WORKERS
+    hypercorn_config.accesslog = '-'
+
+    run(hypercorn_config)
@@ -0,0 +1,178 @@
+"""
+下游服务熔断器
+按服务统计调用结果，连续失败后熔断；同时按接口根据观测到的p99延迟自适应调整超时
+"""
+import re
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+# 接口路径中只由字母和下划线组成的段视为路由名，其余(任务ID、文件名等)替换为占位符
+_ROUTE_SEGMENT = re.compile(r'^[A-Za-z_]+$')
+
+
+def route_template(endpoint: str) -> str:
+    """接口路径对应的路由模板，如 result/3f2a... -> result/<id>，同一路由的调用共享延迟统计"""
+    segments = endpoint.strip('/').split('/')
+    return '/'.join(segment if _ROUTE_SEGMENT.match(segment) else '<id>' for segment in segments)
+
+
+class CircuitBreaker:
+    """
+    熔断器，三种状态:
+    - closed: 正常放行，连续失败达到阈值后转为 open
+    - open: 直接拒绝，经过恢复时间后转为 half_open
+    - half_open: 只放行一个试探请求，成功则恢复 closed，失败则重新 open
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        latency_window: int = 200,
+        min_samples: int = 20,
+        timeout_multiplier: float = 3.0,
+        min_timeout: float = 1.0,
+        max_routes: int = 32
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.min_samples = min_samples
+        self.timeout_multiplier = timeout_multiplier
+        self.min_timeout = min_timeout
+        self.latency_window = latency_window
+        self.max_routes = max_routes
+
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._opened_at_iso: Optional[str] = None
+        self._trial_in_flight = False
+        # 路由模板 -> 最近调用耗时(秒)，不同接口的延迟差异很大(如轮询结果与检测)，分别计算超时
+        self._latencies: "OrderedDict[str, deque]" = OrderedDict()
+
+        # 累计统计
+        self._rejected = 0
+        self._open_count = 0
+
+    def _recovery_elapsed(self) -> bool:
+        return self._opened_at is not None and time.monotonic() - self._opened_at >= self.recovery_timeout
+
+    def is_open(self) -> bool:
+        """是否处于熔断期(不改变状态，供路由快速判断)"""
+        return self.state == self.OPEN and not self._recovery_elapsed()
+
+    def count_rejection(self):
+        """记录一次在路由层被快速拒绝的请求"""
+        self._rejected += 1
+
+    def allow_request(self) -> bool:
+        """判断是否放行本次调用"""
+        if self.state == self.OPEN:
+            if not self._recovery_elapsed():
+                self._rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                self._rejected += 1
+                return False
+            self._trial_in_flight = True
+
+        return True
+
+    def _record_latency(self, route: str, latency: float):
+        latencies = self._latencies.get(route)
+        if latencies is None:
+            latencies = self._latencies[route] = deque(maxlen=self.latency_window)
+            while len(self._latencies) > self.max_routes:
+                self._latencies.popitem(last=False)
+        else:
+            self._latencies.move_to_end(route)
+        latencies.append(latency)
+
+    def record_success(self, latency: float, route: str = ''):
+        """记录成功调用及其耗时(秒)"""
+        self._record_latency(route, latency)
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            self._opened_at = None
+            self._opened_at_iso = None
+
+    def record_failure(self):
+        """记录失败调用(连接失败、超时或5xx)"""
+        self._consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            self._trip()
+
+    def record_timeout(self, timeout: float, route: str = ''):
+        """
+        记录超时的调用: 计为失败，同时以超时值作为一个延迟样本
+
+        下游整体变慢后，超时样本使p99随之升高、自适应超时逐步放宽，不会因只统计成功调用而卡在下限。
+        """
+        self._record_latency(route, timeout)
+        self.record_failure()
+
+    def release(self):
+        """调用因与下游无关的原因中止时，释放试探名额且不计入结果"""
+        self._trial_in_flight = False
+
+    def _trip(self):
+        """进入熔断状态"""
+        if self.state != self.OPEN:
+            self._open_count += 1
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._opened_at_iso = datetime.now().isoformat()
+
+    def latency_percentile(self, percentile: float, route: str = '') -> Optional[float]:
+        """接口最近调用耗时的百分位数(秒)，样本不足时返回None"""
+        latencies = self._latencies.get(route)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def get_timeout(self, max_timeout: float, route: str = '') -> float:
+        """
+        根据接口的p99延迟计算本次调用的超时，不超过路由给定的上限
+
+        半开状态的试探请求使用完整的上限，避免下游变慢后试探请求总被过紧的超时判为失败而无法恢复。
+        """
+        if self.state == self.HALF_OPEN:
+            return max_timeout
+        p99 = self.latency_percentile(99, route)
+        if p99 is None:
+            return max_timeout
+        return min(max(p99 * self.timeout_multiplier, self.min_timeout), max_timeout)
+
+    def get_state(self) -> Dict[str, Any]:
+        """获取熔断器状态"""
+        p99 = {}
+        for route in self._latencies:
+            value = self.latency_percentile(99, route)
+            p99[route] = round(value * 1000, 2) if value is not None else None
+        state = self.state
+        if state == self.OPEN and self._recovery_elapsed():
+            state = self.HALF_OPEN
+        return {
+            'state': state,
+            'consecutive_failures': self._consecutive_failures,
+            'opened_at': self._opened_at_iso,
+            'open_count': self._open_count,
+            'rejected': self._rejected,
+            'p99_latency_ms': p99,
+            'latency_samples': {route: len(latencies) for route, latencies in self._latencies.items()}
+        }
@@ -6,27 +6,42 @@ import os
 # 服务端口配置
 GATEWAY_PORT = int(os.getenv('GATEWAY_PORT', 8000))
 
-# 微服务地址配置
+# ASGI服务器配置 (hypercorn)，每个worker为一个独立进程，进程内单事件循环
+GATEWAY_WORKERS = int(os.getenv('GATEWAY_WORKERS', 1))
+
+
+def _replicas(env_name: str, default_url: str) -> list:
+    """从环境变量读取副本地址列表(逗号分隔)，未设置时使用单个默认地址"""
+    value = os.getenv(env_name, '')
+    urls = [url.strip() for url in value.split(',') if url.strip()]
+    return urls or [default_url]
+
+
+# 微服务地址配置，每个服务可配置多个副本
 SERVICES = {
     'rumor_detection': {
-        'url': f"http://localhost:{os.getenv('RUMOR_SERVICE_PORT', 8010)}",
+        'replicas': _replicas('RUMOR_SERVICE_REPLICAS', f"http://localhost:{os.getenv('RUMOR_SERVICE_PORT', 8010)}"),
         'name': '图文谣言检测服务'
     },
     'ai_image_detection': {
-        'url': f"http://localhost:{os.getenv('AI_IMAGE_SERVICE_PORT', 8002)}",
+        'replicas': _replicas('AI_IMAGE_SERVICE_REPLICAS', f"http://localhost:{os.getenv('AI_IMAGE_SERVICE_PORT', 8002)}"),
         'name': 'AI图像检测服务'
     },
     'video_analysis_module1': {
-        'url': f"http://localhost:{os.getenv('VIDEO_MODULE1_PORT', 8003)}",
+        'replicas': _replicas('VIDEO_MODULE1_REPLICAS', f"http://localhost:{os.getenv('VIDEO_MODULE1_PORT', 8003)}"),
         'name': '视频分析模块1'
     },
     'video_analysis_module2': {
-        'url': f"http://localhost:{os.getenv('VIDEO_MODULE2_PORT', 8004)}",
+        'replicas': _replicas('VIDEO_MODULE2_REPLICAS', f"http://localhost:{os.getenv('VIDEO_MODULE2_PORT', 8004)}"),
         'name': '视频分析模块2'
     }
 
 }
 
+# 副本配置文件(JSON)，格式: {"ai_image_detection": ["http://host1:8002", "http://host2:8002"]}
+# 文件中的服务覆盖上面的默认副本列表；修改后在下一轮健康探测时自动重新加载，无需重启网关
+SERVICE_REGISTRY_FILE = os.getenv('SERVICE_REGISTRY_FILE', '')
+
 # CORS配置
 CORS_ORIGINS = [
     "http://localhost:3000",
@@ -39,5 +54,84 @@ CORS_ORIGINS = [
 MAX_CONTENT_LENGTH = 100 * 1024 * 1024  # 100MB
 UPLOAD_FOLDER = 'uploads'
 
+# 流式上传转发: multipart请求体不在网关解析，边接收边转发到下游服务
+STREAMING_PROXY_ENABLED = os.getenv('GATEWAY_STREAMING_PROXY', 'true') == 'true'
+
+# 响应透传: 下游的成功响应不在网关解析JSON和重新序列化，原样转发状态码、响应头和响应体字节；
+# 网关只在出错时生成统一格式的错误响应。多模态与批量检测需要合并结果，不受影响
+PASSTHROUGH_ENABLED = os.getenv('GATEWAY_PASSTHROUGH', 'true') == 'true'
+PASSTHROUGH_STREAM_THRESHOLD = int(os.getenv('PASSTHROUGH_STREAM_THRESHOLD', 256 * 1024))  # 超过该大小(字节)或长度未知的响应体边收边发
+
+# 请求合并: 内容相同的并发检测请求(图文谣言、AI图像)只调用一次下游服务
+# AI图像上传需要在网关解析以计算内容哈希，只有请求体不超过 SINGLE_FLIGHT_MAX_UPLOAD_BYTES 时才参与合并，
+# 更大或长度未知的上传仍走流式转发(视频上传不受影响)
+SINGLE_FLIGHT_ENABLED = os.getenv('GATEWAY_SINGLE_FLIGHT', 'true') == 'true'
+SINGLE_FLIGHT_MAX_UPLOAD_BYTES = int(os.getenv('SINGLE_FLIGHT_MAX_UPLOAD_BYTES', 2 * 1024 * 1024))
+
+# 多模态检测: 一次上传并发调用谣言检测与AI图像检测，各部分独立超时(秒)
+MULTIMODAL_TIMEOUTS = {
+    'rumor_detection': float(os.getenv('MULTIMODAL_RUMOR_TIMEOUT', 30)),
+    'ai_image_detection': float(os.getenv('MULTIMODAL_AI_IMAGE_TIMEOUT', 30))
+}
+
+# AI图像批量检测: 网关逐张转发到AI图像检测服务，每张完成后立即以NDJSON/SSE推送结果
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', 50))               # 单批最大图片数，与AI图像检测服务一致
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))              # 单批同时转发的图片数
+BATCH_IMAGE_TIMEOUT = float(os.getenv('BATCH_IMAGE_TIMEOUT', 30))       # 单张图片检测超时(秒)
+BATCH_ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+
+# 路由准入控制: 限制每个路由的并发数和等待队列，超出或预计超时的请求直接拒绝(429/503 + Retry-After)
+ADMISSION_CONTROL_ENABLED = os.getenv('GATEWAY_ADMISSION_CONTROL', 'true') == 'true'
+ADMISSION_DEFAULTS = {
+    'max_in_flight': int(os.getenv('ADMISSION_MAX_IN_FLIGHT', 16)),  # 每个路由同时转发到下游的最大请求数
+    'max_queue': int(os.getenv('ADMISSION_MAX_QUEUE', 64)),          # 等待队列长度上限
+    'deadline': float(os.getenv('ADMISSION_DEADLINE', 30))          # 请求截止时间(秒)，与下游调用超时一致
+}
+# 按路由覆盖默认值，模型推理为CPU密集型，并发上限应与下游副本的处理能力匹配
+ADMISSION_ROUTES = {
+    'rumor_detect': {'max_in_flight': int(os.getenv('ADMISSION_RUMOR_MAX_IN_FLIGHT', 4))},
+    'ai_image_detect': {'max_in_flight': int(os.getenv('ADMISSION_AI_IMAGE_MAX_IN_FLIGHT', 4))},
+    'multimodal_detect': {'max_in_flight': int(os.getenv('ADMISSION_MULTIMODAL_MAX_IN_FLIGHT', 4))},
+    # 批量检测单个请求耗时较长，截止时间按整批计算
+    'ai_image_batch': {
+        'max_in_flight': int(os.getenv('ADMISSION_AI_IMAGE_BATCH_MAX_IN_FLIGHT', 2)),
+        'deadline': float(os.getenv('ADMISSION_AI_IMAGE_BATCH_DEADLINE', 600))
+    },
+    'video_module1_detect': {},
+    'video_module2_detect': {}
+}
+
 # 健康检查配置
-HEALTH_CHECK_TIMEOUT = 5 
\ No newline at end of file
+HEALTH_CHECK_TIMEOUT = 5
+HEALTH_CHECK_INTERVAL = float(os.getenv('HEALTH_CHECK_INTERVAL', 5))  # 后台探测间隔(秒)
+
+# 下游连接池配置
+HTTP_POOL_CONFIG = {
+    'pool_maxsize': int(os.getenv('HTTP_POOL_MAXSIZE', 20)),       # 每个下游服务保持的最大空闲长连接数
+    'max_connections': int(os.getenv('HTTP_MAX_CONNECTIONS', 200)), # 每个下游服务的最大并发连接数
+    'max_retries': int(os.getenv('HTTP_MAX_RETRIES', 2)),          # 幂等请求重试次数
+    'backoff_factor': float(os.getenv('HTTP_RETRY_BACKOFF', 0.3))  # 重试退避系数(秒)
+}
+
+# 请求对冲配置(每个下游服务独立): 检测请求超过该接口近期p95延迟仍未返回时，向另一副本发送相同请求，
+# 取先返回的结果并取消另一个，用于削减单个副本GC停顿或CPU争用造成的长尾延迟
+HEDGING_CONFIG = {
+    'enabled': os.getenv('GATEWAY_HEDGING', 'false') == 'true',
+    'budget_ratio': float(os.getenv('HEDGING_BUDGET_RATIO', 0.05)),  # 对冲请求数占请求总数的上限比例
+    'burst': int(os.getenv('HEDGING_BURST', 10)),                    # 预算令牌上限，允许短时间内的集中对冲
+    'min_delay': float(os.getenv('HEDGING_MIN_DELAY', 0.05)),        # 发出对冲前的最短等待时间(秒)
+    'latency_window': 200,       # 用于计算p95的最近调用样本数
+    'min_samples': 20,           # 样本数达到后才开始对冲
+    'max_endpoints': 64          # 最多记录耗时的接口数，超出后淘汰最久未使用的接口
+}
+
+# 熔断器配置(每个下游服务独立)
+CIRCUIT_BREAKER_CONFIG = {
+    'failure_threshold': int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5)),   # 连续失败多少次后熔断
+    'recovery_timeout': float(os.getenv('BREAKER_RECOVERY_TIMEOUT', 30)),  # 熔断多久后放行试探请求(秒)
+    'latency_window': 200,       # 用于计算p99的最近调用样本数
+    'min_samples': 20,           # 样本数达到后才启用自适应超时
+    'timeout_multiplier': 3.0,   # 自适应超时 = p99延迟 * 倍数
+    'min_timeout': 1.0,          # 自适应超时下限(秒)
+    'max_routes': 32             # 按接口(路由模板)统计延迟，最多保留的接口数
+}
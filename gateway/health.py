@@ -0,0 +1,120 @@
+"""
+下游服务健康探测
+后台定时并发探测所有服务副本，结果保存在副本上供负载均衡和路由直接读取；
+每轮探测前检查副本配置文件，变化时热加载副本列表
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from config import SERVICES, HEALTH_CHECK_TIMEOUT, HEALTH_CHECK_INTERVAL
+from proxy import (
+    ReplicaProxy, get_service_proxy, sync_service_replicas,
+    STATUS_UNKNOWN, STATUS_HEALTHY, STATUS_UNHEALTHY
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HealthProber:
+    """后台健康探测器"""
+
+    def __init__(self, interval: float = HEALTH_CHECK_INTERVAL, timeout: float = HEALTH_CHECK_TIMEOUT):
+        self.interval = interval
+        self.timeout = timeout
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, replica: ReplicaProxy):
+        """探测单个副本并更新其健康快照"""
+        start_time = time.perf_counter()
+        is_healthy = await replica.check_health(timeout=self.timeout)
+        latency_ms = (time.perf_counter() - start_time) * 1000
+
+        now = datetime.now().isoformat()
+        status = STATUS_HEALTHY if is_healthy else STATUS_UNHEALTHY
+        previous = replica.health
+
+        # 整体替换字典，读取方拿到的始终是一致的快照
+        replica.health = {
+            'status': status,
+            'latency_ms': round(latency_ms, 2),
+            'last_checked': now,
+            'last_change': now if status != previous['status'] else previous['last_change']
+        }
+
+    async def probe_all(self):
+        """并发探测所有服务的所有副本，总耗时不超过单次探测超时"""
+        await asyncio.gather(
+            *(
+                self._probe(replica)
+                for service_name in SERVICES
+                for replica in get_service_proxy(service_name).get_replicas()
+            ),
+            return_exceptions=True
+        )
+
+    async def _run(self):
+        """探测循环，单轮出错只记录日志，不终止后台任务"""
+        while True:
+            try:
+                sync_service_replicas()
+                await self.probe_all()
+            except Exception:
+                logger.exception("健康探测或副本配置热加载失败")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """在当前事件循环中启动后台探测"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止后台探测"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_status(self, service_name: str) -> Dict[str, Any]:
+        """
+        汇总单个服务的探测结果
+
+        任一副本健康即视为健康，全部副本不可用时视为不可用。
+        """
+        statuses = [replica.health['status'] for replica in get_service_proxy(service_name).get_replicas()]
+        if STATUS_HEALTHY in statuses:
+            status = STATUS_HEALTHY
+        elif statuses and all(item == STATUS_UNHEALTHY for item in statuses):
+            status = STATUS_UNHEALTHY
+        else:
+            status = STATUS_UNKNOWN
+        return {
+            'status': status,
+            'healthy_replicas': statuses.count(STATUS_HEALTHY),
+            'total_replicas': len(statuses)
+        }
+
+    def get_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """汇总所有服务的探测结果"""
+        return {service_name: self.get_status(service_name) for service_name in SERVICES}
+
+    def is_down(self, service_name: str) -> bool:
+        """服务的所有副本是否都在最近一次探测中不可用，尚未探测时视为可用"""
+        return self.get_status(service_name)['status'] == STATUS_UNHEALTHY
+
+
+# 全局探测器实例
+_health_prober = None
+
+
+def get_health_prober() -> HealthProber:
+    """获取健康探测器实例 (单例模式)"""
+    global _health_prober
+    if _health_prober is None:
+        _health_prober = HealthProber()
+    return _health_prober
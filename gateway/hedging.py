@@ -0,0 +1,114 @@
+"""
+请求对冲策略
+主副本在该接口近期p95延迟内未响应时，向另一副本发送相同请求，取先返回的结果；
+对冲请求数受令牌预算限制，避免在下游整体变慢时成倍放大负载
+"""
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional
+
+
+class HedgingPolicy:
+    """
+    单个下游服务的对冲策略
+
+    预算: 每个可对冲的请求积累 budget_ratio 个令牌(上限 burst)，每次对冲消耗一个，
+    因此长期来看对冲请求数不超过总请求数的 budget_ratio。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        budget_ratio: float = 0.05,
+        burst: int = 10,
+        min_delay: float = 0.05,
+        latency_window: int = 200,
+        min_samples: int = 20,
+        max_endpoints: int = 64
+    ):
+        self.enabled = enabled
+        self.budget_ratio = budget_ratio
+        self.burst = burst
+        self.min_delay = min_delay
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.max_endpoints = max_endpoints
+
+        self._tokens = 0.0
+        # 接口 -> 最近单次调用耗时(秒)，按最近使用淘汰，最多保留 max_endpoints 个接口
+        self._latencies: "OrderedDict[str, deque]" = OrderedDict()
+
+        # 累计统计
+        self._requests = 0
+        self._hedged = 0
+        self._hedge_wins = 0
+        self._budget_exhausted = 0
+
+    def record_latency(self, endpoint: str, latency: float):
+        """记录一次可对冲接口的调用耗时(秒)，对冲请求的耗时同样计入"""
+        latencies = self._latencies.get(endpoint)
+        if latencies is None:
+            latencies = self._latencies[endpoint] = deque(maxlen=self.latency_window)
+            while len(self._latencies) > self.max_endpoints:
+                self._latencies.popitem(last=False)
+        else:
+            self._latencies.move_to_end(endpoint)
+        latencies.append(latency)
+
+    def latency_percentile(self, endpoint: str, percentile: float) -> Optional[float]:
+        """接口最近调用耗时的百分位数(秒)，样本不足时返回None"""
+        latencies = self._latencies.get(endpoint)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+    def hedge_delay(self, endpoint: str) -> Optional[float]:
+        """
+        本次请求发出对冲前的等待时间(秒)，返回None表示不对冲
+
+        调用一次计为一个可对冲请求并积累预算。
+        """
+        if not self.enabled:
+            return None
+        self._requests += 1
+        self._tokens = min(self._tokens + self.budget_ratio, self.burst)
+
+        p95 = self.latency_percentile(endpoint, 95)
+        if p95 is None:
+            return None
+        return max(p95, self.min_delay)
+
+    def try_acquire(self) -> bool:
+        """消耗一个对冲令牌，预算不足时返回False"""
+        if self._tokens < 1:
+            self._budget_exhausted += 1
+            return False
+        self._tokens -= 1
+        self._hedged += 1
+        return True
+
+    def refund(self):
+        """对冲请求最终未发出(没有副本可接收)，退还 try_acquire 消耗的令牌"""
+        self._tokens = min(self._tokens + 1, self.burst)
+        self._hedged -= 1
+
+    def record_hedge_win(self):
+        """记录对冲请求先于主请求返回"""
+        self._hedge_wins += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取对冲统计"""
+        p95 = {}
+        for endpoint in self._latencies:
+            value = self.latency_percentile(endpoint, 95)
+            p95[endpoint] = round(value * 1000, 2) if value is not None else None
+        return {
+            'enabled': self.enabled,
+            'requests': self._requests,
+            'hedged': self._hedged,
+            'hedge_wins': self._hedge_wins,
+            'budget_exhausted': self._budget_exhausted,
+            'hedge_ratio': round(self._hedged / self._requests, 4) if self._requests > 0 else 0.0,
+            'p95_latency_ms': p95
+        }
@@ -0,0 +1,607 @@
+"""
+网关异步代理层
+每个下游副本维护一个非阻塞HTTP客户端，长连接在进程内复用；
+同一服务的多个副本之间按最少未完成请求数进行负载均衡，可选对慢请求向另一副本发送对冲请求
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import asyncio
+import time
+import weakref
+from typing import Dict, Any, Optional, AsyncIterable, AsyncIterator, List, Tuple, Union
+
+import httpx
+from werkzeug.exceptions import RequestEntityTooLarge
+from shared.exceptions import ServiceUnavailableException
+from shared.utils import trace_headers
+from shared.tracing import span
+from breaker import CircuitBreaker, route_template
+from hedging import HedgingPolicy
+from registry import get_service_registry
+from config import SERVICES, HTTP_POOL_CONFIG, HEALTH_CHECK_TIMEOUT, CIRCUIT_BREAKER_CONFIG, HEDGING_CONFIG
+
+
+# 允许自动重试的幂等方法
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+# 对幂等请求触发重试的响应状态码
+RETRY_STATUS_CODES = frozenset({502, 503, 504})
+
+# 原样转发响应时不透传的响应头: 逐跳头、由网关重新生成的头
+EXCLUDED_RESPONSE_HEADERS = frozenset({
+    'connection', 'keep-alive', 'proxy-authenticate', 'te', 'trailer', 'transfer-encoding', 'upgrade',
+    'content-length', 'server', 'date'
+})
+
+# 副本健康状态
+STATUS_UNKNOWN = 'unknown'
+STATUS_HEALTHY = 'healthy'
+STATUS_UNHEALTHY = 'unhealthy'
+
+
+class RelayedResponse:
+    """
+    原样转发的下游响应
+
+    body 为完整的响应体字节，或边收边发的异步迭代器(读完后才释放副本)。
+    """
+
+    __slots__ = ('status_code', 'headers', 'body')
+
+    def __init__(self, status_code: int, headers: List[Tuple[str, str]], body: Union[bytes, AsyncIterator[bytes]]):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+
+
+class _RelayRelease:
+    """
+    流式透传响应的收尾: 关闭下游响应并释放副本，只执行一次
+
+    响应体正常读完或客户端中途断开时由生成器的 finally 执行；客户端在响应体开始发送前断开时生成器从未运行，
+    由生成器被回收时的 close_soon 兜底释放副本并异步关闭下游响应。
+    """
+
+    __slots__ = ('_proxy', '_replica', '_response', '_loop', '_done')
+
+    def __init__(self, proxy: 'ServiceProxy', replica: 'ReplicaProxy', response: httpx.Response):
+        self._proxy = proxy
+        self._replica = replica
+        self._response = response
+        self._loop = asyncio.get_running_loop()
+        self._done = False
+
+    async def close(self):
+        if self._done:
+            return
+        self._done = True
+        try:
+            await self._response.aclose()
+        finally:
+            self._proxy._release(self._replica)
+
+    def close_soon(self):
+        if self._done:
+            return
+        self._done = True
+        self._proxy._release(self._replica)
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._response.aclose()))
+
+
+def _relay_headers(headers: httpx.Headers) -> List[Tuple[str, str]]:
+    """筛选需要透传的响应头；CORS头由网关统一设置"""
+    return [
+        (key, value) for key, value in headers.items()
+        if key not in EXCLUDED_RESPONSE_HEADERS and not key.startswith('access-control-')
+    ]
+
+
+async def _read_raw(response: httpx.Response) -> bytes:
+    """读取未解码的响应体(保留Content-Encoding)并关闭响应"""
+    try:
+        return b''.join([chunk async for chunk in response.aiter_raw()])
+    finally:
+        await response.aclose()
+
+
+class ReplicaProxy:
+    """单个下游副本的异步代理"""
+
+    def __init__(self, name: str, url: str, pool_config: Dict[str, Any], breaker_config: Dict[str, Any]):
+        self.name = name
+        self.url = url.rstrip('/')
+        self.config = pool_config
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            limits=httpx.Limits(
+                max_connections=pool_config['max_connections'],
+                max_keepalive_connections=pool_config['pool_maxsize']
+            ),
+            trust_env=False
+        )
+        self.breaker = CircuitBreaker(**breaker_config)
+
+        # 进行中的请求数，用于负载均衡
+        self.outstanding = 0
+        # 已从注册表移除，等进行中的请求结束后关闭
+        self.retired = False
+
+        # 最近一次健康探测结果，由后台探测器整体替换
+        self.health = {
+            'status': STATUS_UNKNOWN,
+            'latency_ms': None,
+            'last_checked': None,
+            'last_change': None
+        }
+
+        # 连接复用统计
+        self._requests = 0
+        self._new_connections = 0
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        """httpcore追踪回调，统计成功建立的TCP连接数"""
+        if event_name == 'connection.connect_tcp.complete':
+            self._new_connections += 1
+
+    async def request(
+        self, method: str, endpoint: str, retries: Optional[int] = None, stream: bool = False, **kwargs
+    ) -> httpx.Response:
+        """
+        发送请求到下游服务
+
+        幂等方法在连接失败、超时或网关类错误(502/503/504)时按指数退避重试，
+        非幂等方法(如POST)只发送一次。stream 为True时只读取响应头，响应体由调用方读取并关闭。
+        """
+        method = method.upper()
+        path = f"/{endpoint.lstrip('/')}"
+
+        if retries is None:
+            retries = self.config['max_retries']
+        attempts = retries + 1 if method in IDEMPOTENT_METHODS else 1
+
+        headers = kwargs.pop('headers', None) or {}
+
+        for attempt in range(attempts):
+            is_last = attempt == attempts - 1
+            try:
+                # 向下游传递请求ID与当前span，每次重试为下游根span分配新的ID
+                response = await self.client.send(
+                    self.client.build_request(
+                        method, path, headers={**headers, **trace_headers()}, extensions={'trace': self._trace}, **kwargs
+                    ),
+                    stream=stream
+                )
+            except httpx.TransportError:
+                if is_last:
+                    raise
+            else:
+                self._requests += 1
+                if is_last or response.status_code not in RETRY_STATUS_CODES:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self.config['backoff_factor'] * (2 ** attempt))
+
+    def is_down(self) -> bool:
+        """副本是否在最近一次探测中不可用，尚未探测时视为可用"""
+        return self.health['status'] == STATUS_UNHEALTHY
+
+    def is_available(self) -> bool:
+        """副本当前是否可以接收请求"""
+        return not self.retired and not self.is_down() and not self.breaker.is_open()
+
+    async def _send_tracked(self, method: str, endpoint: str, timeout: float, stream: bool, kwargs: Dict[str, Any]) -> httpx.Response:
+        """
+        发送请求并记录熔断器结果，连接失败与超时统一转换为带中文说明的异常
+
+        调用方需已通过 breaker.allow_request() 获得放行；超时取路由给定值与该接口p99自适应值中的较小者。
+        """
+        route = route_template(endpoint)
+        call_timeout = self.breaker.get_timeout(timeout, route)
+        start_time = time.perf_counter()
+        try:
+            with span(f"proxy {self.name}", replica=self.url, endpoint=endpoint):
+                response = await self.request(method, endpoint, timeout=call_timeout, stream=stream, **kwargs)
+        except httpx.TimeoutException:
+            self.breaker.record_timeout(call_timeout, route)
+            raise Exception("请求超时")
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise Exception("服务连接失败")
+        except (RequestEntityTooLarge, asyncio.CancelledError):
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self.breaker.release()
+            raise Exception(f"请求失败: {str(e)}")
+
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success(time.perf_counter() - start_time, route)
+        return response
+
+    async def call_json(self, method: str, endpoint: str, timeout: float = 30, **kwargs) -> Dict[str, Any]:
+        """发送请求并解析JSON响应"""
+        response = await self._send_tracked(method, endpoint, timeout, False, kwargs)
+        try:
+            response.raise_for_status()
+            return response.json()
+
+        except httpx.HTTPStatusError as e:
+            raise Exception(f"HTTP错误: {e.response.status_code}")
+        except Exception as e:
+            raise Exception(f"请求失败: {str(e)}")
+
+    async def open_raw(self, method: str, endpoint: str, timeout: float = 30, **kwargs) -> httpx.Response:
+        """
+        发送请求并返回尚未读取响应体的2xx响应，由调用方读取并关闭
+
+        非2xx响应关闭后抛出与 call_json 相同的异常，由路由统一包装为错误响应。
+        """
+        response = await self._send_tracked(method, endpoint, timeout, True, kwargs)
+        if not 200 <= response.status_code < 300:
+            await response.aclose()
+            raise Exception(f"HTTP错误: {response.status_code}")
+        return response
+
+    async def call_raw(self, method: str, endpoint: str, timeout: float = 30, **kwargs) -> RelayedResponse:
+        """发送请求并原样读取完整响应，不解析JSON"""
+        response = await self.open_raw(method, endpoint, timeout=timeout, **kwargs)
+        try:
+            body = await _read_raw(response)
+        except httpx.TimeoutException:
+            raise Exception("请求超时")
+        except httpx.TransportError:
+            raise Exception("服务连接失败")
+        return RelayedResponse(response.status_code, _relay_headers(response.headers), body)
+
+    async def check_health(self, timeout: int = HEALTH_CHECK_TIMEOUT) -> bool:
+        """检查下游服务健康状态，不重试"""
+        try:
+            response = await self.request('GET', 'health', retries=0, timeout=timeout)
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """
+        获取连接复用统计
+
+        pool_misses 为新建TCP连接数，pool_hits 为复用已有连接发出的请求数。
+        """
+        pool_hits = max(self._requests - self._new_connections, 0)
+        return {
+            'requests': self._requests,
+            'pool_hits': pool_hits,
+            'pool_misses': self._new_connections,
+            'hit_ratio': round(pool_hits / self._requests, 4) if self._requests > 0 else 0.0
+        }
+
+    def get_status(self) -> Dict[str, Any]:
+        """获取副本状态"""
+        return {
+            'url': self.url,
+            'outstanding': self.outstanding,
+            **self.health,
+            'connection_pool': self.get_pool_stats(),
+            'circuit_breaker': self.breaker.get_state()
+        }
+
+    async def aclose(self):
+        """关闭底层连接池"""
+        await self.client.aclose()
+
+
+class ServiceProxy:
+    """单个下游服务的异步代理，在多个副本之间负载均衡"""
+
+    def __init__(
+        self,
+        name: str,
+        urls: List[str],
+        pool_config: Dict[str, Any],
+        breaker_config: Dict[str, Any],
+        hedging_config: Optional[Dict[str, Any]] = None
+    ):
+        self.name = name
+        self.pool_config = pool_config
+        self.breaker_config = breaker_config
+        self.hedging = HedgingPolicy(**(hedging_config or {}))
+        self.replicas: Dict[str, ReplicaProxy] = {}
+        self._cursor = 0
+        # 正在关闭的副本连接池任务，保留引用直到关闭完成
+        self._closing = set()
+        self.set_replicas(urls)
+
+    def set_replicas(self, urls: List[str]):
+        """更新副本列表：保留已有副本的连接与统计，移除的副本在请求结束后关闭"""
+        current = self.replicas
+        replicas = {}
+        for url in urls:
+            url = url.rstrip('/')
+            replicas[url] = current.get(url) or ReplicaProxy(self.name, url, self.pool_config, self.breaker_config)
+        self.replicas = replicas
+
+        for url, replica in current.items():
+            if url not in replicas:
+                replica.retired = True
+                self._close_if_idle(replica)
+
+    def get_replicas(self) -> List[ReplicaProxy]:
+        """获取当前副本列表"""
+        return list(self.replicas.values())
+
+    def has_available_replica(self) -> bool:
+        """是否存在可接收请求的副本"""
+        return any(replica.is_available() for replica in self.replicas.values())
+
+    def _acquire(self, exclude: Optional[ReplicaProxy] = None) -> ReplicaProxy:
+        """
+        选择进行中请求最少的可用副本
+
+        探测为不可用的副本不参与选择；请求数相同时轮换起点，避免空闲时总是落到第一个副本。
+        """
+        candidates = [
+            replica for replica in self.replicas.values()
+            if not replica.is_down() and replica is not exclude
+        ]
+        if not candidates:
+            raise ServiceUnavailableException(f"{SERVICES[self.name]['name']}暂不可用")
+
+        self._cursor = (self._cursor + 1) % len(candidates)
+        rotated = candidates[self._cursor:] + candidates[:self._cursor]
+        for replica in sorted(rotated, key=lambda item: item.outstanding):
+            if replica.breaker.allow_request():
+                replica.outstanding += 1
+                return replica
+
+        raise ServiceUnavailableException(f"{SERVICES[self.name]['name']}已熔断，暂停调用")
+
+    def _release(self, replica: ReplicaProxy):
+        replica.outstanding -= 1
+        self._close_if_idle(replica)
+
+    def _close_if_idle(self, replica: ReplicaProxy):
+        """已移除的副本没有进行中的请求时关闭其连接池"""
+        if replica.retired and replica.outstanding == 0:
+            task = asyncio.ensure_future(replica.aclose())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    async def _send(
+        self, replica: ReplicaProxy, method: str, endpoint: str, timeout: float, kwargs: Dict[str, Any], relay: bool = False,
+        hedge: bool = False
+    ):
+        """
+        通过已选定的副本发送请求，结束后释放副本；relay 为True时返回原样的响应字节
+
+        只有可对冲的接口(hedge 为True)记录耗时，轮询结果等路径含ID的接口不进入对冲统计。
+        """
+        start_time = time.perf_counter()
+        try:
+            if relay:
+                result = await replica.call_raw(method, endpoint, timeout=timeout, **kwargs)
+            else:
+                result = await replica.call_json(method, endpoint, timeout=timeout, **kwargs)
+        finally:
+            self._release(replica)
+        if hedge and self.hedging.enabled:
+            self.hedging.record_latency(endpoint, time.perf_counter() - start_time)
+        return result
+
+    def _acquire_hedge(self, primary: ReplicaProxy) -> Optional[ReplicaProxy]:
+        """
+        为对冲请求选择主副本以外的副本，没有可用副本或预算不足时返回None
+
+        副本选择失败(如熔断或半开探测名额已被占用)时退还对冲令牌，hedged 只统计实际发出的对冲请求。
+        """
+        if not any(replica is not primary and replica.is_available() for replica in self.replicas.values()):
+            return None
+        if not self.hedging.try_acquire():
+            return None
+        try:
+            return self._acquire(exclude=primary)
+        except ServiceUnavailableException:
+            self.hedging.refund()
+            return None
+
+    async def _hedged_send(
+        self, replica: ReplicaProxy, delay: float, method: str, endpoint: str, timeout: float, kwargs: Dict[str, Any],
+        relay: bool = False
+    ):
+        """
+        主请求超过 delay 秒未返回时向另一副本发送相同请求
+
+        取先成功返回的结果并取消另一个；两者都失败时抛出后失败者的异常。
+        """
+        primary = asyncio.ensure_future(self._send(replica, method, endpoint, timeout, kwargs, relay, hedge=True))
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                hedge_replica = self._acquire_hedge(replica)
+                if hedge_replica is not None:
+                    pending.add(asyncio.ensure_future(
+                        self._send(hedge_replica, method, endpoint, timeout, kwargs, relay, hedge=True)
+                    ))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedging.record_hedge_win()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _relay_streaming(
+        self, replica: ReplicaProxy, method: str, endpoint: str, timeout: float, stream_threshold: int, kwargs: Dict[str, Any]
+    ) -> RelayedResponse:
+        """
+        原样转发响应，响应体超过 stream_threshold 字节或长度未知时边收边发
+
+        流式返回时副本在响应体读完(或客户端断开)后才释放。
+        """
+        try:
+            response = await replica.open_raw(method, endpoint, timeout=timeout, **kwargs)
+        except BaseException:
+            self._release(replica)
+            raise
+
+        headers = _relay_headers(response.headers)
+        content_length = response.headers.get('content-length')
+        if content_length is not None and int(content_length) <= stream_threshold:
+            try:
+                body = await _read_raw(response)
+            finally:
+                self._release(replica)
+            return RelayedResponse(response.status_code, headers, body)
+
+        release = _RelayRelease(self, replica, response)
+        body = self._iter_raw(response, release)
+        weakref.finalize(body, release.close_soon)
+        return RelayedResponse(response.status_code, headers, body)
+
+    async def _iter_raw(self, response: httpx.Response, release: _RelayRelease) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await release.close()
+
+    async def _call(
+        self,
+        method: str,
+        endpoint: str,
+        timeout: float = 30,
+        hedge: bool = False,
+        relay: bool = False,
+        stream_threshold: Optional[int] = None,
+        **kwargs
+    ):
+        """
+        选择副本并发送请求，所有副本熔断或不可用时抛出 ServiceUnavailableException
+
+        hedge 为True且开启对冲时，慢请求会向另一副本发送对冲请求，仅用于无副作用的检测接口。
+        relay 为True时不解析JSON，返回原样的 RelayedResponse；同时给定 stream_threshold 时
+        大响应体边收边发(不对冲)，结果需要被多个请求共享(请求合并)时不能给定。
+        """
+        if relay and stream_threshold is not None:
+            return await self._relay_streaming(self._acquire(), method, endpoint, timeout, stream_threshold, kwargs)
+
+        delay = self.hedging.hedge_delay(endpoint) if hedge else None
+        if delay is None:
+            return await self._send(self._acquire(), method, endpoint, timeout, kwargs, relay, hedge=hedge)
+
+        # 对冲请求需要重新发送请求体，上传文件先读为字节
+        if kwargs.get('files'):
+            kwargs['files'] = {
+                field_name: (filename, stream if isinstance(stream, bytes) else stream.read(), content_type)
+                for field_name, (filename, stream, content_type) in kwargs['files'].items()
+            }
+        return await self._hedged_send(self._acquire(), delay, method, endpoint, timeout, kwargs, relay)
+
+    async def call(
+        self,
+        endpoint: str,
+        method: str = "POST",
+        data: Optional[Dict] = None,
+        files: Optional[Dict] = None,
+        timeout: int = 30,
+        hedge: bool = False,
+        relay: bool = False,
+        stream_threshold: Optional[int] = None
+    ) -> Union[Dict[str, Any], RelayedResponse]:
+        """
+        调用下游服务API
+
+        hedge 表示允许对冲(仅用于无副作用的接口)；relay 为True时返回原样的下游响应而不解析JSON。
+        """
+        method = method.upper()
+        options = {'timeout': timeout, 'hedge': hedge, 'relay': relay, 'stream_threshold': stream_threshold}
+
+        if method == "POST":
+            if files:
+                return await self._call("POST", endpoint, data=data, files=files, **options)
+            return await self._call("POST", endpoint, json=data, **options)
+        elif method == "GET":
+            return await self._call("GET", endpoint, params=data, **options)
+
+        raise Exception(f"请求失败: 不支持的HTTP方法: {method}")
+
+    async def stream(
+        self,
+        endpoint: str,
+        body: AsyncIterable[bytes],
+        content_type: str,
+        content_length: Optional[int] = None,
+        timeout: int = 30,
+        relay: bool = False,
+        stream_threshold: Optional[int] = None
+    ) -> Union[Dict[str, Any], RelayedResponse]:
+        """
+        流式转发请求体到下游服务
+
+        原样转发上游的请求体和Content-Type(含multipart boundary)，边收边发；
+        长度未知时使用分块传输编码。relay 与 stream_threshold 含义同 call。
+        """
+        headers = {'Content-Type': content_type}
+        if content_length is not None:
+            headers['Content-Length'] = str(content_length)
+
+        return await self._call(
+            "POST", endpoint, content=body, headers=headers, timeout=timeout,
+            relay=relay, stream_threshold=stream_threshold
+        )
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """获取所有副本状态"""
+        return [replica.get_status() for replica in self.replicas.values()]
+
+    async def aclose(self):
+        """关闭所有副本的连接池"""
+        replicas = list(self.replicas.values())
+        self.replicas = {}
+        await asyncio.gather(
+            *(replica.aclose() for replica in replicas), *self._closing,
+            return_exceptions=True
+        )
+
+
+# 全局代理实例，按服务名索引
+_service_proxies: Dict[str, ServiceProxy] = {}
+
+
+def get_service_proxy(service_name: str) -> ServiceProxy:
+    """获取下游服务代理实例，首次使用时创建"""
+    proxy = _service_proxies.get(service_name)
+    if proxy is None:
+        replicas = get_service_registry().get_replicas(service_name)
+        proxy = ServiceProxy(service_name, replicas, HTTP_POOL_CONFIG, CIRCUIT_BREAKER_CONFIG, HEDGING_CONFIG)
+        _service_proxies[service_name] = proxy
+    return proxy
+
+
+def sync_service_replicas() -> bool:
+    """副本配置文件变化时重新加载，并更新所有服务代理的副本列表"""
+    registry = get_service_registry()
+    if not registry.reload_if_changed():
+        return False
+    for service_name in SERVICES:
+        get_service_proxy(service_name).set_replicas(registry.get_replicas(service_name))
+    return True
+
+
+async def close_service_proxies():
+    """关闭所有下游服务代理"""
+    proxies = list(_service_proxies.values())
+    _service_proxies.clear()
+    await asyncio.gather(*(proxy.aclose() for proxy in proxies), return_exceptions=True)
@@ -0,0 +1,103 @@
+"""
+下游服务注册表
+维护每个服务的副本地址列表，支持从配置文件热加载
+"""
+import os
+import json
+import logging
+from typing import Dict, List, Optional
+
+from config import SERVICES, SERVICE_REGISTRY_FILE
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_urls(urls) -> List[str]:
+    """去掉末尾斜杠并按出现顺序去重"""
+    if isinstance(urls, str):
+        urls = [urls]
+    normalized = []
+    for url in urls:
+        url = str(url).strip().rstrip('/')
+        if url and url not in normalized:
+            normalized.append(url)
+    return normalized
+
+
+class ServiceRegistry:
+    """服务副本注册表"""
+
+    def __init__(self, registry_file: Optional[str] = SERVICE_REGISTRY_FILE):
+        self.registry_file = registry_file or None
+        self._mtime: Optional[float] = None
+        self._replicas: Dict[str, List[str]] = self._defaults()
+        self.reload_if_changed()
+
+    def _defaults(self) -> Dict[str, List[str]]:
+        return {
+            service_name: _normalize_urls(service_config['replicas'])
+            for service_name, service_config in SERVICES.items()
+        }
+
+    def reload_if_changed(self) -> bool:
+        """
+        配置文件修改后重新加载，返回副本列表是否发生变化
+
+        文件不存在或格式错误时保留当前列表。
+        """
+        if not self.registry_file:
+            return False
+
+        try:
+            mtime = os.stat(self.registry_file).st_mtime
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        try:
+            with open(self.registry_file, 'r', encoding='utf-8') as f:
+                loaded = json.load(f)
+        except Exception as e:
+            logger.warning(f"读取副本配置文件失败 {self.registry_file}: {e}")
+            return False
+        if not isinstance(loaded, dict):
+            logger.warning(f"副本配置文件格式错误 {self.registry_file}: 顶层应为 服务名 -> 副本地址列表 的对象")
+            return False
+
+        replicas = self._defaults()
+        for service_name, urls in loaded.items():
+            if service_name not in SERVICES:
+                logger.warning(f"副本配置文件中存在未知服务: {service_name}")
+                continue
+            if not isinstance(urls, (str, list)):
+                logger.warning(f"服务 {service_name} 的副本配置应为地址或地址列表，保留默认配置")
+                continue
+            urls = _normalize_urls(urls)
+            if not urls:
+                logger.warning(f"服务 {service_name} 的副本列表为空，保留默认配置")
+                continue
+            replicas[service_name] = urls
+
+        changed = replicas != self._replicas
+        self._replicas = replicas
+        if changed:
+            logger.info(f"已重新加载副本配置: {self.registry_file}")
+        return changed
+
+    def get_replicas(self, service_name: str) -> List[str]:
+        """获取服务的副本地址列表"""
+        return list(self._replicas[service_name])
+
+
+# 全局注册表实例
+_service_registry = None
+
+
+def get_service_registry() -> ServiceRegistry:
+    """获取服务注册表实例 (单例模式)"""
+    global _service_registry
+    if _service_registry is None:
+        _service_registry = ServiceRegistry()
+    return _service_registry
@@ -3,20 +3,154 @@ API网关路由
 """
 import sys
 import os
+import io
+import json
+import time
+import uuid
+import asyncio
+import zipfile
+import mimetypes
+import weakref
+from datetime import datetime
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-import requests
-from flask import Blueprint, request, jsonify
+from quart import Blueprint, Response, request
 from werkzeug.exceptions import RequestEntityTooLarge
 from shared.response_models import APIResponse
-from shared.utils import call_service_api, check_service_health
-from config import SERVICES
+from proxy import RelayedResponse, get_service_proxy
+from health import get_health_prober
+from admission import (
+    AdmissionRejected, AdmissionSlot, admission_control, get_admission_controller, get_admission_stats,
+    rejection_response, request_deadline
+)
+from singleflight import get_single_flight, content_key, json_key, stream_digest
+from shared.tracing import current_request_id, start_trace, finish_trace, span
+from config import (
+    SERVICES, STREAMING_PROXY_ENABLED, SINGLE_FLIGHT_ENABLED, SINGLE_FLIGHT_MAX_UPLOAD_BYTES, MULTIMODAL_TIMEOUTS,
+    ADMISSION_CONTROL_ENABLED,
+    PASSTHROUGH_ENABLED, PASSTHROUGH_STREAM_THRESHOLD,
+    BATCH_MAX_IMAGES, BATCH_CONCURRENCY, BATCH_IMAGE_TIMEOUT, BATCH_ALLOWED_EXTENSIONS
+)
 
 api = Blueprint('api', __name__)
 
 
+def _unavailable_message(service_name: str):
+    """服务的所有副本均熔断或最近一次健康探测不可用时返回原因，否则返回None"""
+    proxy = get_service_proxy(service_name)
+    if proxy.has_available_replica():
+        return None
+
+    open_breakers = [replica.breaker for replica in proxy.get_replicas() if replica.breaker.is_open()]
+    if open_breakers:
+        for breaker in open_breakers:
+            breaker.count_rejection()
+        return f"{SERVICES[service_name]['name']}已熔断，暂停调用"
+    return f"{SERVICES[service_name]['name']}暂不可用"
+
+
+def _unavailable_response(service_name: str):
+    """服务不可用时直接返回503，不再等待下游超时"""
+    message = _unavailable_message(service_name)
+    if message:
+        return APIResponse.error(message=message, code=503).to_dict(), 503
+    return None
+
+
+def _use_streaming_proxy() -> bool:
+    """multipart上传是否走流式转发"""
+    return STREAMING_PROXY_ENABLED and request.mimetype == 'multipart/form-data'
+
+
+def _relay_options(stream_body: bool) -> dict:
+    """
+    开启响应透传时的代理参数
+
+    stream_body 为False时完整读取响应体，用于结果需要共享(请求合并)或对冲的检测接口。
+    """
+    if not PASSTHROUGH_ENABLED:
+        return {}
+    return {'relay': True, 'stream_threshold': PASSTHROUGH_STREAM_THRESHOLD if stream_body else None}
+
+
+def _to_response(result):
+    """透传的下游响应直接返回原始字节，其余结果由Quart序列化为JSON"""
+    if not isinstance(result, RelayedResponse):
+        return result
+    response = Response(result.body, status=result.status_code, headers=result.headers)
+    if not isinstance(result.body, bytes):
+        # 大响应体边收边发，耗时由下游调用超时约束
+        response.timeout = None
+    return response
+
+
+async def _stream_upload(service_name: str, endpoint: str = 'detect'):
+    """将multipart请求体原样流式转发到下游服务，不在网关解析文件"""
+    return _to_response(await get_service_proxy(service_name).stream(
+        endpoint=endpoint,
+        body=request.body,
+        content_type=request.content_type,
+        content_length=request.content_length,
+        **_relay_options(True)
+    ))
+
+
+async def _collect_upload(field_name: str, default_filename: str, default_content_type: str):
+    """解析multipart表单，返回待转发的文件和表单字段"""
+    files = {}
+    data = {}
+    
+    request_files = await request.files
+    if field_name in request_files:
+        uploaded_file = request_files[field_name]
+        # 重置文件流位置并准备转发
+        uploaded_file.seek(0)
+        files[field_name] = (
+            uploaded_file.filename or default_filename,
+            uploaded_file.stream,
+            uploaded_file.content_type or default_content_type
+        )
+    
+    # 获取其他表单数据
+    for key, value in (await request.form).items():
+        data[key] = value
+    
+    return files, data
+
+
+def _upload_key(service_name: str, endpoint: str, files: dict, data: dict) -> str:
+    """根据上传文件内容和表单字段计算合并键，与文件名及multipart边界无关"""
+    parts = []
+    for field_name in sorted(files):
+        parts.append(field_name.encode('utf-8'))
+        parts.append(stream_digest(files[field_name][1]))
+    for key in sorted(data):
+        parts.append(f"{key}={data[key]}".encode('utf-8'))
+    return content_key(f"{service_name}/{endpoint}", *parts)
+
+
+async def _coalesce(key: str, call):
+    """开启请求合并时，相同内容的并发请求共享同一次下游调用"""
+    if SINGLE_FLIGHT_ENABLED:
+        return await get_single_flight().do(key, call)
+    return await call()
+
+
+def _coalesce_upload() -> bool:
+    """
+    单张上传是否参与请求合并
+
+    合并需要在网关解析上传并读取图片计算哈希，只对长度已知且不超过 SINGLE_FLIGHT_MAX_UPLOAD_BYTES 的请求体开启，
+    大文件仍边接收边转发。
+    """
+    if not SINGLE_FLIGHT_ENABLED:
+        return False
+    length = request.content_length
+    return length is not None and length <= SINGLE_FLIGHT_MAX_UPLOAD_BYTES
+
+
 @api.route('/health', methods=['GET'])
-def health_check():
+async def health_check():
     """网关健康检查"""
     return APIResponse.success(
         data={"status": "healthy", "service": "API Gateway"}
@@ -24,38 +158,54 @@ def health_check():
 
 
 @api.route('/services/status', methods=['GET'])
-def services_status():
+async def services_status():
     """获取所有微服务状态"""
     services_health = {}
     
+    # 直接读取后台探测的快照，不在请求路径上探测
+    snapshot = get_health_prober().get_snapshot()
+    
     for service_name, service_config in SERVICES.items():
-        is_healthy = check_service_health(service_config['url'])
         services_health[service_name] = {
             'name': service_config['name'],
-            'url': service_config['url'],
-            'status': 'healthy' if is_healthy else 'unhealthy'
+            **snapshot[service_name],
+            'replicas': get_service_proxy(service_name).get_status(),
+            'hedging': get_service_proxy(service_name).hedging.get_stats()
         }
     
     return APIResponse.success(
-        data={"services": services_health}
+        data={
+            "services": services_health,
+            "single_flight": get_single_flight().get_stats(),
+            "admission": get_admission_stats()
+        }
     ).to_dict()
 
 
 @api.route('/api/v1/rumor/detect', methods=['POST'])
-def rumor_detection():
+@admission_control('rumor_detect')
+async def rumor_detection():
     """图文谣言检测代理"""
     try:
-        service_url = SERVICES['rumor_detection']['url']
+        unavailable = _unavailable_response('rumor_detection')
+        if unavailable:
+            return unavailable
+        
+        payload = await request.get_json()
         
         # 转发请求到谣言检测服务
-        response = call_service_api(
-            service_url=service_url,
-            endpoint='detect',
-            method='POST',
-            data=request.get_json()
+        response = await _coalesce(
+            json_key('rumor_detection/detect', payload),
+            lambda: get_service_proxy('rumor_detection').call(
+                endpoint='detect',
+                method='POST',
+                data=payload,
+                hedge=True,
+                **_relay_options(False)
+            )
         )
         
-        return response
+        return _to_response(response)
         
     except Exception as e:
         return APIResponse.error(
@@ -65,40 +215,42 @@ def rumor_detection():
 
 
 @api.route('/api/v1/ai-image/detect', methods=['POST'])
-def ai_image_detection():
+@admission_control('ai_image_detect')
+async def ai_image_detection():
     """AI图像检测代理"""
     try:
-        service_url = SERVICES['ai_image_detection']['url']
+        unavailable = _unavailable_response('ai_image_detection')
+        if unavailable:
+            return unavailable
         
-        # 处理文件上传
-        files = {}
-        data = {}
-        
-        if 'image' in request.files:
-            uploaded_file = request.files['image']
-            # 重置文件流位置并准备转发
-            uploaded_file.seek(0)
-            files['image'] = (
-                uploaded_file.filename or 'image.png',
-                uploaded_file.stream,
-                uploaded_file.content_type or 'image/png'
-            )
+        # 小请求体先读取图片内容计算哈希以合并相同请求，其余上传流式转发
+        coalesce = _coalesce_upload()
+        if _use_streaming_proxy() and not coalesce:
+            return await _stream_upload('ai_image_detection')
         
-        # 获取其他表单数据
-        for key, value in request.form.items():
-            data[key] = value
+        # 处理文件上传
+        files, data = await _collect_upload('image', 'image.png', 'image/png')
         
         # 转发请求到AI图像检测服务
-        response = call_service_api(
-            service_url=service_url,
-            endpoint='detect',
-            method='POST',
-            data=data,
-            files=files
-        )
+        def call():
+            return get_service_proxy('ai_image_detection').call(
+                endpoint='detect',
+                method='POST',
+                data=data,
+                files=files,
+                hedge=True,
+                **_relay_options(False)
+            )
         
-        return response
+        if coalesce:
+            response = await _coalesce(_upload_key('ai_image_detection', 'detect', files, data), call)
+        else:
+            response = await call()
+        
+        return _to_response(response)
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return APIResponse.error(
             message=f"AI图像检测服务异常: {str(e)}",
@@ -107,18 +259,20 @@ def ai_image_detection():
 
 
 @api.route('/api/v1/ai-image/result/<task_id>', methods=['GET'])
-def ai_image_result(task_id):
+async def ai_image_result(task_id):
     """获取AI图像检测结果"""
     try:
-        service_url = SERVICES['ai_image_detection']['url']
+        unavailable = _unavailable_response('ai_image_detection')
+        if unavailable:
+            return unavailable
         
-        response = call_service_api(
-            service_url=service_url,
+        response = await get_service_proxy('ai_image_detection').call(
             endpoint=f'result/{task_id}',
-            method='GET'
+            method='GET',
+            **_relay_options(True)
         )
         
-        return response
+        return _to_response(response)
         
     except Exception as e:
         return APIResponse.error(
@@ -127,32 +281,311 @@ def ai_image_result(task_id):
         ).to_dict(), 503
 
 
+def _allowed_image(filename: str) -> bool:
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in BATCH_ALLOWED_EXTENSIONS
+
+
+def _batch_images(request_files):
+    """
+    收集批量检测的图片，返回 [(文件名, 打开函数, Content-Type)]
+
+    支持多文件上传(images)和ZIP压缩包(zip_file)；ZIP内的图片在转发时才读取，
+    网关同一时间只在内存中保留正在转发的几张图片。
+    """
+    if 'zip_file' in request_files:
+        archive = zipfile.ZipFile(request_files['zip_file'].stream)
+        images = []
+        for member in archive.infolist():
+            filename = os.path.basename(member.filename)
+            if member.is_dir() or not _allowed_image(filename) or member.filename.startswith('__MACOSX/'):
+                continue
+            images.append((
+                filename,
+                lambda name=member.filename: io.BytesIO(archive.read(name)),
+                mimetypes.guess_type(filename)[0] or 'image/png'
+            ))
+        return images
+
+    images = []
+    for uploaded_file in request_files.getlist('images'):
+        if not uploaded_file.filename or not _allowed_image(uploaded_file.filename):
+            continue
+        stream = uploaded_file.stream
+
+        def open_image(stream=stream):
+            stream.seek(0)
+            return stream
+
+        images.append((uploaded_file.filename, open_image, uploaded_file.content_type or 'image/png'))
+    return images
+
+
+async def _detect_batch_image(index: int, filename: str, open_image, content_type: str):
+    """批量检测中的单张图片，失败只影响本张结果"""
+    start_time = time.perf_counter()
+    try:
+        files = {'image': (filename, open_image(), content_type)}
+        result = await asyncio.wait_for(
+            _coalesce(
+                _upload_key('ai_image_detection', 'detect', files, {}),
+                lambda: get_service_proxy('ai_image_detection').call(
+                    endpoint='detect',
+                    method='POST',
+                    files=files,
+                    timeout=BATCH_IMAGE_TIMEOUT,
+                    hedge=True
+                )
+            ),
+            timeout=BATCH_IMAGE_TIMEOUT
+        )
+        item = {'index': index, 'filename': filename, 'status': 'success', **result}
+    except asyncio.TimeoutError:
+        item = {'index': index, 'filename': filename, 'status': 'failed', 'error': "检测超时"}
+    except Exception as e:
+        item = {'index': index, 'filename': filename, 'status': 'failed', 'error': str(e)}
+
+    item['latency_ms'] = round((time.perf_counter() - start_time) * 1000, 2)
+    return item
+
+
+def _format_event(event: str, payload: dict, sse: bool) -> bytes:
+    """NDJSON每行一个JSON对象(event字段区分类型)；SSE使用 event/data 字段"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode('utf-8')
+    return (json.dumps({'event': event, **payload}, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+async def _stream_batch(images: list, job: dict, sse: bool, slot, request_id: str):
+    """并发检测批量图片，按完成顺序逐条推送结果，结束时推送汇总并释放准入名额"""
+    start_time = time.perf_counter()
+    # 响应体在请求上下文结束后才开始发送，需在此处沿用请求ID继续追踪
+    start_trace(request_id, 'gateway')
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def detect(index, filename, open_image, content_type):
+        async with semaphore:
+            return await _detect_batch_image(index, filename, open_image, content_type)
+
+    tasks = [
+        asyncio.ensure_future(detect(index, *image))
+        for index, image in enumerate(images)
+    ]
+    counts = {'success': 0, 'failed': 0, 'real': 0, 'fake': 0}
+    try:
+        with span('batch ai_image_detection', total_images=len(images)):
+            yield _format_event('start', {**job, 'total_images': len(images)}, sse)
+            for next_result in asyncio.as_completed(tasks):
+                item = await next_result
+                counts[item['status']] += 1
+                if item.get('prediction') in ('real', 'fake'):
+                    counts[item['prediction']] += 1
+                yield _format_event('result', item, sse)
+
+        yield _format_event('end', {
+            'id': job['id'],
+            'status': 'completed',
+            'total_images': len(images),
+            'processed_images': counts['success'] + counts['failed'],
+            'real_count': counts['real'],
+            'ai_count': counts['fake'],
+            'success_count': counts['success'],
+            'failed_count': counts['failed'],
+            'elapsed_ms': round((time.perf_counter() - start_time) * 1000, 2)
+        }, sse)
+    finally:
+        # 客户端提前断开时取消尚未完成的检测
+        for task in tasks:
+            task.cancel()
+        if slot is not None:
+            slot.release()
+        finish_trace()
+
+
+@api.route('/api/v1/ai-image/detect/batch', methods=['POST'])
+async def ai_image_batch_detection():
+    """
+    AI图像批量检测
+
+    每张图片完成后立即推送一条结果，默认为NDJSON(application/x-ndjson)，
+    请求头 Accept: text/event-stream 或参数 format=sse 时使用SSE。
+    准入名额在整批结果推送完毕或响应体被丢弃后才释放，因此不使用 admission_control 装饰器。
+    """
+    try:
+        unavailable = _unavailable_response('ai_image_detection')
+        if unavailable:
+            return unavailable
+        
+        request_files = await request.files
+        if 'zip_file' not in request_files and 'images' not in request_files:
+            return APIResponse.error(message="请提供ZIP文件或图像文件", code=400).to_dict(), 400
+        
+        try:
+            images = _batch_images(request_files)
+        except zipfile.BadZipFile:
+            return APIResponse.error(message="ZIP文件格式错误", code=400).to_dict(), 400
+        
+        if not images:
+            return APIResponse.error(message="未找到有效图像文件", code=400).to_dict(), 400
+        if len(images) > BATCH_MAX_IMAGES:
+            return APIResponse.error(
+                message=f"图像数量超过限制 ({BATCH_MAX_IMAGES})",
+                code=400
+            ).to_dict(), 400
+        
+        job = {
+            'id': str(uuid.uuid4()),
+            'name': (await request.form).get('name') or f"批量任务_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            'created_at': datetime.now().isoformat()
+        }
+        sse = request.args.get('format') == 'sse' or request.accept_mimetypes.best == 'text/event-stream'
+        
+        slot = None
+        if ADMISSION_CONTROL_ENABLED:
+            controller = get_admission_controller('ai_image_batch')
+            try:
+                await controller.acquire(request_deadline())
+            except AdmissionRejected as e:
+                return rejection_response(e)
+            slot = AdmissionSlot(controller)
+        
+        body = _stream_batch(images, job, sse, slot, current_request_id())
+        if slot is not None:
+            # 客户端在响应体开始发送前断开时生成器从未运行，不会执行其中的finally，由生成器被回收时释放名额
+            weakref.finalize(body, slot.release)
+        response = Response(body, content_type='text/event-stream' if sse else 'application/x-ndjson')
+        # 整批耗时可能超过默认响应超时，由单张图片超时和准入截止时间约束
+        response.timeout = None
+        # 禁止反向代理缓冲，保证结果逐条到达客户端
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        return APIResponse.error(
+            message=f"AI图像批量检测服务异常: {str(e)}",
+            code=503
+        ).to_dict(), 503
+
+
+async def _detect_part(service_name: str, files: dict, data: dict):
+    """多模态检测中的单个子检测，超时或失败只影响本部分结果"""
+    start_time = time.perf_counter()
+    timeout = MULTIMODAL_TIMEOUTS[service_name]
+
+    message = _unavailable_message(service_name)
+    if message:
+        return {'success': False, 'message': message}
+
+    try:
+        result = await asyncio.wait_for(
+            _coalesce(
+                _upload_key(service_name, 'detect', files, data),
+                lambda: get_service_proxy(service_name).call(
+                    endpoint='detect',
+                    method='POST',
+                    data=data,
+                    files=files,
+                    timeout=timeout,
+                    hedge=True
+                )
+            ),
+            timeout=timeout
+        )
+        part = {'success': True, 'data': result}
+    except asyncio.TimeoutError:
+        part = {'success': False, 'timed_out': True, 'message': f"{SERVICES[service_name]['name']}响应超时"}
+    except Exception as e:
+        part = {'success': False, 'message': f"{SERVICES[service_name]['name']}异常: {str(e)}"}
+
+    part['latency_ms'] = round((time.perf_counter() - start_time) * 1000, 2)
+    return part
+
+
+@api.route('/api/v1/multimodal/detect', methods=['POST'])
+@admission_control('multimodal_detect')
+async def multimodal_detection():
+    """多模态检测：一次上传图文，并发调用谣言检测与AI图像检测并合并结果"""
+    try:
+        request_files = await request.files
+        if 'image' not in request_files:
+            return APIResponse.error(message="请上传图片", code=400).to_dict(), 400
+        
+        uploaded_file = request_files['image']
+        image_bytes = uploaded_file.read()
+        filename = uploaded_file.filename or 'image.png'
+        content_type = uploaded_file.content_type or 'image/png'
+        content = (await request.form).get('content', '').strip()
+        
+        # 每个子检测使用独立的文件对象，并发读取互不影响
+        def image_files():
+            return {'image': (filename, io.BytesIO(image_bytes), content_type)}
+        
+        # AI图像部分的合并键与 /api/v1/ai-image/detect 相同，可与单独的检测请求合并；
+        # 谣言部分同时提交图片与文本，与只提交JSON文本的 /api/v1/rumor/detect 请求内容不同，只在多模态请求之间合并
+        parts = {'ai_image_detection': _detect_part('ai_image_detection', image_files(), {})}
+        # 谣言检测需要文本内容，未提供时只做AI图像检测
+        if content:
+            parts['rumor_detection'] = _detect_part('rumor_detection', image_files(), {'content': content})
+        
+        results = dict(zip(parts, await asyncio.gather(*parts.values())))
+        if not content:
+            results['rumor_detection'] = {'success': False, 'skipped': True, 'message': "未提供文本内容，跳过谣言检测"}
+        
+        completed = sum(1 for service_name in parts if results[service_name]['success'])
+        if completed == 0:
+            return APIResponse.error(
+                message="多模态检测失败",
+                code=503,
+                errors=results
+            ).to_dict(), 503
+        
+        return APIResponse.success(
+            data={
+                'results': results,
+                'completed': completed,
+                'total': len(parts)
+            },
+            message="检测完成" if completed == len(parts) else "部分检测完成"
+        ).to_dict()
+        
+    except RequestEntityTooLarge:
+        raise
+    except Exception as e:
+        return APIResponse.error(
+            message=f"多模态检测服务异常: {str(e)}",
+            code=503
+        ).to_dict(), 503
+
+
 @api.route('/api/v1/video-analysis/module1/detect', methods=['POST'])
-def video_analysis_module1():
+@admission_control('video_module1_detect')
+async def video_analysis_module1():
     """视频分析模块1代理"""
     try:
-        service_url = SERVICES['video_analysis_module1']['url']
+        unavailable = _unavailable_response('video_analysis_module1')
+        if unavailable:
+            return unavailable
         
-        # 处理文件上传
-        files = {}
-        data = {}
+        if _use_streaming_proxy():
+            return await _stream_upload('video_analysis_module1')
         
-        if 'video' in request.files:
-            files['video'] = request.files['video']
-        
-        for key, value in request.form.items():
-            data[key] = value
+        # 处理文件上传
+        files, data = await _collect_upload('video', 'video.mp4', 'video/mp4')
         
-        response = call_service_api(
-            service_url=service_url,
+        response = await get_service_proxy('video_analysis_module1').call(
             endpoint='detect',
             method='POST',
             data=data,
-            files=files
+            files=files,
+            **_relay_options(True)
         )
         
-        return response
+        return _to_response(response)
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return APIResponse.error(
             message=f"视频分析模块1服务异常: {str(e)}",
@@ -161,31 +594,32 @@ def video_analysis_module1():
 
 
 @api.route('/api/v1/video-analysis/module2/detect', methods=['POST'])
-def video_analysis_module2():
+@admission_control('video_module2_detect')
+async def video_analysis_module2():
     """视频分析模块2代理"""
     try:
-        service_url = SERVICES['video_analysis_module2']['url']
+        unavailable = _unavailable_response('video_analysis_module2')
+        if unavailable:
+            return unavailable
         
-        # 处理文件上传
-        files = {}
-        data = {}
-        
-        if 'video' in request.files:
-            files['video'] = request.files['video']
+        if _use_streaming_proxy():
+            return await _stream_upload('video_analysis_module2')
         
-        for key, value in request.form.items():
-            data[key] = value
+        # 处理文件上传
+        files, data = await _collect_upload('video', 'video.mp4', 'video/mp4')
         
-        response = call_service_api(
-            service_url=service_url,
+        response = await get_service_proxy('video_analysis_module2').call(
             endpoint='detect',
             method='POST',
             data=data,
-            files=files
+            files=files,
+            **_relay_options(True)
         )
         
-        return response
+        return _to_response(response)
         
+    except RequestEntityTooLarge:
+        raise
     except Exception as e:
         return APIResponse.error(
             message=f"视频分析模块2服务异常: {str(e)}",
@@ -193,11 +627,8 @@ def video_analysis_module2():
         ).to_dict(), 503
 
 
-
-
-
 @api.errorhandler(RequestEntityTooLarge)
-def handle_file_too_large(e):
+async def handle_file_too_large(e):
     """处理文件过大错误"""
     return APIResponse.error(
         message="上传文件过大",
@@ -206,12 +637,12 @@ def handle_file_too_large(e):
 
 
 @api.errorhandler(404)
-def handle_not_found(e):
+async def handle_not_found(e):
     """处理404错误"""
     return APIResponse.not_found("接口不存在").to_dict(), 404
 
 
 @api.errorhandler(500)
-def handle_server_error(e):
+async def handle_server_error(e):
     """处理500错误"""
     return APIResponse.server_error("服务器内部错误").to_dict(), 500 
\ No newline at end of file
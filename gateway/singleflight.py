@@ -0,0 +1,91 @@
+"""
+请求合并 (single-flight)
+内容相同的并发请求只向下游发起一次调用，所有等待者共享同一结果
+"""
+import asyncio
+import hashlib
+import json
+from typing import Dict, Any, Callable, Awaitable
+
+
+def content_key(namespace: str, *parts: bytes) -> str:
+    """根据请求内容计算合并键"""
+    digest = hashlib.sha256(namespace.encode('utf-8'))
+    for part in parts:
+        # 写入长度前缀，避免不同分段拼接后产生相同的字节串
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def stream_digest(stream, chunk_size: int = 64 * 1024) -> bytes:
+    """按块计算文件流的摘要并将位置重置到开头，不把整个文件复制到内存"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.digest()
+
+
+def json_key(namespace: str, payload: Any) -> str:
+    """根据JSON请求体计算合并键，字段顺序不影响结果"""
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return content_key(namespace, encoded)
+
+
+class SingleFlight:
+    """按键合并进行中的下游调用"""
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+        # 统计信息
+        self._executed = 0
+        self._coalesced = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行或加入键对应的调用
+
+        调用在独立任务中运行，发起者断开连接不会取消其他等待者共享的调用。
+        """
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._coalesced += 1
+        else:
+            self._executed += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda finished: self._on_done(key, finished))
+
+        return await asyncio.shield(task)
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        """调用结束后移除键，后续请求重新发起调用"""
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # 标记异常已读取，等待者全部断开时不会产生未处理异常的警告
+        if not task.cancelled():
+            task.exception()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计"""
+        total = self._executed + self._coalesced
+        return {
+            'in_flight': len(self._in_flight),
+            'executed': self._executed,
+            'coalesced': self._coalesced,
+            'coalesced_ratio': round(self._coalesced / total, 4) if total > 0 else 0.0
+        }
+
+
+# 全局实例
+_single_flight = None
+
+
+def get_single_flight() -> SingleFlight:
+    """获取请求合并实例 (单例模式)"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -1,23 +1,40 @@
-from flask import Flask, request, jsonify, send_file, send_from_directory, abort
-from flask_cors import CORS
+import sys
 import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from flask import Flask, request, jsonify, send_file, abort
+from flask_cors import CORS
+import io
 import tempfile
 import logging
 import uuid
 import time
-from PIL import Image
+from torchvision import transforms
 import torch
 import zipfile
 from datetime import datetime
 from werkzeug.utils import secure_filename
 import shutil  # 添加shutil模块
 
-from safe_model import SAFEModel
+from safe_model import SAFEModel, InferenceContext
 from heatmap_generator import HeatmapGenerator
+from result_cache import ResultCache
+from batch_pipeline import get_batch_pipeline
+from decoded_image import DecodedImage
+from heatmap_cache import HeatmapCache
 from config import Config
+from shared.metrics import register_flask_metrics, observe_inference, INFERENCE_DURATION
+from shared.tracing import register_flask_tracing, span
+from shared.imaging import decode_image
 
 app = Flask(__name__)
 
+# 请求与推理指标，GET /metrics
+register_flask_metrics(app, 'ai_image_detection')
+
+# 请求ID与链路追踪
+register_flask_tracing(app, 'ai_image_detection')
+
 # 配置CORS，允许前端访问
 CORS(app, resources={
     r"/*": {
@@ -27,12 +44,15 @@ CORS(app, resources={
     }
 })
 
-# 新增：提供热力图静态访问路由
+# 新增：提供热力图访问路由，首次访问时渲染
 @app.route('/heatmap/<filename>')
 def serve_heatmap(filename):
-    heatmap_dir = 'heatmaps'
-    logger.info(f"尝试访问热力图: {filename}, 目录: {heatmap_dir}")
-    return send_from_directory(heatmap_dir, filename)
+    logger.info(f"尝试访问热力图: {filename}")
+    # 配置了共享目录时，本进程未登记的热力图从共享目录读取其他进程登记的来源或渲染结果
+    data = heatmap_cache.get(filename, render_heatmap)
+    if data is None:
+        abort(404)
+    return send_file(io.BytesIO(data), mimetype='image/jpeg')
 
 # 新增：提供批量任务图片访问路由
 @app.route('/batch/<job_id>/image/<filename>')
@@ -60,11 +80,31 @@ logger = logging.getLogger(__name__)
 safe_model = None
 heatmap_generator = None
 
+# 检测结果缓存
+result_cache = ResultCache(
+    max_memory_items=Config.RESULT_CACHE_MEMORY_ITEMS,
+    disk_dir=Config.RESULT_CACHE_DISK_DIR,
+    max_disk_items=Config.RESULT_CACHE_DISK_ITEMS
+) if Config.RESULT_CACHE_ENABLED else None
+
+# 热力图来源登记与渲染结果缓存
+heatmap_cache = HeatmapCache(
+    max_rendered_bytes=Config.HEATMAP_CACHE_MAX_BYTES,
+    max_source_bytes=Config.HEATMAP_SOURCE_MAX_BYTES,
+    shared_dir=Config.HEATMAP_SHARED_DIR,
+    max_shared_bytes=Config.HEATMAP_SHARED_MAX_BYTES,
+    shared_ttl=Config.HEATMAP_SHARED_TTL
+)
+
 def init_model():
     """初始化SAFE模型"""
     global safe_model, heatmap_generator
     try:
-        safe_model = SAFEModel(Config.MODEL_PATH, Config.DEVICE)
+        safe_model = SAFEModel(
+            Config.MODEL_PATH, Config.DEVICE, Config.MICRO_BATCH_MAX_SIZE, Config.MICRO_BATCH_MAX_WAIT_MS,
+            Config.SAVE_DEBUG_PATCH, Config.ENERGY_TILE_ROWS, Config.INFERENCE_PRECISION,
+            Config.QUANT_CALIBRATION_DIR, Config.QUANT_CALIBRATION_SAMPLES
+        )
         heatmap_generator = HeatmapGenerator(safe_model)
         logger.info("SAFE模型初始化成功")
         return True
@@ -74,32 +114,74 @@ def init_model():
         logger.error("如果模型文件不存在，服务将使用启发式方法进行检测")
         # 即使模型加载失败，也不将模型设置为None，使用启发式方法
         if safe_model is None:
-            safe_model = SAFEModel(Config.MODEL_PATH, Config.DEVICE)
+            safe_model = SAFEModel(
+                Config.MODEL_PATH, Config.DEVICE, Config.MICRO_BATCH_MAX_SIZE, Config.MICRO_BATCH_MAX_WAIT_MS,
+                Config.SAVE_DEBUG_PATCH, Config.ENERGY_TILE_ROWS, Config.INFERENCE_PRECISION,
+                Config.QUANT_CALIBRATION_DIR, Config.QUANT_CALIBRATION_SAMPLES
+            )
         if heatmap_generator is None:
             heatmap_generator = HeatmapGenerator(safe_model)
         return True  # 即使模型加载失败也返回True，以便健康检查通过
 
+def cache_model_version(model):
+    """结果缓存键中的模型版本，非fp32精度的预测结果与fp32分开缓存"""
+    precision = model.precision if model is not None else 'fp32'
+    return Config.MODEL_VERSION if precision == 'fp32' else f"{Config.MODEL_VERSION}+{precision}"
+
 def allowed_file(filename):
     """检查文件格式是否允许"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def validate_image(file):
-    """验证图像文件"""
-    try:
-        img = Image.open(file)
-        # 检查图像尺寸
-        if img.size[0] > Config.MAX_IMAGE_SIZE[0] or img.size[1] > Config.MAX_IMAGE_SIZE[1]:
-            return False, "图像尺寸过大"
-        # 检查文件大小
-        file.seek(0, 2)  # 移到文件末尾
-        size = file.tell()
-        file.seek(0)  # 回到开始
-        if size > Config.MAX_FILE_SIZE:
-            return False, "文件大小超过限制"
-        return True, None
-    except Exception as e:
-        return False, f"图像文件无效: {str(e)}"
+def validate_image(image):
+    """验证图像(DecodedImage)，只使用文件头中的尺寸和上传内容大小"""
+    # 检查图像尺寸
+    if image.size[0] > Config.MAX_IMAGE_SIZE[0] or image.size[1] > Config.MAX_IMAGE_SIZE[1]:
+        return False, "图像尺寸过大"
+    # 检查文件大小
+    if image.byte_size > Config.MAX_FILE_SIZE:
+        return False, "文件大小超过限制"
+    return True, None
+
+def predict_with_cache(model, original_image, cache_key, context=None):
+    """带结果缓存的预测，返回 (预测结果, 是否命中缓存)；未命中时本次预测的中间结果写入 context"""
+    if result_cache is not None:
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+    
+    result = model.predict_image(original_image, context)
+    if result_cache is not None:
+        result_cache.put(cache_key, result)
+    return result, False
+
+def register_heatmap(image_source, result, cache_key, heatmap_filename, activation=None):
+    """
+    登记AI生成图像的热力图并返回热力图文件名，渲染推迟到首次访问热力图URL时
+    
+    image_source 为上传的原始内容或图像文件路径，activation 为预测时的layer2激活图(可为None)；
+    结果缓存中记录的热力图仍可访问时直接复用
+    """
+    cached_filename = result.get('heatmap_filename')
+    if cached_filename and heatmap_cache.contains(cached_filename):
+        return cached_filename
+    
+    patch_info = result.get('patch_info')
+    if patch_info is None:
+        return None
+    heatmap_cache.register(heatmap_filename, image_source, patch_info, activation)
+    
+    result['heatmap_filename'] = heatmap_filename
+    if result_cache is not None:
+        result_cache.update(cache_key, heatmap_filename=heatmap_filename)
+    return heatmap_filename
+
+def render_heatmap(source):
+    """按登记的来源渲染热力图JPEG"""
+    image = source.image
+    original_image = decode_image(image)
+    with span('heatmap'), observe_inference('ai_image_detection', 'SAFEResNet', 'heatmap'):
+        return heatmap_generator.render(original_image, source.patch_info, features=source.activation)
 
 @app.route('/health', methods=['GET', 'OPTIONS'])
 def health_check():
@@ -142,75 +224,56 @@ def detect_single():
     if not allowed_file(file.filename):
         return jsonify({'error': '不支持的文件格式'}), 400
     
+    # 读取上传内容并解析文件头，整个请求复用同一图像对象
+    try:
+        with span('read_upload'):
+            image = DecodedImage.from_upload(file)
+    except Exception as e:
+        return jsonify({'error': f"图像文件无效: {str(e)}"}), 400
+    
     # 验证图像
-    is_valid, error_msg = validate_image(file)
+    is_valid, error_msg = validate_image(image)
     if not is_valid:
         return jsonify({'error': error_msg}), 400
     
-    temp_file_path = ""
     try:
-        # 使用更安全的方式处理临时文件
-        temp_dir = tempfile.mkdtemp()
-        temp_file_path = os.path.join(temp_dir, f"{uuid.uuid4()}.jpg")
-        file.save(temp_file_path)
-        
         start_time = time.time()
         
-
-        result = safe_model.predict(temp_file_path)     
-
+        # 按解码后的像素内容查询结果缓存
+        with span('decode_image'):
+            original_image = image.rgb
+            cache_key = image.cache_key(cache_model_version(safe_model))
+        # 本请求的预测上下文: 同一次前向传播中保留layer2特征图，判定为AI生成时直接用于热力图
+        context = InferenceContext(capture_features=True)
+        result, cache_hit = predict_with_cache(safe_model, original_image, cache_key, context)
         
         processing_time = time.time() - start_time
         
-        # 生成热力图（仅对AI生成图像）
+        # 登记热力图（仅对AI生成图像），客户端首次访问URL时才渲染
         heatmap_url = None
         if result['prediction'] == 'fake' and heatmap_generator:
-            # 保存到 heatmaps 目录 - 使用相对路径
-            heatmap_dir = 'heatmaps'
-            os.makedirs(heatmap_dir, exist_ok=True)
-            heatmap_filename = f"heatmap_{uuid.uuid4()}.jpg"
-            heatmap_path = os.path.join(heatmap_dir, heatmap_filename)
-            logger.info(f"热力图保存路径: {heatmap_path}")
-            if heatmap_generator.generate(temp_file_path, heatmap_path):
+            features = context.features
+            heatmap_filename = register_heatmap(
+                image.data, result, cache_key, f"heatmap_{uuid.uuid4()}.jpg",
+                HeatmapGenerator.activation_map(features) if features is not None else None
+            )
+            if heatmap_filename:
                 # 返回完整的URL，包含协议和端口
                 heatmap_url = f"http://localhost:8002/heatmap/{heatmap_filename}"
                 logger.info(f"热力图URL: {heatmap_url}")
         
-        # 获取图像信息
-        img = Image.open(file)
-        file.seek(0)
-        
-        response = jsonify({
+        return jsonify({
             'prediction': result['prediction'],
             'confidence': result['confidence'],
             'processing_time': processing_time,
-            'model_version': 'SAFE-v1.0',
-            'image_info': {
-                'width': img.size[0],
-                'height': img.size[1],
-                'format': img.format,
-                'size': f"{file.content_length / 1024:.1f} KB" if file.content_length else "Unknown"
-            },
+            'model_version': Config.MODEL_VERSION,
+            'cache_hit': cache_hit,
+            'image_info': image.image_info(),
             'heatmap_url': heatmap_url
         })
         
-        # 清理临时文件和目录 - 确保在返回前安全清理
-        try:
-            # 使用安全的删除方式
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        except Exception as cleanup_error:
-            logger.warning(f"临时文件清理失败: {cleanup_error}")
-            
-        return response
-        
     except Exception as e:
         logger.error(f"检测失败: {str(e)}")
-        # 确保即使发生错误也清理临时文件
-        try:
-            if temp_file_path and os.path.exists(os.path.dirname(temp_file_path)):
-                shutil.rmtree(os.path.dirname(temp_file_path), ignore_errors=True)
-        except:
-            pass
         return jsonify({'error': f'检测失败: {str(e)}'}), 500
 
 @app.route('/detect/batch', methods=['POST', 'OPTIONS'])
@@ -332,57 +395,141 @@ def handle_multiple_files_batch(files, task_name):
         return jsonify({'error': f'批量检测失败: {str(e)}'}), 500
 
 def process_batch_images(image_paths, job_id):
-    """处理批量图像"""
-    results = []
+    """
+    流水线处理批量图像
     
+    解码与energy patch提取在进程池中并行执行；主线程按顺序取回预处理结果，
+    未命中缓存的patch每 BATCH_FORWARD_SIZE 张执行一次批量前向传播；
+    图片复制提交到I/O线程池，与后续图像的预处理、推理重叠；热力图只登记，首次访问时渲染。
+    结果顺序与字段与逐张处理一致。
+    """
     # 如果全局模型未加载，创建临时模型实例
     model_to_use = safe_model
     if model_to_use is None:
-        model_to_use = SAFEModel(Config.MODEL_PATH, Config.DEVICE)
+        model_to_use = SAFEModel(
+            Config.MODEL_PATH, Config.DEVICE, Config.MICRO_BATCH_MAX_SIZE, Config.MICRO_BATCH_MAX_WAIT_MS,
+            Config.SAVE_DEBUG_PATCH, Config.ENERGY_TILE_ROWS, Config.INFERENCE_PRECISION,
+            Config.QUANT_CALIBRATION_DIR, Config.QUANT_CALIBRATION_SAMPLES
+        )
     
     # 创建批量任务的图片存储目录
     batch_images_dir = os.path.join('batch_images', job_id)
     os.makedirs(batch_images_dir, exist_ok=True)
     
-    for i, image_path in enumerate(image_paths):
+    pipeline = get_batch_pipeline()
+    energy_patch_metric = INFERENCE_DURATION.labels('ai_image_detection', 'SAFEResNet', 'energy_patch')
+    model_version = cache_model_version(model_to_use)
+    prepared = [pipeline.prepare(image_path, model_version) for image_path in image_paths]
+    
+    # 每张图像的处理状态: 预处理结果、预测结果、错误及I/O任务
+    entries = [{} for _ in image_paths]
+    # 同一批次内像素内容相同的图像只推理一次: 缓存键 -> 首次出现的序号
+    primary = {}
+    pending = []
+    
+    def schedule_heatmap(i):
+        """登记AI生成图像的热力图，来源为复制到批量任务目录的原图"""
+        entry = entries[i]
+        if entry['result']['prediction'] == 'fake' and heatmap_generator:
+            heatmap_filename = register_heatmap(
+                entry['batch_image_path'], entry['result'], entry['cache_key'],
+                f"batch_{job_id}_{i:03d}_{uuid.uuid4().hex[:8]}.jpg", entry.get('activation')
+            )
+            if heatmap_filename:
+                entry['heatmap_url'] = f"http://localhost:8002/heatmap/{heatmap_filename}"
+    
+    def flush():
+        """对待推理的patch执行一次批量前向传播"""
+        if not pending:
+            return
+        start_time = time.time()
         try:
-            start_time = time.time()
-            result = model_to_use.predict(image_path)
-            processing_time = time.time() - start_time
-            
-            # 生成唯一的文件名
-            original_filename = os.path.basename(image_path)
-            safe_filename = f"{i:03d}_{uuid.uuid4().hex[:8]}_{original_filename}"
-            
-            # 复制原始图片到批量任务目录
-            batch_image_path = os.path.join(batch_images_dir, safe_filename)
-            shutil.copy2(image_path, batch_image_path)
-            
-            # 生成图片URL
-            image_url = f"http://localhost:8002/batch/{job_id}/image/{safe_filename}"
-            
-            # 生成热力图（仅对AI生成图像）
-            heatmap_url = None
-            if result['prediction'] == 'fake' and heatmap_generator:
-                # 保存到 heatmaps 目录
-                heatmap_dir = 'heatmaps'
-                os.makedirs(heatmap_dir, exist_ok=True)
-                heatmap_filename = f"batch_{job_id}_{i:03d}_{uuid.uuid4().hex[:8]}.jpg"
-                heatmap_path = os.path.join(heatmap_dir, heatmap_filename)
-                
-                logger.info(f"批量任务 {job_id}: 为图片 {original_filename} 生成热力图")
-                if heatmap_generator.generate(image_path, heatmap_path):
-                    heatmap_url = f"http://localhost:8002/heatmap/{heatmap_filename}"
-                    logger.info(f"批量任务热力图URL: {heatmap_url}")
-                else:
-                    logger.warning(f"批量任务 {job_id}: 热力图生成失败 {original_filename}")
+            if model_to_use.model is None:
+                results = [model_to_use.predict_image(decode_image(image_paths[i])) for i in pending]
+            else:
+                with span('SAFEResNet.forward_batch', batch_size=len(pending)):
+                    outputs = model_to_use.forward_batch(
+                        [transforms.ToTensor()(entries[i]['energy_patch']) for i in pending], return_features=True
+                    )
+                results = []
+                for i, (probs, features) in zip(pending, outputs):
+                    result = SAFEModel.build_result(probs, entries[i]['patch_info'])
+                    if result['prediction'] == 'fake':
+                        # 热力图直接使用本次前向传播的layer2激活图
+                        entries[i]['activation'] = HeatmapGenerator.activation_map(features)
+                    results.append(result)
+        except Exception as e:
+            logger.error(f"批量任务 {job_id}: 批量推理失败: {str(e)}")
+            for i in pending:
+                entries[i]['error'] = e
+            pending.clear()
+            return
+        forward_time = time.time() - start_time
+        
+        for i, result in zip(pending, results):
+            entry = entries[i]
+            entry['result'] = result
+            entry['processing_time'] += forward_time
+            if result_cache is not None:
+                result_cache.put(entry['cache_key'], result)
+            schedule_heatmap(i)
+        pending.clear()
+    
+    for i, future in enumerate(prepared):
+        entry = entries[i]
+        try:
+            entry.update(future.result())
+        except Exception as e:
+            entry['error'] = e
+            continue
+        entry['processing_time'] = entry['prepare_time']
+        energy_patch_metric.observe(entry['prepare_time'])
+        
+        # 复制原始图片到批量任务目录，使用唯一的文件名
+        safe_filename = f"{i:03d}_{uuid.uuid4().hex[:8]}_{os.path.basename(image_paths[i])}"
+        entry['batch_image_path'] = os.path.join(batch_images_dir, safe_filename)
+        entry['image_url'] = f"http://localhost:8002/batch/{job_id}/image/{safe_filename}"
+        entry['copy'] = pipeline.submit_io(shutil.copy2, image_paths[i], entry['batch_image_path'])
+        
+        cache_key = entry['cache_key']
+        if cache_key in primary:
+            entry['duplicate_of'] = primary[cache_key]
+            continue
+        primary[cache_key] = i
+        
+        cached = result_cache.get(cache_key) if result_cache is not None else None
+        if cached is not None:
+            entry['result'] = cached
+            entry['cache_hit'] = True
+            schedule_heatmap(i)
+        else:
+            entry['cache_hit'] = False
+            pending.append(i)
+            if len(pending) >= Config.BATCH_FORWARD_SIZE:
+                flush()
+    flush()
+    
+    results = []
+    for i, entry in enumerate(entries):
+        original_filename = os.path.basename(image_paths[i])
+        try:
+            if 'error' in entry:
+                raise entry['error']
+            source = entries[entry.get('duplicate_of', i)]
+            if 'error' in source:
+                raise source['error']
+            result = source['result']
+            heatmap_url = source.get('heatmap_url')
+            entry['copy'].result()
+            image_url = entry['image_url']
             
             results.append({
                 'index': i,
                 'filename': original_filename,
                 'prediction': result['prediction'],
                 'confidence': result['confidence'],
-                'processing_time': processing_time,
+                'processing_time': entry['processing_time'],
+                'cache_hit': source['cache_hit'] or 'duplicate_of' in entry,
                 'status': 'success',
                 'image_url': image_url,
                 'original_image_url': image_url,  # 添加这个字段以兼容前端
@@ -390,16 +537,30 @@ def process_batch_images(image_paths, job_id):
             })
             
         except Exception as e:
-            logger.error(f"处理图像失败 {image_path}: {str(e)}")
+            logger.error(f"处理图像失败 {image_paths[i]}: {str(e)}")
             results.append({
                 'index': i,
-                'filename': os.path.basename(image_path),
+                'filename': original_filename,
                 'status': 'failed',
                 'error': str(e)
             })
     
     return results
 
+@app.route('/stats', methods=['GET'])
+def get_service_stats():
+    """获取服务统计信息"""
+    return jsonify({
+        'service_name': 'AI图像检测服务',
+        'model_version': Config.MODEL_VERSION,
+        'model_loaded': safe_model is not None,
+        'inference_precision': safe_model.precision if safe_model is not None else None,
+        'result_cache': result_cache.get_stats() if result_cache is not None else None,
+        'heatmap_cache': heatmap_cache.get_stats(),
+        'micro_batching': safe_model.batcher.get_stats() if safe_model is not None else None,
+        'batch_pipeline': get_batch_pipeline().get_stats()
+    })
+
 @app.route('/batch/<job_id>/status', methods=['GET'])
 def get_batch_status(job_id):
     """获取批量任务状态"""
@@ -425,5 +586,7 @@ if __name__ == '__main__':
     logger.info("🔍 健康检查: http://localhost:8002/health")
     logger.info("📡 单张检测: POST http://localhost:8002/detect")
     logger.info("📦 批量检测: POST http://localhost:8002/detect/batch")
+    logger.info("📊 服务统计: GET http://localhost:8002/stats")
     
-    app.run(host=Config.HOST, port=Config.PORT, debug=Config.DEBUG) 
\ No newline at end of file
+    # 预测状态按请求隔离，可多线程处理请求
+    app.run(host=Config.HOST, port=Config.PORT, debug=Config.DEBUG, threaded=True) 
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+批量检测流水线
+将批量图像的处理拆为三个可重叠的阶段:
+1. 预处理: 解码、计算缓存键、提取energy patch，CPU密集，在进程池中并行执行(绕开GIL)
+2. 推理: 主线程按顺序取回预处理结果，未命中缓存的patch凑批后执行一次批量前向传播
+3. I/O: 复制原图到批量任务目录，在线程池中执行
+
+进程池使用spawn方式启动，避免fork继承父进程中已初始化的torch线程池导致死锁。
+"""
+import os
+import time
+import logging
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+from config import Config
+from result_cache import compute_image_key
+from safe_model import EnergyBasedCrop, extract_energy_patch
+from shared.imaging import decode_image, probe_image
+
+logger = logging.getLogger(__name__)
+
+# 预处理工作进程内复用的能量裁剪器(含DWT算子)
+_worker_energy_crop: Optional[EnergyBasedCrop] = None
+
+
+def _init_prepare_worker():
+    """预处理进程初始化: 单线程计算，避免多个进程争抢CPU"""
+    global _worker_energy_crop
+    torch.set_num_threads(1)
+    _worker_energy_crop = EnergyBasedCrop(size=256, tile_rows=Config.ENERGY_TILE_ROWS)
+
+
+def prepare_image(image_path: str, model_version: str) -> Dict[str, Any]:
+    """解码图像并提取energy patch，返回可跨进程传递的预处理结果"""
+    global _worker_energy_crop
+    if _worker_energy_crop is None:
+        _worker_energy_crop = EnergyBasedCrop(size=256, tile_rows=Config.ENERGY_TILE_ROWS)
+
+    start_time = time.time()
+    # 解码前只读取文件头，与单张检测一样拒绝尺寸过大的图像，避免解码超大图像
+    info = probe_image(image_path)
+    if info.width > Config.MAX_IMAGE_SIZE[0] or info.height > Config.MAX_IMAGE_SIZE[1]:
+        raise ValueError(f"图像尺寸过大: {info.width}x{info.height}")
+    # energy crop依赖原始分辨率的高频细节，按原尺寸解码
+    original_image = decode_image(image_path)
+    cache_key = compute_image_key(original_image, model_version)
+    energy_patch, patch_info = extract_energy_patch(_worker_energy_crop, original_image)
+    return {
+        'cache_key': cache_key,
+        'energy_patch': energy_patch,
+        'patch_info': patch_info,
+        'prepare_time': time.time() - start_time
+    }
+
+
+class BatchPipeline:
+    """批量检测的预处理进程池与I/O线程池"""
+
+    def __init__(self, process_workers: int = 4, io_threads: int = 4, model_version: str = Config.MODEL_VERSION):
+        self.process_workers = process_workers
+        self.io_threads = io_threads
+        self.model_version = model_version
+
+        if process_workers > 0:
+            self._prepare_executor = ProcessPoolExecutor(
+                max_workers=process_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_prepare_worker
+            )
+        else:
+            # 不启用进程池时在线程中预处理，仍与推理阶段重叠
+            self._prepare_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batch-prepare')
+        self._io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix='batch-io')
+
+        # 累计统计
+        self._prepared = 0
+        self._io_tasks = 0
+
+    def prepare(self, image_path: str, model_version: Optional[str] = None) -> Future:
+        """提交一张图像的预处理，model_version 为缓存键中的模型版本(默认为流水线创建时的版本)"""
+        self._prepared += 1
+        return self._prepare_executor.submit(
+            prepare_image, os.path.abspath(image_path), model_version or self.model_version
+        )
+
+    def submit_io(self, func: Callable, *args, **kwargs) -> Future:
+        """提交I/O任务，沿用调用线程的追踪上下文"""
+        self._io_tasks += 1
+        context = contextvars.copy_context()
+        return self._io_executor.submit(context.run, func, *args, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取流水线统计"""
+        return {
+            'process_workers': self.process_workers,
+            'io_threads': self.io_threads,
+            'forward_batch_size': Config.BATCH_FORWARD_SIZE,
+            'prepared_images': self._prepared,
+            'io_tasks': self._io_tasks
+        }
+
+
+_batch_pipeline: Optional[BatchPipeline] = None
+_batch_pipeline_lock = threading.Lock()
+
+
+def get_batch_pipeline() -> BatchPipeline:
+    """获取全局批量检测流水线(首次调用时启动进程池)"""
+    global _batch_pipeline
+    if _batch_pipeline is None:
+        with _batch_pipeline_lock:
+            if _batch_pipeline is None:
+                _batch_pipeline = BatchPipeline(
+                    process_workers=Config.BATCH_PROCESS_WORKERS,
+                    io_threads=Config.BATCH_IO_THREADS
+                )
+                logger.info(
+                    f"批量检测流水线已启动: 预处理进程 {Config.BATCH_PROCESS_WORKERS}, I/O线程 {Config.BATCH_IO_THREADS}"
+                )
+    return _batch_pipeline
@@ -0,0 +1,84 @@
+"""
+能量裁剪微基准
+对比逐窗口求和(原实现)与积分图向量化实现在不同图像尺寸下的耗时，并校验两者的裁剪位置一致；
+同时对比每次新建DWT算子与复用算子计算能量图的耗时
+
+用法: python bench_energy_crop.py [--sizes 512 1024 2048 4096] [--repeat 5]
+"""
+import argparse
+import time
+
+import torch
+
+from safe_model import EnergyBasedCrop, WAVELETS_AVAILABLE, DWTForward
+
+
+def loop_find_best_crop(energy_map, target_size):
+    """原实现: Python双重循环逐窗口求和"""
+    h, w = energy_map.shape
+    stride = max(target_size // 4, 16)
+    max_energy = -1
+    best_x, best_y = 0, 0
+    for y in range(0, h - target_size + 1, stride):
+        for x in range(0, w - target_size + 1, stride):
+            window_energy = energy_map[y:y+target_size, x:x+target_size].sum().item()
+            if window_energy > max_energy:
+                max_energy = window_energy
+                best_x, best_y = x, y
+    return best_x, best_y
+
+
+def timed(func, repeat):
+    """返回多次运行的最短耗时(毫秒)和最后一次的结果"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='能量裁剪微基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048, 4096], help='图像边长')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数，取最短耗时')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    torch.manual_seed(args.seed)
+    crop = EnergyBasedCrop(size=256)
+    target_size = crop.size // 2
+
+    print(f"{'图像尺寸':>10} {'窗口数':>8} {'循环(ms)':>10} {'向量化(ms)':>11} {'加速比':>8} {'位置一致':>8}")
+    for size in args.sizes:
+        # 叠加局部高频区域，使最佳窗口位置不唯一依赖随机噪声
+        img = torch.rand(3, size, size) * 0.1
+        y0, x0 = size // 3, size // 2
+        img[:, y0:y0 + size // 8, x0:x0 + size // 8] += torch.rand(3, size // 8, size // 8)
+        energy_map = crop.compute_energy_map(img)
+
+        h, w = energy_map.shape
+        stride = max(target_size // 4, 16)
+        windows = ((h - target_size) // stride + 1) * ((w - target_size) // stride + 1)
+
+        loop_ms, loop_pos = timed(lambda: loop_find_best_crop(energy_map, target_size), args.repeat)
+        fast_ms, fast_pos = timed(lambda: crop.find_best_crop(energy_map, target_size), args.repeat)
+        print(f"{size:>10} {windows:>8} {loop_ms:>10.2f} {fast_ms:>11.2f} {loop_ms / fast_ms:>7.1f}x {str(loop_pos == fast_pos):>8}")
+
+    if WAVELETS_AVAILABLE:
+        print()
+        print(f"{'图像尺寸':>10} {'新建DWT(ms)':>12} {'复用DWT(ms)':>12}")
+        for size in args.sizes:
+            img = torch.rand(1, 3, size, size)
+
+            def fresh_dwt():
+                return DWTForward(J=1, mode="symmetric", wave="bior1.3")(img)
+
+            fresh_ms, _ = timed(fresh_dwt, args.repeat)
+            reused_ms, _ = timed(lambda: crop.dwt(img), args.repeat)
+            print(f"{size:>10} {fresh_ms:>12.2f} {reused_ms:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
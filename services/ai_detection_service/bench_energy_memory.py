@@ -0,0 +1,77 @@
+"""
+能量裁剪峰值内存基准
+对比整图计算与分块计算小波能量在不同图像尺寸下的峰值RSS增量与耗时，并校验两者的裁剪位置一致。
+每项测量在独立子进程中执行，峰值RSS(ru_maxrss)互不影响。
+
+用法: python bench_energy_memory.py [--sizes 1024 2048 4096] [--tile-rows 512]
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import time
+
+
+def _peak_rss_mb():
+    """当前进程的峰值RSS(MB)，Linux上 ru_maxrss 单位为KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(mode, size, tile_rows, seed, queue):
+    """子进程: 构造图像后执行一次能量裁剪定位，返回 (峰值RSS增量, 耗时, 裁剪位置)"""
+    import numpy as np
+    import torch
+    from PIL import Image
+    from torchvision import transforms
+    from safe_model import EnergyBasedCrop
+
+    torch.set_num_threads(1)
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 40, (size, size, 3), dtype=np.uint8)
+    # 叠加局部高频区域，使最佳窗口位置明确
+    y0, x0, patch = size // 3, size // 2, size // 8
+    pixels[y0:y0 + patch, x0:x0 + patch] = rng.integers(0, 255, (patch, patch, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels)
+    del pixels
+
+    crop = EnergyBasedCrop(size=256, tile_rows=tile_rows if mode == 'tiled' else 0)
+    # 预热，排除算子初始化的一次性内存
+    crop.locate_best_crop(image.crop((0, 0, 512, 512)), crop.size // 2)
+
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'tiled':
+        position = crop.locate_best_crop(image, crop.size // 2)
+    else:
+        position = crop.find_best_crop(crop.compute_energy_map(transforms.ToTensor()(image)), crop.size // 2)
+    elapsed = time.perf_counter() - start
+    queue.put((_peak_rss_mb() - baseline, elapsed * 1000, position))
+
+
+def run(mode, size, tile_rows, seed):
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(mode, size, tile_rows, seed, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='能量裁剪峰值内存基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024, 2048, 4096], help='图像边长')
+    parser.add_argument('--tile-rows', type=int, default=256, help='分块计算时每块的原图行数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'图像尺寸':>10} {'整图峰值(MB)':>13} {'分块峰值(MB)':>13} {'整图(ms)':>10} {'分块(ms)':>10} {'位置一致':>8}")
+    for size in args.sizes:
+        full_mb, full_ms, full_pos = run('full', size, args.tile_rows, args.seed)
+        tiled_mb, tiled_ms, tiled_pos = run('tiled', size, args.tile_rows, args.seed)
+        print(f"{size:>10} {full_mb:>13.1f} {tiled_mb:>13.1f} {full_ms:>10.1f} {tiled_ms:>10.1f} {str(full_pos == tiled_pos):>8}")
+
+
+if __name__ == '__main__':
+    main()
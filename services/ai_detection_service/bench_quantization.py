@@ -0,0 +1,109 @@
+"""
+推理精度对比
+在留出集上依次以各推理精度运行SAFE模型，报告吞吐量以及与fp32的预测一致率、概率差与准确率差。
+留出集目录下按子目录名区分标签(real/0 为真实图像，fake/1 为AI生成)，没有标签子目录时只报告与fp32的一致率。
+energy patch对所有精度只提取一次，吞吐量只统计批量前向传播(含DWT预处理)。
+
+用法: python bench_quantization.py --data-dir <留出集目录> [--calibration-dir <校准集目录>]
+                                  [--precisions fp32 int8_dynamic int8_static bf16] [--batch-size 8]
+"""
+import argparse
+import logging
+import os
+import time
+
+import torch
+from torchvision import transforms
+
+from config import Config
+from safe_model import IMAGE_EXTENSIONS, SAFEModel, extract_energy_patch
+from shared.imaging import decode_image
+from shared.quantization import PRECISIONS, compare_predictions
+
+LABELS = {'real': 0, '0': 0, 'fake': 1, '1': 1}
+
+
+def load_patches(model, data_dir, max_samples):
+    """读取留出集，返回 energy patch 张量列表与标签(无标签时为None)"""
+    samples = []
+    for root, _, names in os.walk(data_dir):
+        label = LABELS.get(os.path.basename(root).lower())
+        for name in names:
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(root, name), label))
+    samples = sorted(samples)[:max_samples] if max_samples else sorted(samples)
+
+    to_tensor = transforms.ToTensor()
+    patches, labels = [], []
+    for image_path, label in samples:
+        energy_patch, _ = extract_energy_patch(model.energy_crop, decode_image(image_path))
+        patches.append(to_tensor(energy_patch))
+        labels.append(label)
+    labelled = bool(labels) and all(label is not None for label in labels)
+    return patches, torch.tensor(labels) if labelled else None
+
+
+def run(model, patches, batch_size):
+    """批量前向传播全部patch，返回 (类别概率[N, 2], 每秒处理的patch数)"""
+    batches = [patches[i:i + batch_size] for i in range(0, len(patches), batch_size)]
+    model.forward_batch(batches[0])  # 预热，排除首次调用的算子初始化
+    start = time.perf_counter()
+    probabilities = [probs for batch in batches for probs in model.forward_batch(batch)]
+    elapsed = time.perf_counter() - start
+    return torch.stack(probabilities), len(patches) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SAFE模型推理精度对比')
+    parser.add_argument('--data-dir', required=True, help='留出集目录')
+    parser.add_argument('--calibration-dir', default=Config.QUANT_CALIBRATION_DIR,
+                        help='int8_static的校准集目录，应与留出集不重叠')
+    parser.add_argument('--calibration-samples', type=int, default=Config.QUANT_CALIBRATION_SAMPLES)
+    parser.add_argument('--precisions', nargs='+', default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument('--batch-size', type=int, default=Config.BATCH_FORWARD_SIZE)
+    parser.add_argument('--max-samples', type=int, default=0, help='最多使用的留出集图像数，0为全部')
+    parser.add_argument('--seed', type=int, default=0, help='未找到权重文件时随机初始化所用的种子')
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    precisions = ['fp32'] + [p for p in args.precisions if p != 'fp32']
+
+    models = {}
+    for precision in precisions:
+        # 各精度从相同的fp32权重转换(无权重文件时使用相同的随机初始化)
+        torch.manual_seed(args.seed)
+        models[precision] = SAFEModel(
+            Config.MODEL_PATH, 'cpu', precision=precision,
+            calibration_dir=args.calibration_dir, calibration_samples=args.calibration_samples
+        )
+
+    patches, labels = load_patches(models['fp32'], args.data_dir, args.max_samples)
+    if not patches:
+        parser.error(f"留出集目录中没有图像: {args.data_dir}")
+    print(f"留出集: {len(patches)} 张{'(有标签)' if labels is not None else '(无标签)'}，批大小: {args.batch_size}")
+
+    reference, reference_speed = run(models['fp32'], patches, args.batch_size)
+    header = f"{'精度':>14} {'吞吐(张/s)':>11} {'加速比':>7} {'一致率':>8} {'最大概率差':>10} {'平均概率差':>10}"
+    if labels is not None:
+        header += f" {'准确率':>8} {'准确率差':>9}"
+    print(header)
+
+    for precision in precisions:
+        model = models[precision]
+        if model.precision != precision:
+            print(f"{precision:>14} 不可用，已回退为 {model.precision}")
+            continue
+        if precision == 'fp32':
+            probabilities, speed = reference, reference_speed
+        else:
+            probabilities, speed = run(model, patches, args.batch_size)
+        report = compare_predictions(reference, probabilities, labels)
+        line = (f"{precision:>14} {speed:>11.1f} {speed / reference_speed:>7.2f} {report['agreement']:>8.2%} "
+                f"{report['max_prob_diff']:>10.4f} {report['mean_prob_diff']:>10.4f}")
+        if labels is not None:
+            line += f" {report['accuracy']:>8.2%} {report['accuracy_delta']:>+9.2%}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
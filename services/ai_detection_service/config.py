@@ -10,14 +10,53 @@ class Config:
     MAX_IMAGE_SIZE = (4096, 4096)  # 最大图像尺寸
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
     
+    # 能量裁剪: 图像高度超过两块时按行分块计算小波能量以限制峰值内存，为0时总是整图计算
+    ENERGY_TILE_ROWS = int(os.environ.get('ENERGY_TILE_ROWS', 256))
+    
     # 批量处理配置
     MAX_BATCH_SIZE = 50  # 最大批量处理数量
     
+    # 批量检测流水线: 预处理进程池、I/O线程池与批量前向传播的样本数，PROCESS_WORKERS 为0时在线程中预处理
+    BATCH_PROCESS_WORKERS = int(os.environ.get('BATCH_PROCESS_WORKERS', min(4, (os.cpu_count() or 1) - 1)))  # 留一个核心给批量推理
+    BATCH_IO_THREADS = int(os.environ.get('BATCH_IO_THREADS', 4))
+    BATCH_FORWARD_SIZE = int(os.environ.get('BATCH_FORWARD_SIZE', 8))
+    
+    # 动态微批处理: 并发请求在等待窗口内合并为一次批量前向传播，MAX_SIZE 为1时关闭
+    MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', 8))  # 单批最大样本数
+    MICRO_BATCH_MAX_WAIT_MS = float(os.environ.get('MICRO_BATCH_MAX_WAIT_MS', 5))  # 凑批等待窗口(毫秒)
+    
+    # 每次预测把energy patch写入 debug_energy_patch.jpg，仅用于本地调试(并发请求会相互覆盖)
+    SAVE_DEBUG_PATCH = os.environ.get('SAVE_DEBUG_PATCH', 'false') == 'true'
+    
+    # CPU推理精度: fp32 / int8_dynamic / int8_static / bf16，CPU不支持或转换失败时回退为fp32
+    # int8_static 从 QUANT_CALIBRATION_DIR 读取最多 QUANT_CALIBRATION_SAMPLES 张图像校准激活范围；
+    # 切换前用 bench_quantization.py 在留出集上对比与fp32的准确率差异
+    INFERENCE_PRECISION = os.environ.get('INFERENCE_PRECISION', 'fp32')
+    QUANT_CALIBRATION_DIR = os.environ.get('QUANT_CALIBRATION_DIR', '')
+    QUANT_CALIBRATION_SAMPLES = int(os.environ.get('QUANT_CALIBRATION_SAMPLES', 64))
+    
     # 服务配置
     HOST = '0.0.0.0'
     PORT = 8002
     DEBUG = True
     
+    # 模型版本 (参与结果缓存键，更换权重时需同步修改)
+    MODEL_VERSION = 'SAFE-v1.0'
+    
+    # 结果缓存配置
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true') == 'true'
+    RESULT_CACHE_MEMORY_ITEMS = int(os.environ.get('RESULT_CACHE_MEMORY_ITEMS', 1024))  # 内存层最大条目数
+    RESULT_CACHE_DISK_DIR = os.environ.get('RESULT_CACHE_DISK_DIR', '')  # 磁盘层目录，为空则不启用
+    RESULT_CACHE_DISK_ITEMS = int(os.environ.get('RESULT_CACHE_DISK_ITEMS', 10000))  # 磁盘层最大条目数
+    
+    # 热力图缓存: 检测时只登记来源，首次访问时渲染；分别限制渲染结果与来源(上传原图)占用的内存
+    HEATMAP_CACHE_MAX_BYTES = int(os.environ.get('HEATMAP_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    HEATMAP_SOURCE_MAX_BYTES = int(os.environ.get('HEATMAP_SOURCE_MAX_BYTES', 256 * 1024 * 1024))
+    # 多进程/多副本部署时的共享热力图目录，为空(默认)则只保存在本进程内存中；目录按总大小与保留时间(秒)淘汰
+    HEATMAP_SHARED_DIR = os.environ.get('HEATMAP_SHARED_DIR', '')
+    HEATMAP_SHARED_MAX_BYTES = int(os.environ.get('HEATMAP_SHARED_MAX_BYTES', 1024 * 1024 * 1024))
+    HEATMAP_SHARED_TTL = int(os.environ.get('HEATMAP_SHARED_TTL', 3600))
+    
     # 上传目录
     UPLOAD_FOLDER = 'uploads'
     HEATMAP_FOLDER = 'heatmaps'
@@ -0,0 +1,63 @@
+"""
+请求范围内的已解码图像
+上传内容只读取一次并保存在内存中；尺寸与格式从文件头获取，RGB像素只在首次使用时解码一次，
+校验、缓存键、energy patch提取、热力图与图像信息均复用同一对象，不再经过临时文件。
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from PIL import Image
+
+from result_cache import compute_image_key
+from shared.imaging import decode_image, open_image
+
+
+class DecodedImage:
+    """单次请求内共享的图像对象"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+        # 只解析文件头，像素数据延迟到访问 rgb 时解码
+        self._header = open_image(data)
+        self._rgb: Optional[Image.Image] = None
+        self._cache_keys: Dict[str, str] = {}
+
+    @classmethod
+    def from_upload(cls, file) -> "DecodedImage":
+        """从上传文件流构造(werkzeug FileStorage 或任意文件对象)"""
+        return cls(file.read())
+
+    @property
+    def format(self) -> Optional[str]:
+        return self._header.format
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self._header.size
+
+    @property
+    def byte_size(self) -> int:
+        return len(self.data)
+
+    @property
+    def rgb(self) -> Image.Image:
+        """解码后的RGB图像，首次访问时解码"""
+        if self._rgb is None:
+            # energy crop依赖原始分辨率的高频细节，不做缩小解码
+            self._rgb = decode_image(self._header)
+        return self._rgb
+
+    def cache_key(self, model_version: str) -> str:
+        """按像素内容计算的结果缓存键"""
+        key = self._cache_keys.get(model_version)
+        if key is None:
+            key = self._cache_keys[model_version] = compute_image_key(self.rgb, model_version)
+        return key
+
+    def image_info(self) -> Dict[str, Any]:
+        """检测响应中的图像信息"""
+        return {
+            'width': self.size[0],
+            'height': self.size[1],
+            'format': self.format,
+            'size': f"{self.byte_size / 1024:.1f} KB"
+        }
@@ -0,0 +1,298 @@
+"""
+按需渲染的热力图缓存
+检测时只登记热力图的来源(原图内容或路径、patch位置、layer2激活图)，客户端首次访问热力图URL时才渲染，
+渲染结果(JPEG)按LRU保存在内存中；来源与渲染结果分别按字节数限制容量。
+
+多进程或多副本部署时，热力图请求可能落到未执行预测的进程。给定共享目录 shared_dir 时，
+登记的来源由后台线程写入 shared_dir/.sources，渲染结果写入 shared_dir/<文件名>，任一进程都能渲染或直接返回；
+共享目录按总字节数与保留时间淘汰最早写入的文件。未给定时(单进程部署)不写任何文件。
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class HeatmapSource:
+    """渲染一张热力图所需的信息"""
+
+    __slots__ = ('image', 'patch_info', 'activation', 'nbytes')
+
+    def __init__(self, image: Union[bytes, str], patch_info: Dict[str, Any], activation=None):
+        # image 为上传的原始内容(bytes)或磁盘上的图像路径
+        self.image = image
+        self.patch_info = patch_info
+        # 预测时layer2特征图按通道求均值后的激活图，为None时渲染时重新前向传播
+        self.activation = activation
+        self.nbytes = (len(image) if isinstance(image, bytes) else 0) + \
+            (activation.numel() * activation.element_size() if activation is not None else 0)
+
+
+class HeatmapCache:
+    """热力图来源登记 + 渲染结果LRU缓存"""
+
+    def __init__(self, max_rendered_bytes: int = 64 * 1024 * 1024, max_source_bytes: int = 256 * 1024 * 1024,
+                 max_sources: int = 10000, shared_dir: Optional[str] = None,
+                 max_shared_bytes: int = 1024 * 1024 * 1024, shared_ttl: float = 3600.0,
+                 max_pending_writes: int = 256, sweep_interval: float = 60.0):
+        self.max_rendered_bytes = max_rendered_bytes
+        self.max_source_bytes = max_source_bytes
+        self.max_sources = max_sources
+        self.shared_dir = shared_dir or None
+        self.max_shared_bytes = max_shared_bytes
+        self.shared_ttl = shared_ttl
+        self.sweep_interval = sweep_interval
+        self._source_dir = os.path.join(self.shared_dir, '.sources') if self.shared_dir else None
+
+        self._sources: "OrderedDict[str, HeatmapSource]" = OrderedDict()
+        self._rendered: "OrderedDict[str, bytes]" = OrderedDict()
+        self._source_bytes = 0
+        self._rendered_bytes = 0
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._registered = 0
+        self._renders = 0
+        self._hits = 0
+        self._expired = 0
+        self._shared_hits = 0
+        self._shared_dropped = 0
+        self._shared_evicted = 0
+        self._shared_bytes = 0
+
+        # 共享目录的写入与淘汰都在后台线程执行，不占用请求线程
+        self._writes: "queue.Queue[Callable[[], None]]" = queue.Queue(maxsize=max_pending_writes)
+        if self.shared_dir:
+            os.makedirs(self._source_dir, exist_ok=True)
+            threading.Thread(target=self._run_writer, name='heatmap-writer', daemon=True).start()
+
+    @staticmethod
+    def _valid_name(name: str) -> bool:
+        """热力图文件名来自URL，只接受不含路径的普通文件名"""
+        return bool(name) and os.path.basename(name) == name and not name.startswith('.')
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        """先写临时文件再重命名，其他进程不会读到写了一半的文件"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _submit_write(self, task: Callable[[], None]):
+        """提交共享目录写入任务，队列已满时放弃写入(本进程仍可从内存返回该热力图)"""
+        try:
+            self._writes.put_nowait(task)
+        except queue.Full:
+            with self._lock:
+                self._shared_dropped += 1
+
+    def _run_writer(self):
+        """后台线程: 依次执行写入任务，写入量超过上限或到达清理间隔时淘汰共享目录中的文件"""
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                task = self._writes.get(timeout=self.sweep_interval)
+            except queue.Empty:
+                task = None
+            try:
+                if task is not None:
+                    task()
+                if time.monotonic() >= next_sweep or self._shared_bytes > self.max_shared_bytes:
+                    self._sweep_shared()
+                    next_sweep = time.monotonic() + self.sweep_interval
+            except Exception:
+                logger.exception("写入或清理共享热力图目录失败")
+
+    def _write_shared(self, path: str, data: bytes):
+        self._write_atomic(path, data)
+        with self._lock:
+            self._shared_bytes += len(data)
+
+    def _sweep_shared(self):
+        """
+        淘汰共享目录中超过保留时间的文件，总大小仍超过上限时按写入时间从早到晚删除到上限的90%
+
+        多个进程可同时清理同一目录，已被其他进程删除的文件直接跳过。
+        """
+        entries = []
+        for directory in (self.shared_dir, self._source_dir):
+            for entry in os.scandir(directory):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        expire_before = time.time() - self.shared_ttl
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_shared_bytes * 0.9) if total > self.max_shared_bytes else total
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= expire_before and total <= target:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._shared_bytes = total
+            self._shared_evicted += removed
+        if removed:
+            logger.info(f"共享热力图目录淘汰 {removed} 个文件，剩余 {total} 字节")
+
+    def _persist_source(self, name: str, source: HeatmapSource):
+        """把来源写入共享目录: 上传内容写为 <name>.img，其余信息写为 <name>.json(最后写入，表示来源完整)"""
+        meta = {
+            'image_path': None if isinstance(source.image, bytes) else os.path.abspath(source.image),
+            'patch_info': source.patch_info,
+            'activation': source.activation.tolist() if source.activation is not None else None
+        }
+        if isinstance(source.image, bytes):
+            self._write_shared(os.path.join(self._source_dir, f"{name}.img"), source.image)
+        self._write_shared(os.path.join(self._source_dir, f"{name}.json"),
+                           json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    def _load_source(self, name: str) -> Optional[HeatmapSource]:
+        """从共享目录读取其他进程登记的来源，不存在时返回None"""
+        try:
+            with open(os.path.join(self._source_dir, f"{name}.json"), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            image = meta['image_path']
+            if image is None:
+                with open(os.path.join(self._source_dir, f"{name}.img"), 'rb') as f:
+                    image = f.read()
+        except FileNotFoundError:
+            return None
+        activation = torch.tensor(meta['activation']) if meta['activation'] is not None else None
+        return HeatmapSource(image, meta['patch_info'], activation)
+
+    def _shared_path(self, name: str) -> Optional[str]:
+        return os.path.join(self.shared_dir, name) if self.shared_dir else None
+
+    def _publish(self, name: str, data: bytes):
+        """渲染结果写入共享目录供其他进程直接返回，并删除已不再需要的来源文件"""
+        self._write_shared(self._shared_path(name), data)
+        for suffix in ('.json', '.img'):
+            try:
+                os.remove(os.path.join(self._source_dir, f"{name}{suffix}"))
+            except FileNotFoundError:
+                pass
+
+    def register(self, name: str, image: Union[bytes, str], patch_info: Dict[str, Any], activation=None):
+        """登记热力图来源，不做渲染"""
+        source = HeatmapSource(image, patch_info, activation)
+        with self._lock:
+            previous = self._sources.pop(name, None)
+            if previous is not None:
+                self._source_bytes -= previous.nbytes
+            self._sources[name] = source
+            self._source_bytes += source.nbytes
+            self._registered += 1
+            while self._sources and (self._source_bytes > self.max_source_bytes or len(self._sources) > self.max_sources):
+                _, evicted = self._sources.popitem(last=False)
+                self._source_bytes -= evicted.nbytes
+        if self.shared_dir:
+            self._submit_write(lambda: self._persist_source(name, source))
+
+    def contains(self, name: str) -> bool:
+        """热力图仍可访问(已渲染或来源未被淘汰，或共享目录中存在渲染结果或来源)"""
+        with self._lock:
+            if name in self._rendered or name in self._sources:
+                return True
+        if not self.shared_dir or not self._valid_name(name):
+            return False
+        return os.path.isfile(self._shared_path(name)) or \
+            os.path.isfile(os.path.join(self._source_dir, f"{name}.json"))
+
+    def get(self, name: str, render: Callable[[HeatmapSource], Optional[bytes]]) -> Optional[bytes]:
+        """
+        获取热力图JPEG，未渲染时用 render 渲染并缓存；来源已被淘汰时返回None
+
+        本进程没有登记时依次查找共享目录中的渲染结果与来源。
+        """
+        with self._lock:
+            data = self._rendered.get(name)
+            if data is not None:
+                self._rendered.move_to_end(name)
+                self._hits += 1
+                return data
+            source = self._sources.get(name)
+            if source is not None:
+                self._sources.move_to_end(name)
+
+        if source is None and self.shared_dir and self._valid_name(name):
+            try:
+                with open(self._shared_path(name), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                source = self._load_source(name)
+            else:
+                with self._lock:
+                    self._shared_hits += 1
+                self._store_rendered(name, data)
+                return data
+
+        if source is None:
+            with self._lock:
+                self._expired += 1
+            return None
+
+        data = render(source)
+        if data is None:
+            return None
+
+        with self._lock:
+            self._renders += 1
+            # 已渲染的热力图不再需要来源
+            previous = self._sources.pop(name, None)
+            if previous is not None:
+                self._source_bytes -= previous.nbytes
+        self._store_rendered(name, data)
+        if self.shared_dir:
+            self._submit_write(lambda: self._publish(name, data))
+        return data
+
+    def _store_rendered(self, name: str, data: bytes):
+        with self._lock:
+            if name not in self._rendered:
+                self._rendered[name] = data
+                self._rendered_bytes += len(data)
+            while self._rendered and self._rendered_bytes > self.max_rendered_bytes:
+                _, evicted = self._rendered.popitem(last=False)
+                self._rendered_bytes -= len(evicted)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            return {
+                'sources': len(self._sources),
+                'source_bytes': self._source_bytes,
+                'source_capacity_bytes': self.max_source_bytes,
+                'rendered': len(self._rendered),
+                'rendered_bytes': self._rendered_bytes,
+                'rendered_capacity_bytes': self.max_rendered_bytes,
+                'registered': self._registered,
+                'renders': self._renders,
+                'hits': self._hits,
+                'expired': self._expired,
+                'shared_dir': self.shared_dir,
+                'shared_hits': self._shared_hits,
+                'shared_bytes': self._shared_bytes,
+                'shared_capacity_bytes': self.max_shared_bytes if self.shared_dir else 0,
+                'shared_pending_writes': self._writes.qsize(),
+                'shared_dropped': self._shared_dropped,
+                'shared_evicted': self._shared_evicted
+            }
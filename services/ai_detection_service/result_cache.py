@@ -0,0 +1,161 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def compute_image_key(image: Image.Image, model_version: str) -> str:
+    """根据解码后的像素内容和模型版本计算缓存键，与文件名、容器格式无关"""
+    digest = hashlib.sha256()
+    digest.update(model_version.encode('utf-8'))
+    digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode('utf-8'))
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """检测结果缓存：内存LRU + 可选的磁盘持久层"""
+
+    def __init__(self, max_memory_items: int = 1024, disk_dir: Optional[str] = None, max_disk_items: int = 10000):
+        self.max_memory_items = max_memory_items
+        self.disk_dir = disk_dir or None
+        self.max_disk_items = max_disk_items
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._disk_items = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._disk_items = sum(1 for name in os.listdir(self.disk_dir) if name.endswith('.json'))
+            logger.info(f"结果缓存磁盘层: {self.disk_dir}, 已有 {self._disk_items} 条")
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """查询缓存，依次检查内存层和磁盘层"""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+                self._memory_hits += 1
+                return dict(result)
+
+        if self.disk_dir:
+            result = self._read_disk(key)
+            if result is not None:
+                with self._lock:
+                    self._disk_hits += 1
+                    self._put_memory(key, result)
+                return dict(result)
+
+        with self._lock:
+            self._misses += 1
+        return None
+
+    def put(self, key: str, result: Dict[str, Any]):
+        """写入缓存"""
+        with self._lock:
+            self._put_memory(key, result)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def update(self, key: str, **fields):
+        """更新已缓存结果的部分字段(如补充热力图文件名)"""
+        with self._lock:
+            result = self._memory.get(key)
+            if result is None:
+                return
+            result.update(fields)
+            result = dict(result)
+        if self.disk_dir:
+            self._write_disk(key, result)
+
+    def _put_memory(self, key: str, result: Dict[str, Any]):
+        """写入内存层并按LRU淘汰，调用方需持有锁"""
+        self._memory[key] = dict(result)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+            # 更新访问时间，淘汰时按最近访问排序
+            os.utime(path, None)
+            return result
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取磁盘缓存失败 {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, result: Dict[str, Any]):
+        path = self._disk_path(key)
+        is_new = not os.path.exists(path)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"写入磁盘缓存失败 {path}: {e}")
+            return
+
+        if is_new:
+            with self._lock:
+                self._disk_items += 1
+                need_evict = self._disk_items > self.max_disk_items
+            if need_evict:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """按最近访问时间淘汰磁盘层，一次清理到上限的90%，避免频繁扫描目录"""
+        try:
+            entries = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith('.json')]
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+            target = int(self.max_disk_items * 0.9)
+            removed = 0
+            for entry in entries[:max(len(entries) - target, 0)]:
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                self._disk_items = len(entries) - removed
+            logger.info(f"磁盘缓存淘汰 {removed} 条")
+        except Exception as e:
+            logger.warning(f"磁盘缓存淘汰失败: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            total = hits + self._misses
+            return {
+                'memory_items': len(self._memory),
+                'memory_capacity': self.max_memory_items,
+                'disk_enabled': self.disk_dir is not None,
+                'disk_items': self._disk_items,
+                'disk_capacity': self.max_disk_items if self.disk_dir else 0,
+                'memory_hits': self._memory_hits,
+                'disk_hits': self._disk_hits,
+                'misses': self._misses,
+                'hit_ratio': round(hits / total, 4) if total > 0 else 0.0
+            }
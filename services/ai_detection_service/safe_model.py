@@ -1,13 +1,20 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torchvision import transforms
 from PIL import Image
-import numpy as np
-import os
 import logging
 import random
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, Tuple, List, Optional
+from shared.metrics import observe_inference
+from shared.tracing import span
+from shared.batching import MicroBatcher
+from shared.imaging import decode_image
+from shared import quantization
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -15,6 +22,7 @@ logger = logging.getLogger(__name__)
 
 # 尝试导入pytorch_wavelets
 try:
+    import pywt
     from pytorch_wavelets import DWTForward
     WAVELETS_AVAILABLE = True
     logger.info("pytorch_wavelets 可用")
@@ -22,15 +30,24 @@ except ImportError:
     WAVELETS_AVAILABLE = False
     logger.warning("pytorch_wavelets 不可用。安装: pip install pytorch_wavelets")
 
+# 读取校准图像时识别的文件扩展名
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
 
 class EnergyBasedCrop:
     """基于小波能量图的智能裁剪"""
     
-    def __init__(self, size=256, wave="bior1.3"):
+    # 分块计算时每块上下额外读取的像素行数(偶数)，保证块内小波系数与整图计算一致
+    TILE_HALO = 8
+    
+    def __init__(self, size=256, wave="bior1.3", tile_rows=256):
         self.size = size
         self.wave = wave
+        # 图像高度超过两块时按 tile_rows 行分块计算能量，为0时总是整图计算
+        self.tile_rows = tile_rows
         if WAVELETS_AVAILABLE:
             self.dwt = DWTForward(J=1, mode="symmetric", wave=wave)
+            self.filter_length = pywt.Wavelet(wave).dec_len
         else:
             self.dwt = None
     
@@ -57,7 +74,12 @@ class EnergyBasedCrop:
     
     
     def find_best_crop(self, energy_map, target_size):
-        """找到最佳裁剪位置"""
+        """
+        找到最佳裁剪位置
+
+        一次性计算所有候选窗口(步长 target_size // 4)的能量和，取能量最大的窗口；
+        并列时取按行扫描的第一个，与逐窗口求和的结果一致。
+        """
         h, w = energy_map.shape
         
         if target_size > h or target_size > w:
@@ -65,19 +87,75 @@ class EnergyBasedCrop:
         
         # 设置步长避免内存爆炸
         stride = max(target_size // 4, 16)
+        rows = (h - target_size) // stride + 1
+        cols = (w - target_size) // stride + 1
+        
+        if target_size % stride == 0:
+            # 窗口由整数个 stride×stride 小块组成: 先求每个小块的能量和(只遍历一次能量图)，
+            # 再在小块网格上求窗口和
+            blocks = target_size // stride
+            grid_h, grid_w = rows + blocks - 1, cols + blocks - 1
+            cells = self._block_sums(energy_map[:grid_h * stride], stride, grid_w)
+            return self._best_window(cells, blocks, stride)
+        
+        window_energy = self._box_sum(energy_map, target_size, stride, rows, cols)
+        # argmax 在并列时返回第一个最大值的位置
+        best_y, best_x = divmod(int(torch.argmax(window_energy)), cols)
+        return best_x * stride, best_y * stride
+    
+    def locate_best_crop(self, image: Image.Image, target_size):
+        """
+        在RGB图像上找到最佳裁剪位置(能量图坐标)，结果与 find_best_crop(compute_energy_map(...)) 一致
         
-        max_energy = -1
-        best_x, best_y = 0, 0
-        
-        # 滑动窗口寻找最大能量区域
-        for y in range(0, h - target_size + 1, stride):
-            for x in range(0, w - target_size + 1, stride):
-                window_energy = energy_map[y:y+target_size, x:x+target_size].sum().item()
-                if window_energy > max_energy:
-                    max_energy = window_energy
-                    best_x, best_y = x, y
-        
-        return best_x, best_y
+        大图按行分块计算小波能量并累加到小块能量网格，不构造整图的浮点张量和能量图，峰值内存与图像高度无关。
+        """
+        stride = max(target_size // 4, 16)
+        w, h = image.size
+        if (self.dwt is None or target_size % stride != 0 or self.tile_rows <= 0 or h <= 2 * self.tile_rows):
+            return self.find_best_crop(self.compute_energy_map(transforms.ToTensor()(image)), target_size)
+        
+        # 能量图尺寸与整图小波变换的系数尺寸一致
+        energy_h = pywt.dwt_coeff_len(h, self.filter_length, 'symmetric')
+        energy_w = pywt.dwt_coeff_len(w, self.filter_length, 'symmetric')
+        if target_size > energy_h or target_size > energy_w:
+            raise ValueError(f"目标尺寸 {target_size} 大于图像尺寸 {energy_h}x{energy_w}")
+        grid_h, grid_w = energy_h // stride, energy_w // stride
+        
+        # 每块覆盖整数个小块行: 能量图行 [k0, k1) 对应原图行 [2*k0, 2*k1)，上下各多读 TILE_HALO 行
+        tile_energy_rows = max(self.tile_rows // 2 // stride, 1) * stride
+        cells = []
+        for k0 in range(0, grid_h * stride, tile_energy_rows):
+            k1 = min(k0 + tile_energy_rows, grid_h * stride)
+            top = max(2 * k0 - self.TILE_HALO, 0)
+            bottom = min(2 * k1 + self.TILE_HALO, h)
+            band = transforms.ToTensor()(image.crop((0, top, w, bottom)))
+            # 块内第 j 行系数对应整图第 j + top/2 行
+            energy = self.compute_energy_map(band)[k0 - top // 2:k1 - top // 2]
+            cells.append(self._block_sums(energy, stride, grid_w))
+        return self._best_window(torch.cat(cells), target_size // stride, stride)
+    
+    @staticmethod
+    def _block_sums(energy_rows, stride, grid_w):
+        """能量图(行数为 stride 的整数倍)中每个 stride×stride 小块的能量和"""
+        cells = energy_rows[:, :grid_w * stride]
+        return cells.reshape(cells.shape[0] // stride, stride, grid_w, stride).sum(dim=(1, 3))
+    
+    def _best_window(self, cells, blocks, stride):
+        """在小块能量网格上找到能量和最大的 blocks×blocks 窗口，返回其左上角的能量图坐标"""
+        rows, cols = cells.shape[0] - blocks + 1, cells.shape[1] - blocks + 1
+        window_energy = self._box_sum(cells, blocks, 1, rows, cols)
+        # argmax 在并列时返回第一个最大值的位置
+        best_y, best_x = divmod(int(torch.argmax(window_energy)), cols)
+        return best_x * stride, best_y * stride
+    
+    @staticmethod
+    def _box_sum(values, size, stride, rows, cols):
+        """用积分图计算左上角为 (i*stride, j*stride)、边长为 size 的各窗口之和，float64累加避免精度损失"""
+        integral = F.pad(values.to(torch.float64).cumsum(0).cumsum(1), (1, 0, 1, 0))
+        top = torch.arange(rows, device=values.device)[:, None] * stride
+        left = torch.arange(cols, device=values.device)[None, :] * stride
+        bottom, right = top + size, left + size
+        return integral[bottom, right] - integral[top, right] - integral[bottom, left] + integral[top, left]
     
     def __call__(self, img):
         """执行基于能量的裁剪"""
@@ -102,6 +180,30 @@ class EnergyBasedCrop:
         return transforms.functional.crop(img, y * 2, x * 2, self.size, self.size)
 
 
+def extract_energy_patch(energy_crop: EnergyBasedCrop, original_image: Image.Image):
+    """用给定的能量裁剪器从RGB图像中提取energy patch，返回 (patch, patch位置信息)"""
+    logger.info(f"原始图像尺寸: {original_image.size}")
+    
+    # 计算能量图并找到最佳裁剪位置(大图分块计算)
+    best_x, best_y = energy_crop.locate_best_crop(original_image, 256 // 2)
+    
+    # 执行裁剪得到energy patch
+    energy_patch = transforms.functional.crop(original_image, best_y * 2, best_x * 2, 256, 256)
+    
+    # 保存patch信息
+    patch_info = {
+        'x': best_x * 2,
+        'y': best_y * 2, 
+        'width': 256,
+        'height': 256,
+        'original_size': original_image.size
+    }
+    
+    logger.info(f"Energy patch位置: x={patch_info['x']}, y={patch_info['y']}, size=256x256")
+    
+    return energy_patch, patch_info
+
+
 class BasicBlock(nn.Module):
     """ResNet基础块"""
     expansion = 1
@@ -199,7 +301,13 @@ class SAFEResNet(nn.Module):
         self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
         self.fc1 = nn.Linear(512, num_classes)
         
+        # DWT算子缓存，不注册为子模块，不影响权重文件
+        self._dwt_cache = {}
+        
         self._initialize_weights()
+        
+        # int8静态量化后的卷积主干(见 SAFETrunk)，为None时使用上面的fp32各层
+        self.quantized_trunk = None
     
     def _make_layer(self, block, planes, blocks, stride=1):
         """构建ResNet层"""
@@ -228,6 +336,15 @@ class SAFEResNet(nn.Module):
                 nn.init.constant_(m.weight, 1)
                 nn.init.constant_(m.bias, 0)
     
+    def _get_dwt(self, mode, wave, device):
+        """按参数和设备复用DWT算子，避免每次前向传播重新构建滤波器"""
+        key = (mode, wave, str(device))
+        dwt_transform = self._dwt_cache.get(key)
+        if dwt_transform is None:
+            dwt_transform = DWTForward(J=1, mode=mode, wave=wave).to(device)
+            self._dwt_cache[key] = dwt_transform
+        return dwt_transform
+    
     def _preprocess_dwt(self, x, mode="symmetric", wave="bior1.3"):
         """DWT预处理"""
         if not WAVELETS_AVAILABLE:
@@ -235,7 +352,7 @@ class SAFEResNet(nn.Module):
             return x
         
         try:
-            dwt_transform = DWTForward(J=1, mode=mode, wave=wave).to(x.device)
+            dwt_transform = self._get_dwt(mode, wave, x.device)
             Yl, Yh = dwt_transform(x)
             # 返回垂直方向的高频系数
             result = Yh[0][:, :, 2, :, :]
@@ -246,10 +363,24 @@ class SAFEResNet(nn.Module):
             logger.error(f"DWT预处理失败: {e}, 使用原始图像")
             return x
     
-    def forward(self, x):
-        """前向传播"""
+    def forward(self, x, return_features=False):
+        """前向传播，return_features 为True时同时返回layer2特征图(用于热力图)"""
         # DWT预处理
         x = self._preprocess_dwt(x)
+        features = self.forward_trunk(x)
+        
+        x = self.avgpool(features)
+        x = torch.flatten(x, 1)
+        x = self.fc1(x)
+        
+        if return_features:
+            return x, features
+        return x
+    
+    def forward_trunk(self, x):
+        """DWT之后的卷积主干(conv1~layer2)，返回layer2特征图"""
+        if self.quantized_trunk is not None:
+            return self.quantized_trunk(x)
         
         x = self.conv1(x)
         x = self.bn1(x)
@@ -257,26 +388,64 @@ class SAFEResNet(nn.Module):
         x = self.maxpool(x)
         
         x = self.layer1(x)
-        x = self.layer2(x)
-        
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x = self.fc1(x)
-        
-        return x
+        return self.layer2(x)
+
+
+class SAFETrunk(nn.Module):
+    """
+    SAFEResNet的卷积主干，作为int8静态量化的对象
+    
+    DWT预处理包含日志与异常回退，无法被torch.fx追踪，保持fp32在主干之外执行；
+    avgpool与fc1计算量很小，同样保持fp32。
+    """
+    
+    def __init__(self, model: SAFEResNet):
+        super(SAFETrunk, self).__init__()
+        self.conv1 = model.conv1
+        self.bn1 = model.bn1
+        self.relu = model.relu
+        self.maxpool = model.maxpool
+        self.layer1 = model.layer1
+        self.layer2 = model.layer2
+    
+    def forward(self, x):
+        x = self.maxpool(self.relu(self.bn1(self.conv1(x))))
+        return self.layer2(self.layer1(x))
+
+
+class InferenceContext:
+    """
+    单次预测的中间结果，由调用方创建并在请求内传递给热力图生成
+    
+    模型实例不保存任何请求相关的状态，多个线程可并发调用同一个 SAFEModel。
+    """
+    
+    def __init__(self, capture_features: bool = False):
+        self.capture_features = capture_features  # 是否在前向传播中保留layer2特征图
+        self.features = None      # layer2特征图([1, C, H, W])，仅在 capture_features 为True时保留
 
 
 class SAFEModel:
     """SAFE模型服务"""
     
-    def __init__(self, model_path: str, device: str = 'cpu'):
+    def __init__(self, model_path: str, device: str = 'cpu', max_batch_size: int = 1, max_wait_ms: float = 0.0,
+                 save_debug_patch: bool = False, energy_tile_rows: int = 256, precision: str = 'fp32',
+                 calibration_dir: str = '', calibration_samples: int = 64):
         self.model_path = './20250509_204548-2.5allprocess'
         self.device = device if torch.cuda.is_available() else 'cpu'
         self.model = None
-        self.last_energy_patch = None  # 保存最后一次的energy patch
-        self.last_patch_info = None    # 保存patch的位置信息
+        # 每次预测都把energy patch写入同一个调试文件，仅用于本地调试
+        self.save_debug_patch = save_debug_patch
+        self.energy_crop = EnergyBasedCrop(size=256, tile_rows=energy_tile_rows)  # 复用能量裁剪及其DWT算子
         logger.info(f"初始化SAFEModel - 模型路径: {self.model_path}, 设备: {self.device}")
         self._load_model()
+        # 实际使用的推理精度，转换失败或不适用时回退为fp32
+        self.precision = self._apply_precision(precision, calibration_dir, calibration_samples)
+        # 并发请求的patch合并为一次批量前向传播
+        self.batcher = MicroBatcher(
+            'ai_image_detection', 'SAFEResNet', self._forward_requests,
+            max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        )
     
     def _load_model(self):
         """加载模型"""
@@ -321,36 +490,68 @@ class SAFEModel:
             logger.error(f"详细错误信息: {traceback.format_exc()}")
             self.model = None
     
-    def _extract_energy_patch(self, image_path: str):
-        """提取基于能量的patch"""
-        # 加载原始图像
-        original_image = Image.open(image_path).convert('RGB')
-        logger.info(f"原始图像尺寸: {original_image.size}")
-        
-        # 创建EnergyBasedCrop实例
-        energy_crop = EnergyBasedCrop(size=256)
-        
-        # 计算能量图并找到最佳patch
-        img_tensor = transforms.ToTensor()(original_image)
-        energy_map = energy_crop.compute_energy_map(img_tensor)
+    def _apply_precision(self, precision: str, calibration_dir: str, calibration_samples: int) -> str:
+        """按配置转换模型的推理精度，返回实际使用的精度"""
+        try:
+            precision = quantization.resolve_precision(precision)
+        except ValueError as e:
+            logger.error(f"{e}，使用fp32")
+            return 'fp32'
+        if precision == 'fp32' or self.model is None:
+            return 'fp32'
+        if self.device != 'cpu':
+            logger.warning(f"推理精度 {precision} 仅用于CPU推理，设备 {self.device} 使用fp32")
+            return 'fp32'
         
-        # 找到最佳裁剪位置
-        best_x, best_y = energy_crop.find_best_crop(energy_map, 256 // 2)
-        
-        # 执行裁剪得到energy patch
-        energy_patch = transforms.functional.crop(original_image, best_y * 2, best_x * 2, 256, 256)
-        
-        # 保存patch信息
-        patch_info = {
-            'x': best_x * 2,
-            'y': best_y * 2, 
-            'width': 256,
-            'height': 256,
-            'original_size': original_image.size
-        }
+        try:
+            if precision == 'int8_dynamic':
+                # SAFEResNet中只有分类头fc1是线性层，卷积主干仍为fp32，加速有限；卷积网络应使用int8_static
+                quantization.quantize_dynamic(self.model, inplace=True)
+            elif precision == 'int8_static':
+                batches = self._calibration_batches(calibration_dir, calibration_samples)
+                if not batches:
+                    logger.warning(f"校准目录中没有可用图像: '{calibration_dir}'，int8_static回退为fp32")
+                    return 'fp32'
+                self.model.quantized_trunk = quantization.quantize_static(SAFETrunk(self.model), batches)
+            elif precision == 'bf16':
+                # oneDNN的bf16卷积在channels_last布局下才能利用AMX/AVX512-BF16
+                self.model.to(memory_format=torch.channels_last)
+        except Exception as e:
+            logger.error(f"转换推理精度 {precision} 失败: {e}, 使用fp32")
+            return 'fp32'
         
-        logger.info(f"Energy patch位置: x={patch_info['x']}, y={patch_info['y']}, size=256x256")
+        logger.info(f"SAFE模型推理精度: {precision}")
+        return precision
+    
+    def _calibration_batches(self, calibration_dir: str, max_samples: int, batch_size: int = 8) -> List[torch.Tensor]:
+        """读取校准目录(含子目录)中的图像，提取energy patch并做DWT预处理，按批返回卷积主干的输入"""
+        if not calibration_dir or not os.path.isdir(calibration_dir):
+            return []
+        
+        image_paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(calibration_dir)
+            for name in names if name.lower().endswith(IMAGE_EXTENSIONS)
+        )[:max_samples]
+        
+        to_tensor = transforms.ToTensor()
+        patches = []
+        for image_path in image_paths:
+            try:
+                energy_patch, _ = extract_energy_patch(self.energy_crop, decode_image(image_path))
+                patches.append(to_tensor(energy_patch))
+            except Exception as e:
+                logger.warning(f"跳过无法读取的校准图像 {image_path}: {e}")
         
+        with torch.no_grad():
+            return [
+                self.model._preprocess_dwt(torch.stack(patches[i:i + batch_size]))
+                for i in range(0, len(patches), batch_size)
+            ]
+    
+    def _extract_energy_patch(self, original_image: Image.Image):
+        """提取基于能量的patch"""
+        energy_patch, patch_info = extract_energy_patch(self.energy_crop, original_image)
         return energy_patch, patch_info, original_image
 
     def predict(self, image_path: str) -> Dict[str, Any]:
@@ -361,102 +562,86 @@ class SAFEModel:
             logger.error("模型未加载，返回备选结果")
             return self._fallback_prediction(image_path)
         
+        # 加载原始图像
+        original_image = decode_image(image_path)
+        return self.predict_image(original_image)
+    
+    def predict_image(self, original_image: Image.Image, context: Optional[InferenceContext] = None) -> Dict[str, Any]:
+        """
+        对已解码的RGB图像进行预测
+        
+        给定 context 时按需写入本次预测的layer2特征图，供热力图使用；patch位置在结果的 patch_info 中
+        """
+        if self.model is None:
+            logger.error("模型未加载，返回备选结果")
+            return self._fallback_prediction(original_image)
+        
         # 提取energy patch
-        energy_patch, patch_info, original_image = self._extract_energy_patch(image_path)
+        with span('_extract_energy_patch'), observe_inference('ai_image_detection', 'SAFEResNet', 'energy_patch'):
+            energy_patch, patch_info, original_image = self._extract_energy_patch(original_image)
         
-        # 保存用于热力图生成
-        self.last_energy_patch = energy_patch
-        self.last_patch_info = patch_info
+        capture_features = context is not None and context.capture_features
         
         # 保存调试图像
-        debug_path = os.path.join(os.path.dirname(__file__), 'debug_energy_patch.jpg')
-        energy_patch.save(debug_path)
-        logger.info(f"Energy patch已保存: {debug_path}")
+        if self.save_debug_patch:
+            debug_path = os.path.join(os.path.dirname(__file__), 'debug_energy_patch.jpg')
+            energy_patch.save(debug_path)
+            logger.info(f"Energy patch已保存: {debug_path}")
         
         # 预处理energy patch
-        logger.info("开始图像预处理...")
-        transform = transforms.Compose([
-            transforms.ToTensor(),      # 转换为张量
-        ])
-        input_tensor = transform(energy_patch).unsqueeze(0).to(self.device)
-        logger.info(f"预处理完成，张量形状: {input_tensor.shape}")
-        
-        # 预测
-        logger.info("开始模型推理...")
-        with torch.no_grad():
-            outputs = self.model(input_tensor)
-            logger.info(f"模型输出: {outputs}")
-            
-            probabilities = torch.softmax(outputs, dim=1)
-            logger.info(f"概率分布: {probabilities}")
-            
-            confidence, predicted = torch.max(probabilities, 1)
-            logger.info(f"预测类别: {predicted.item()}, 置信度: {confidence.item()}")
-            
-            # 0: real, 1: fake
-            prediction = 'fake' if predicted.item() == 1 else 'real'
-            confidence_score = confidence.item()
-            
-            result = {
-                'prediction': prediction,
-                'confidence': float(confidence_score),
-                'probabilities': {
-                    'real': float(probabilities[0][0]),
-                    'fake': float(probabilities[0][1])
-                },
-                'patch_info': patch_info  # 添加patch信息
-            }
-            logger.info(f"预测结果: {result}")
-            return result
-    
-    
-    def generate_heatmap(self, image_path: str, output_path: str) -> Tuple[bool, np.ndarray]:
-        """生成检测热力图并返回热力图数据"""
-        if self.model is None:
-            return False, None
+        input_tensor = transforms.ToTensor()(energy_patch)
         
-        try:
-            # 使用保存的energy patch
-            if self.last_energy_patch is None:
-                logger.error("没有energy patch，无法生成热力图")
-                return False, None
-                
-            energy_patch = self.last_energy_patch
-            transform = transforms.Compose([
-                transforms.ToTensor(),
-            ])
-            input_tensor = transform(energy_patch).unsqueeze(0).to(self.device)
-            
-            # 使用类似Grad-CAM的方法生成热力图
-            with torch.no_grad():
-                # 获取模型的中间特征
-                x = self.model._preprocess_dwt(input_tensor)
-                x = self.model.conv1(x)
-                x = self.model.bn1(x)
-                x = self.model.relu(x)
-                x = self.model.maxpool(x)
-                x = self.model.layer1(x)
-                feature_maps = self.model.layer2(x)
-                
-                # 计算特征重要性
-                importance = torch.mean(feature_maps, dim=1, keepdim=True)
-                heatmap = F.interpolate(importance, size=(256, 256), mode='bilinear', align_corners=False)
-                heatmap = heatmap.squeeze().cpu().numpy()
-                
-                # 归一化到0-255
-                heatmap = (heatmap - heatmap.min()) / (heatmap.max() - heatmap.min() + 1e-8)
-                heatmap = (heatmap * 255).astype(np.uint8)
-                
-                # 应用颜色映射
-                import cv2
-                heatmap_colored = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
-                
-                # 保存热力图
-                cv2.imwrite(output_path, heatmap_colored)
-                
-                return True, heatmap
-                
-        except Exception as e:
-            logger.error(f"热力图生成失败: {e}")
-            return False, None
-    
\ No newline at end of file
+        # 预测: 经微批处理器与其他并发请求合并推理，包含排队时间
+        with span('SAFEResNet.forward'):
+            probabilities, features = self.batcher.submit((input_tensor, capture_features))
+        if context is not None:
+            context.features = features
+        
+        result = self.build_result(probabilities, patch_info)
+        logger.info(f"预测结果: {result}")
+        return result
+    
+    @staticmethod
+    def build_result(probabilities: torch.Tensor, patch_info: Dict[str, Any]) -> Dict[str, Any]:
+        """由类别概率与patch信息构造预测结果"""
+        confidence, predicted = torch.max(probabilities, 0)
+        
+        # 0: real, 1: fake
+        prediction = 'fake' if predicted.item() == 1 else 'real'
+        confidence_score = confidence.item()
+        
+        return {
+            'prediction': prediction,
+            'confidence': float(confidence_score),
+            'probabilities': {
+                'real': float(probabilities[0]),
+                'fake': float(probabilities[1])
+            },
+            'patch_info': patch_info  # 添加patch信息
+        }
+    
+    def forward_batch(self, patches: List[torch.Tensor], return_features: bool = False) -> List[Any]:
+        """
+        对一组energy patch([3, 256, 256])做一次批量前向传播，返回各自的类别概率
+        
+        return_features 为True时返回 (类别概率, layer2特征图[1, C, H, W]) 列表，特征图为批量结果的切片
+        """
+        input_tensor = torch.stack(patches).to(self.device)
+        with torch.no_grad():
+            with observe_inference('ai_image_detection', 'SAFEResNet', 'forward'), quantization.autocast(self.precision):
+                outputs, features = self.model(input_tensor, return_features=True)
+            probabilities = torch.softmax(outputs.float(), dim=1).cpu()
+        logger.info(f"批量推理完成，批大小: {len(patches)}")
+        if not return_features:
+            return list(probabilities)
+        features = features.float().cpu()
+        return [(probabilities[i], features[i:i + 1]) for i in range(len(patches))]
+    
+    def _forward_requests(self, requests: List[Tuple[torch.Tensor, bool]]) -> List[Tuple[torch.Tensor, Any]]:
+        """微批处理入口: 每个请求为 (energy patch, 是否需要layer2特征图)，返回 (类别概率, 特征图或None)"""
+        outputs = self.forward_batch([patch for patch, _ in requests], return_features=True)
+        # 只为需要的请求复制特征图，不保留整批结果
+        return [
+            (probs, features.clone() if capture else None)
+            for (probs, features), (_, capture) in zip(outputs, requests)
+        ]
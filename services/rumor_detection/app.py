@@ -3,15 +3,17 @@
 """
 import sys
 import os
-import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from flask import Flask, request, jsonify
 from werkzeug.exceptions import RequestEntityTooLarge
 from shared.response_models import APIResponse
+from shared.metrics import register_flask_metrics
+from shared.tracing import register_flask_tracing, span
 from shared.exceptions import ValidationException, ProcessingException
+from shared.imaging import decode_image
 from config import SERVICE_PORT, SERVICE_NAME, SERVICE_VERSION, MAX_CONTENT_LENGTH, UPLOAD_FOLDER
-from services import get_rumor_detection_service
+from services import get_rumor_detection_service, PREPROCESS_SIZE
 
 
 def create_app():
@@ -25,6 +27,12 @@ def create_app():
     # 创建上传目录
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     
+    # 请求与推理指标，GET /metrics
+    register_flask_metrics(app, 'rumor_detection')
+    
+    # 请求ID与链路追踪
+    register_flask_tracing(app, 'rumor_detection')
+    
     return app
 
 
@@ -64,15 +72,16 @@ def detect_rumor():
         if len(content) > 10000:
             print("[DEBUG] 文本内容过长")
             raise ValidationException("文本内容过长，最大支持10000字符")
-        ext = os.path.splitext(image_file.filename)[-1].lower()
-        filename = f"rumor_{int(time.time())}{ext}"
-        save_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        print(f"[DEBUG] 保存图片到: {save_path}")
-        image_file.save(save_path)
-        image_path = save_path
-        print(f"[DEBUG] 调用service.detect_rumor_sync(content, image_path)")
+        # 直接从上传流解码，JPEG按CLIP输入尺寸缩小解码，不再写入临时文件
+        with span('decode_upload'):
+            try:
+                image = decode_image(image_file.stream, min_size=PREPROCESS_SIZE)
+            except Exception as e:
+                print(f"[DEBUG] 图片解码失败: {e}")
+                raise ValidationException(f"图片文件无效: {str(e)}")
+        print(f"[DEBUG] 调用service.detect_rumor_sync(content, image=image)")
         service = get_rumor_detection_service()
-        result = service.detect_rumor_sync(content, image_path)
+        result = service.detect_rumor_sync(content, image=image)
         print(f"[DEBUG] 同步检测完成，结果: {result}")
         return jsonify(result)
     except ValidationException as e:
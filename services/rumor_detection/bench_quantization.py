@@ -0,0 +1,89 @@
+"""
+推理精度对比
+在留出集上依次以各推理精度运行C3N模型，报告吞吐量以及与fp32的预测一致率、概率差与准确率差。
+留出集为JSON Lines文件，每行 {"content": 文本, "image": 图片路径, "label": 1(谣言)/0(非谣言)}，
+label 缺失时只报告与fp32的一致率。预处理对所有精度只执行一次，吞吐量只统计批量前向传播。
+
+用法: python bench_quantization.py --data <留出集.jsonl> [--calibration-file <校准集.jsonl>]
+                                  [--precisions fp32 int8_dynamic int8_static bf16] [--batch-size 8]
+"""
+import argparse
+import gc
+import time
+
+import torch
+
+from config import QUANTIZATION_CONFIG
+from services import RumorDetectionService, load_samples
+from shared.quantization import PRECISIONS, compare_predictions
+
+
+def run(service, batches, samples):
+    """批量前向传播全部样本，返回 (类别概率[N, 2], 每秒处理的样本数)"""
+    service._forward_batch(batches[0])  # 预热，排除首次调用的算子初始化
+    start = time.perf_counter()
+    probabilities = [probs for batch in batches for probs in service._forward_batch(batch)]
+    elapsed = time.perf_counter() - start
+    return torch.stack(probabilities), samples / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='C3N模型推理精度对比')
+    parser.add_argument('--data', required=True, help='留出集JSON Lines文件')
+    parser.add_argument('--calibration-file', default=QUANTIZATION_CONFIG['calibration_file'],
+                        help='int8_static的校准集JSON Lines文件，应与留出集不重叠')
+    parser.add_argument('--calibration-samples', type=int, default=QUANTIZATION_CONFIG['calibration_samples'])
+    parser.add_argument('--precisions', nargs='+', default=list(PRECISIONS), choices=PRECISIONS)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--max-samples', type=int, default=0, help='最多使用的留出集样本数，0为全部')
+    parser.add_argument('--seed', type=int, default=0, help='未找到权重文件时分类头随机初始化所用的种子')
+    args = parser.parse_args()
+
+    samples = load_samples(args.data, args.max_samples)
+    if not samples:
+        parser.error(f"留出集中没有样本: {args.data}")
+    labelled = all('label' in sample for sample in samples)
+    labels = torch.tensor([int(sample['label']) for sample in samples]) if labelled else None
+
+    precisions = ['fp32'] + [p for p in args.precisions if p != 'fp32']
+    batches, reference, reference_speed = None, None, None
+    rows = []
+    for precision in precisions:
+        # 每次只保留一个模型实例；各精度从相同的fp32权重转换(无权重文件时使用相同的随机初始化)
+        torch.manual_seed(args.seed)
+        service = RumorDetectionService({
+            'precision': precision,
+            'calibration_file': args.calibration_file,
+            'calibration_samples': args.calibration_samples
+        })
+        if service.model is None:
+            parser.error("C3N模型初始化失败")
+        if batches is None:
+            inputs = [service._prepare_input_data(sample['content'], sample.get('image')) for sample in samples]
+            batches = [inputs[i:i + args.batch_size] for i in range(0, len(inputs), args.batch_size)]
+
+        if service.precision != precision:
+            rows.append(f"{precision:>14} 不可用，已回退为 {service.precision}")
+        else:
+            probabilities, speed = run(service, batches, len(samples))
+            if precision == 'fp32':
+                reference, reference_speed = probabilities, speed
+            report = compare_predictions(reference, probabilities, labels)
+            row = (f"{precision:>14} {speed:>11.1f} {speed / reference_speed:>7.2f} {report['agreement']:>8.2%} "
+                   f"{report['max_prob_diff']:>10.4f} {report['mean_prob_diff']:>10.4f}")
+            if labels is not None:
+                row += f" {report['accuracy']:>8.2%} {report['accuracy_delta']:>+9.2%}"
+            rows.append(row)
+        del service
+        gc.collect()
+
+    print(f"留出集: {len(samples)} 条{'(有标签)' if labels is not None else '(无标签)'}，批大小: {args.batch_size}")
+    header = f"{'精度':>14} {'吞吐(条/s)':>11} {'加速比':>7} {'一致率':>8} {'最大概率差':>10} {'平均概率差':>10}"
+    if labels is not None:
+        header += f" {'准确率':>8} {'准确率差':>9}"
+    print(header)
+    print('\n'.join(rows))
+
+
+if __name__ == '__main__':
+    main()
@@ -22,4 +22,19 @@ MODEL_CONFIG = {
     'name': 'rumor_detection_v1',
     'version': '1.0.0',
     'confidence_threshold': 0.7
-} 
\ No newline at end of file
+} 
+
+# 动态微批处理: 并发请求在等待窗口内合并为一次批量前向传播，max_batch_size 为1时关闭
+MICRO_BATCH_CONFIG = {
+    'max_batch_size': int(os.getenv('MICRO_BATCH_MAX_SIZE', 8)),   # 单批最大样本数
+    'max_wait_ms': float(os.getenv('MICRO_BATCH_MAX_WAIT_MS', 5))  # 凑批等待窗口(毫秒)
+}
+
+# CPU推理精度: fp32 / int8_dynamic / int8_static / bf16，CPU不支持或转换失败时回退为fp32
+# 量化只作用于冻结的CLIP编码器；int8_static 从 calibration_file 读取最多 calibration_samples 条样本校准，
+# 文件每行一个JSON: {"content": 文本, "image": 图片路径}；切换前用 bench_quantization.py 在留出集上对比与fp32的差异
+QUANTIZATION_CONFIG = {
+    'precision': os.getenv('INFERENCE_PRECISION', 'fp32'),
+    'calibration_file': os.getenv('QUANT_CALIBRATION_FILE', ''),
+    'calibration_samples': int(os.getenv('QUANT_CALIBRATION_SAMPLES', 64))
+}
@@ -6,12 +6,19 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) )
 
 import time
+import json
 import random
 from typing import Dict, Any, List
 from datetime import datetime
 from shared.utils import generate_task_id
 from shared.response_models import DetectionStatus
+from shared.metrics import observe_inference
+from shared.tracing import span
+from shared.batching import MicroBatcher
+from shared.imaging import decode_image
+from shared import quantization
 from models import RumorDetectionTask, RumorDetectionResult
+from config import MICRO_BATCH_CONFIG, QUANTIZATION_CONFIG
 
 # === 导入C3N模型相关 ===
 import torch
@@ -22,11 +29,14 @@ from C3N_models import C3N
 import cn_clip.clip as clip
 
 # === 预处理函数定义 ===
+# CLIP输入边长，JPEG解码时据此在DCT域缩小
+PREPROCESS_SIZE = 224
+
 def clip_preprocess():
     """CLIP图像预处理函数"""
     return Compose([
-        Resize(224, interpolation=3),
-        CenterCrop(224),
+        Resize(PREPROCESS_SIZE, interpolation=3),
+        CenterCrop(PREPROCESS_SIZE),
         ToTensor(),
         Normalize((0.48145466, 0.4578275, 0.40821073), (0.26862954, 0.26130258, 0.27577711))
     ])
@@ -51,11 +61,35 @@ def chinese_tokenize(text, context_length=30):
     
     return tokens  # 确保返回 [1, context_length] 的形状
 
+def load_samples(path: str, max_samples: int = 0) -> List[Dict[str, Any]]:
+    """
+    读取JSON Lines样本文件(量化校准与精度对比使用)
+
+    每行包含 content 与 image(图片路径，相对路径相对于样本文件所在目录)，可选 label(1: 谣言, 0: 非谣言)
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    samples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            sample = json.loads(line)
+            if sample.get('image'):
+                sample['image'] = os.path.join(base_dir, sample['image'])
+            samples.append(sample)
+            if max_samples and len(samples) >= max_samples:
+                break
+    return samples
+
 class RumorDetectionService:
     """图文谣言检测服务"""
-    def __init__(self):
+    def __init__(self, quantization_config: Dict[str, Any] = None):
         self.tasks = {}
         self.model_version = "C3N-v1.0"
+        # 按状态累计的任务数，统计接口无需遍历全部任务
+        self.completed_tasks = 0
+        self.failed_tasks = 0
         
         # 设置设备
         self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
@@ -98,6 +132,12 @@ class RumorDetectionService:
             import traceback
             traceback.print_exc()
             self.model = None
+        
+        # 实际使用的推理精度，转换失败或不适用时回退为fp32
+        self.precision = self._apply_precision(**(quantization_config or QUANTIZATION_CONFIG))
+        
+        # 并发请求合并为一次批量前向传播
+        self.batcher = MicroBatcher('rumor_detection', 'C3N', self._forward_batch, **MICRO_BATCH_CONFIG)
 
     def detect_rumor(self, content: str, image_path: str = None) -> RumorDetectionTask:
         task_id = generate_task_id()
@@ -111,7 +151,7 @@ class RumorDetectionService:
         self._process_detection(task)
         return task
 
-    def detect_rumor_sync(self, content: str, image_path: str = None) -> Dict[str, Any]:
+    def detect_rumor_sync(self, content: str, image_path: str = None, image: Image.Image = None) -> Dict[str, Any]:
         """同步检测谣言，直接返回结果 - 参考main.py的推理方法"""
         try:
             print(f"开始同步处理谣言检测: {content[:50]}...")
@@ -119,16 +159,16 @@ class RumorDetectionService:
                 raise RuntimeError("C3N模型未初始化")
             
             # 准备输入数据
-            data = self._prepare_input_data(content, image_path)
+            with span('_prepare_input_data'), observe_inference('rumor_detection', 'C3N', 'preprocess'):
+                data = self._prepare_input_data(content, image_path, image)
             
-            # 模型推理 - 参考main.py的compute_test方法
-            with torch.no_grad():
-                logits = self.model(data)
-                probs = F.softmax(logits, dim=1)
+            # 模型推理 - 参考main.py的compute_test方法，经微批处理器与其他并发请求合并推理
+            with span('C3N.forward'):
+                probs = self.batcher.submit(data)
             
             # 解析结果
-            is_rumor = bool(torch.argmax(probs, dim=1).item())
-            confidence = probs[0, int(is_rumor)].item()
+            is_rumor = bool(torch.argmax(probs).item())
+            confidence = probs[int(is_rumor)].item()
             
             print(f"[DEBUG] 推理结果 - is_rumor: {is_rumor}, confidence: {confidence:.3f}")
             
@@ -181,16 +221,17 @@ class RumorDetectionService:
                 "message": f"检测失败: {str(e)}"
             }
 
-    def _prepare_input_data(self, content: str, image_path: str = None) -> Dict[str, torch.Tensor]:
+    def _prepare_input_data(self, content: str, image_path: str = None, image: Image.Image = None) -> Dict[str, torch.Tensor]:
         """准备模型输入数据 - 适配C3N模型"""
         # 文本预处理 - 返回 [1, context_length]
         text_tensor = chinese_tokenize(content)
         text_input = text_tensor
         
-        # 图像预处理
-        if image_path and os.path.exists(image_path):
-            img = Image.open(image_path).convert("RGB")
-            image_tensor = PREPROCESS(img)
+        # 图像预处理: 已解码的图像直接使用，路径输入按CLIP输入尺寸缩小解码
+        if image is not None:
+            image_tensor = PREPROCESS(image)
+        elif image_path and os.path.exists(image_path):
+            image_tensor = PREPROCESS(decode_image(image_path, min_size=PREPROCESS_SIZE))
         else:
             image_tensor = torch.zeros(3, 224, 224)
         
@@ -207,6 +248,67 @@ class RumorDetectionService:
         
         return data
 
+    @staticmethod
+    def _collate(samples: List[Dict[str, torch.Tensor]]) -> Dict[str, torch.Tensor]:
+        """将多个样本的输入按batch维拼接"""
+        return {
+            'text_input': torch.cat([sample['text_input'] for sample in samples]),
+            'crop_input': torch.cat([sample['crop_input'] for sample in samples])
+        }
+
+    def _forward_batch(self, samples: List[Dict[str, torch.Tensor]]) -> List[torch.Tensor]:
+        """将多个样本的输入按batch维拼接后做一次前向传播，返回各自的类别概率"""
+        data = self._collate(samples)
+        with torch.no_grad(), observe_inference('rumor_detection', 'C3N', 'forward'):
+            with quantization.autocast(self.precision):
+                logits = self.model(data)
+            probs = F.softmax(logits.float(), dim=1).cpu()
+        return list(probs)
+
+    def _apply_precision(self, precision: str, calibration_file: str, calibration_samples: int) -> str:
+        """按配置转换冻结CLIP编码器的推理精度，返回实际使用的精度；分类头很小，保持fp32"""
+        try:
+            precision = quantization.resolve_precision(precision)
+        except ValueError as e:
+            print(f"[C3N] {e}，使用fp32")
+            return 'fp32'
+        if precision == 'fp32' or self.model is None:
+            return 'fp32'
+        if self.device != 'cpu':
+            print(f"[C3N] 推理精度 {precision} 仅用于CPU推理，设备 {self.device} 使用fp32")
+            return 'fp32'
+
+        try:
+            if precision == 'int8_dynamic':
+                quantization.quantize_dynamic(self.model.clip_model, inplace=True)
+            elif precision == 'int8_static':
+                # CLIP的Transformer无法被torch.fx追踪，只静态量化其中的线性层
+                batches = self._calibration_batches(calibration_file, calibration_samples)
+                if not batches:
+                    print(f"[C3N] 校准文件中没有可用样本: '{calibration_file}'，int8_static回退为fp32")
+                    return 'fp32'
+                quantization.quantize_static_linear(
+                    self.model.clip_model, lambda: [self.model(batch) for batch in batches]
+                )
+        except Exception as e:
+            print(f"[C3N] 转换推理精度 {precision} 失败: {e}，使用fp32")
+            import traceback
+            traceback.print_exc()
+            return 'fp32'
+
+        print(f"[C3N] 推理精度: {precision}")
+        return precision
+
+    def _calibration_batches(self, calibration_file: str, max_samples: int, batch_size: int = 8) -> List[Dict[str, torch.Tensor]]:
+        """读取校准样本并预处理，按批返回模型输入"""
+        if not calibration_file or not os.path.exists(calibration_file):
+            return []
+        samples = [
+            self._prepare_input_data(sample.get('content', ''), sample.get('image'))
+            for sample in load_samples(calibration_file, max_samples)
+        ]
+        return [self._collate(samples[i:i + batch_size]) for i in range(0, len(samples), batch_size)]
+
     def get_task_result(self, task_id: str) -> RumorDetectionTask:
         if task_id not in self.tasks:
             raise ValueError(f"任务不存在: {task_id}")
@@ -219,16 +321,16 @@ class RumorDetectionService:
             print(f"开始处理谣言检测任务: {task.task_id}")
             
             # 准备输入数据
-            data = self._prepare_input_data(task.content, task.image_path)
+            with span('_prepare_input_data'), observe_inference('rumor_detection', 'C3N', 'preprocess'):
+                data = self._prepare_input_data(task.content, task.image_path)
             
             # 模型推理
-            with torch.no_grad():
-                logits = self.model(data)
-                probs = F.softmax(logits, dim=1)
+            with span('C3N.forward'):
+                probs = self.batcher.submit(data)
             
             # 解析结果
-            is_rumor = bool(torch.argmax(probs, dim=1).item())
-            confidence = probs[0, int(is_rumor)].item()
+            is_rumor = bool(torch.argmax(probs).item())
+            confidence = probs[int(is_rumor)].item()
             
             # 生成推理结果
             reasoning = []
@@ -251,12 +353,14 @@ class RumorDetectionService:
             task.confidence = confidence
             task.status = DetectionStatus.COMPLETED
             task.completed_at = datetime.now()
+            self.completed_tasks += 1
             print(f"谣言检测完成: {task.task_id}, 结果: {'谣言' if is_rumor else '非谣言'}")
     
         except Exception as e:
             task.status = DetectionStatus.FAILED
             task.error_message = str(e)
             task.completed_at = datetime.now()
+            self.failed_tasks += 1
             print(f"谣言检测失败: {task.task_id}, 错误: {str(e)}")
             import traceback
             traceback.print_exc()
@@ -264,16 +368,16 @@ class RumorDetectionService:
     def get_service_stats(self) -> Dict[str, Any]:
         """获取服务统计信息"""
         total_tasks = len(self.tasks)
-        completed_tasks = sum(1 for task in self.tasks.values() if task.status == DetectionStatus.COMPLETED)
-        failed_tasks = sum(1 for task in self.tasks.values() if task.status == DetectionStatus.FAILED)
         
         return {
             'service_name': '图文谣言检测服务',
             'model_version': self.model_version,
+            'inference_precision': self.precision,
             'total_tasks': total_tasks,
-            'completed_tasks': completed_tasks,
-            'failed_tasks': failed_tasks,
-            'success_rate': (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
+            'completed_tasks': self.completed_tasks,
+            'failed_tasks': self.failed_tasks,
+            'success_rate': (self.completed_tasks / total_tasks * 100) if total_tasks > 0 else 0,
+            'micro_batching': self.batcher.get_stats()
         }
 
 
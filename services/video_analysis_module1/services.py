@@ -21,6 +21,9 @@ class VideoAnalysisModule1Service:
     def __init__(self):
         self.tasks = {}  # 简单的内存存储
         self.model_version = "video_analysis_module1_v1.0"
+        # 按状态累计的任务数，统计接口无需遍历全部任务
+        self.completed_tasks = 0
+        self.failed_tasks = 0
         print(f"[初始化] 视频分析模块1服务初始化完成，模型版本: {self.model_version}")
     
     def analyze_video(self, video_file: FileStorage) -> VideoAnalysisTask:
@@ -74,6 +77,7 @@ class VideoAnalysisModule1Service:
             task.result = result
             task.status = DetectionStatus.COMPLETED
             task.completed_at = datetime.now()
+            self.completed_tasks += 1
             
             print(f"视频质量分析完成: {task.task_id}, 质量评分: {result.quality_score}")
             
@@ -82,6 +86,7 @@ class VideoAnalysisModule1Service:
             task.status = DetectionStatus.FAILED
             task.error_message = str(e)
             task.completed_at = datetime.now()
+            self.failed_tasks += 1
             
             print(f"视频质量分析失败: {task.task_id}, 错误: {str(e)}")
     
@@ -120,16 +125,14 @@ class VideoAnalysisModule1Service:
     def get_service_stats(self) -> Dict[str, Any]:
         """获取服务统计信息"""
         total_tasks = len(self.tasks)
-        completed_tasks = sum(1 for task in self.tasks.values() if task.status == DetectionStatus.COMPLETED)
-        failed_tasks = sum(1 for task in self.tasks.values() if task.status == DetectionStatus.FAILED)
         
         return {
             'service_name': '视频分析模块1 - 视频内容质量分析',
             'model_version': self.model_version,
             'total_tasks': total_tasks,
-            'completed_tasks': completed_tasks,
-            'failed_tasks': failed_tasks,
-            'success_rate': (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0,
+            'completed_tasks': self.completed_tasks,
+            'failed_tasks': self.failed_tasks,
+            'success_rate': (self.completed_tasks / total_tasks * 100) if total_tasks > 0 else 0,
             'features': ['视频质量评估', '分辨率分析', '清晰度检测', '画面稳定性分析']
         }
 
@@ -9,6 +9,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(
 from flask import Flask, request
 from werkzeug.exceptions import RequestEntityTooLarge
 from shared.response_models import APIResponse
+from shared.metrics import register_flask_metrics
+from shared.tracing import register_flask_tracing
 from shared.exceptions import ValidationException
 from config import SERVICE_PORT, SERVICE_NAME, SERVICE_VERSION, MAX_CONTENT_LENGTH, UPLOAD_FOLDER, ALLOWED_EXTENSIONS, MODULE_CONFIG
 
@@ -24,6 +26,12 @@ def create_app():
     # 创建上传目录
     os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     
+    # 请求与推理指标，GET /metrics
+    register_flask_metrics(app, 'video_analysis_module2')
+    
+    # 请求ID与链路追踪
+    register_flask_tracing(app, 'video_analysis_module2')
+    
     return app
 
 
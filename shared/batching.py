@@ -0,0 +1,149 @@
+"""
+动态微批处理
+并发请求进入队列，后台线程在等待窗口内(或凑满最大批量时)收集请求，合并为一次批量前向传播，
+再把各自的结果交还给对应请求；模型服务为多线程Flask应用，请求线程阻塞等待结果
+
+批量大小分布与排队耗时通过 shared.metrics 输出:
+- micro_batch_size{service,model}: 每次批量前向传播的样本数
+- micro_batch_queue_delay_seconds{service,model}: 请求入队到所在批次开始执行的耗时
+"""
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from shared.metrics import get_metrics_registry
+
+logger = logging.getLogger(__name__)
+
+MICRO_BATCH_SIZE = get_metrics_registry().histogram(
+    'micro_batch_size', '每次批量前向传播的样本数', ('service', 'model'),
+    buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+MICRO_BATCH_QUEUE_DELAY = get_metrics_registry().histogram(
+    'micro_batch_queue_delay_seconds', '请求入队到所在批次开始执行的耗时(秒)', ('service', 'model'),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+class _PendingRequest:
+    """队列中的单个请求"""
+
+    __slots__ = ('item', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    """
+    动态微批处理器
+
+    batch_fn 接收一组样本，返回等长的结果列表(顺序一致)；批量执行失败时该批所有请求收到同一异常。
+    max_batch_size 不大于1时不启用批处理，在调用线程中直接执行。
+    """
+
+    def __init__(
+        self,
+        service: str,
+        model: str,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0
+    ):
+        self.service = service
+        self.model = model
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._batch_size_metric = MICRO_BATCH_SIZE.labels(service, model)
+        self._queue_delay_metric = MICRO_BATCH_QUEUE_DELAY.labels(service, model)
+
+        # 累计统计
+        self._batches = 0
+        self._requests = 0
+        self._largest_batch = 0
+
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue()
+        self._worker = None
+        if self.enabled:
+            self._worker = threading.Thread(target=self._run, name=f'micro-batch-{model}', daemon=True)
+            self._worker.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    def submit(self, item: Any) -> Any:
+        """提交一个样本并阻塞等待其结果"""
+        if not self.enabled:
+            return self._execute([_PendingRequest(item)])[0]
+
+        request = _PendingRequest(item)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_PendingRequest]:
+        """取出一批请求: 从第一个请求入队起最多等待 max_wait 秒，凑满 max_batch_size 立即返回"""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                # 等待窗口已过时仍取走已在队列中的请求，不再等待新请求
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _execute(self, batch: List[_PendingRequest]) -> List[Any]:
+        """执行一次批量前向传播并记录指标"""
+        started_at = time.perf_counter()
+        for request in batch:
+            self._queue_delay_metric.observe(started_at - request.enqueued_at)
+        self._batch_size_metric.observe(len(batch))
+        self._batches += 1
+        self._requests += len(batch)
+        self._largest_batch = max(self._largest_batch, len(batch))
+
+        results = self.batch_fn([request.item for request in batch])
+        if len(results) != len(batch):
+            raise RuntimeError(f"批处理结果数量({len(results)})与请求数量({len(batch)})不一致")
+        return results
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                results = self._execute(batch)
+            except BaseException as e:
+                logger.error(f"{self.model} 批量推理失败 (batch={len(batch)}): {e}")
+                for request in batch:
+                    request.error = e
+                    request.done.set()
+                continue
+            for request, result in zip(batch, results):
+                request.result = result
+                request.done.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取批处理统计"""
+        return {
+            'enabled': self.enabled,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batches': self._batches,
+            'requests': self._requests,
+            'avg_batch_size': round(self._requests / self._batches, 2) if self._batches > 0 else 0.0,
+            'largest_batch': self._largest_batch,
+            'queued': self._queue.qsize()
+        }
@@ -0,0 +1,54 @@
+"""
+图像解码
+各服务统一通过本模块打开和解码图像:
+- 只需要尺寸或格式时只解析文件头，不解码像素
+- 下游只需要小尺寸图像时(如CLIP预处理缩放到224)，JPEG在DCT域按1/2、1/4、1/8直接缩小解码
+- 可直接从上传文件流解码，不必先写入临时文件
+
+source 可以是图像内容(bytes)、文件路径或可读的二进制文件对象(如 werkzeug FileStorage.stream)。
+"""
+import io
+from typing import BinaryIO, NamedTuple, Optional, Union
+
+from PIL import Image
+
+ImageSource = Union[bytes, str, BinaryIO]
+
+
+class ImageInfo(NamedTuple):
+    """文件头中的图像信息"""
+    width: int
+    height: int
+    format: Optional[str]
+    mode: str
+
+
+def open_image(source: ImageSource) -> Image.Image:
+    """打开图像并解析文件头，像素数据在首次访问时才解码"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    return Image.open(source)
+
+
+def probe_image(source: ImageSource) -> ImageInfo:
+    """只读取文件头，获取尺寸、格式与色彩模式"""
+    image = open_image(source)
+    try:
+        return ImageInfo(image.size[0], image.size[1], image.format, image.mode)
+    finally:
+        image.close()
+
+
+def decode_image(source: ImageSource, mode: str = 'RGB', min_size: Optional[int] = None) -> Image.Image:
+    """
+    解码图像并转换色彩模式
+
+    给定 min_size 时，JPEG按不小于 min_size 的短边缩小解码(DCT域缩放)，其他格式仍按原尺寸解码；
+    调用方需自行缩放到目标尺寸。
+    """
+    image = source if isinstance(source, Image.Image) else open_image(source)
+    if min_size is not None:
+        # draft 只对JPEG生效，选择使宽高均不小于请求尺寸的最大缩放比例
+        image.draft(mode, (min_size, min_size))
+    image.load()
+    return image if image.mode == mode else image.convert(mode)
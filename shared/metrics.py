@@ -0,0 +1,385 @@
+"""
+Prometheus格式的指标采集
+网关与各微服务共用：按路由统计请求数、请求耗时直方图、进行中请求数，以及模型推理耗时直方图
+
+记录时只向无锁队列追加一条事件(deque.append在GIL下是原子操作)，
+归并到计数器的工作在输出指标或积压过多时统一完成，可以在生产环境常开。
+"""
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Dict, Any, List, Tuple, Sequence
+
+# 默认直方图分桶(秒)，覆盖网关转发(毫秒级)到模型推理(秒级)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 待归并事件数上限，超过后由记录线程顺带归并，避免长时间不采集时无限积压
+MAX_PENDING_EVENTS = 10000
+
+# 待归并事件队列，元素为 (归并函数, 参数)
+_pending = deque()
+_drain_lock = threading.Lock()
+
+
+def _record(apply, value):
+    """记录一条事件"""
+    _pending.append((apply, value))
+    if len(_pending) > MAX_PENDING_EVENTS:
+        drain()
+
+
+def drain():
+    """将待归并事件应用到各指标，所有状态修改都在此处串行完成"""
+    with _drain_lock:
+        popleft = _pending.popleft
+        while True:
+            try:
+                apply, value = popleft()
+            except IndexError:
+                return
+            apply(value)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _CounterChild:
+    __slots__ = ('_value',)
+
+    def __init__(self):
+        self._value = 0.0
+
+    def _add(self, amount: float):
+        self._value += amount
+
+    def inc(self, amount: float = 1):
+        _record(self._add, amount)
+
+    def get(self) -> float:
+        return self._value
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def _set(self, value: float):
+        self._value = value
+
+    def dec(self, amount: float = 1):
+        _record(self._add, -amount)
+
+    def set(self, value: float):
+        _record(self._set, value)
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', '_counts', '_sum')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # 最后一个桶对应 +Inf
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+
+    def _observe(self, value: float):
+        self._counts[bisect_left(self._bounds, value)] += 1
+        self._sum += value
+
+    def observe(self, value: float):
+        _record(self._observe, value)
+
+    def time(self) -> "_Timer":
+        """计时上下文管理器，退出时记录耗时(秒)"""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        return list(self._counts), self._sum
+
+
+class _Timer:
+    __slots__ = ('_child', '_start')
+
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+class _Metric:
+    """带标签的指标族，每组标签值对应一个子指标"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """获取标签值对应的子指标，首次出现时创建"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(tuple(str(value) for value in values), self._new_child())
+                self._children[values] = child
+        return child
+
+    def _series(self):
+        """去重后的 (标签值, 子指标) 列表，标签值统一为字符串"""
+        seen = set()
+        with self._lock:
+            items = list(self._children.items())
+        for values, child in items:
+            if id(child) not in seen:
+                seen.add(id(child))
+                yield tuple(str(value) for value in values), child
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for values, child in self._series():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}")
+        return lines
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        bounds = self.buckets + (float('inf'),)
+        for values, child in self._series():
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, values)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表，负责输出Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"指标 {metric.name} 已以不同类型或标签注册")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """归并待处理事件后输出所有指标"""
+        drain()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表实例
+_metrics_registry = None
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取指标注册表实例 (单例模式)"""
+    global _metrics_registry
+    if _metrics_registry is None:
+        _metrics_registry = MetricsRegistry()
+    return _metrics_registry
+
+
+# 通用指标，标签中的 service 区分网关与各微服务
+REQUESTS_TOTAL = get_metrics_registry().counter(
+    'http_requests_total', '按路由统计的请求数', ('service', 'route', 'method', 'status')
+)
+REQUEST_DURATION = get_metrics_registry().histogram(
+    'http_request_duration_seconds', '按路由统计的请求耗时(秒)', ('service', 'route', 'method')
+)
+REQUESTS_IN_FLIGHT = get_metrics_registry().gauge(
+    'http_requests_in_flight', '按路由统计的进行中请求数', ('service', 'route')
+)
+INFERENCE_DURATION = get_metrics_registry().histogram(
+    'model_inference_duration_seconds', '模型推理各阶段耗时(秒)', ('service', 'model', 'stage')
+)
+
+
+def observe_inference(service: str, model: str, stage: str = 'forward') -> _Timer:
+    """
+    模型推理计时
+
+    用法: with observe_inference('ai_image_detection', 'SAFEResNet'): ...
+    """
+    return INFERENCE_DURATION.labels(service, model, stage).time()
+
+
+# 标签值 -> 子指标的缓存，归并时一次查找即可更新请求相关的全部指标
+# (service, route) -> 进行中请求数; (service, route, method, status) -> (进行中请求数, 请求数, 耗时)
+_request_series: Dict[Tuple, Any] = {}
+
+
+def _request_started(key: Tuple[str, str]):
+    in_flight = _request_series.get(key)
+    if in_flight is None:
+        in_flight = _request_series[key] = REQUESTS_IN_FLIGHT.labels(*key)
+    in_flight._add(1)
+
+
+def _request_finished(event: Tuple[str, str, str, int, float]):
+    key = event[:4]
+    series = _request_series.get(key)
+    if series is None:
+        service, route, method, status = key
+        series = _request_series[key] = (
+            REQUESTS_IN_FLIGHT.labels(service, route),
+            REQUESTS_TOTAL.labels(service, route, method, status),
+            REQUEST_DURATION.labels(service, route, method)
+        )
+    in_flight, total, duration = series
+    in_flight._add(-1)
+    total._add(1)
+    duration._observe(event[4])
+
+
+def _route_of(request) -> str:
+    """使用路由模板作为标签(如 /result/<task_id>)，避免路径参数导致标签数量无限增长"""
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def register_flask_metrics(app, service_name: str):
+    """为Flask应用注册请求指标采集和 /metrics 接口"""
+    from flask import request, g, Response
+
+    @app.before_request
+    def _metrics_before_request():
+        route = _route_of(request)
+        g._metrics = (route, time.perf_counter())
+        _record(_request_started, (service_name, route))
+
+    @app.after_request
+    def _metrics_after_request(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown_request(exc):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        route, start_time = state
+        status = g.pop('_metrics_status', 500)
+        _record(_request_finished, (service_name, route, request.method, status, time.perf_counter() - start_time))
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus指标"""
+        return Response(get_metrics_registry().render(), content_type=CONTENT_TYPE)
+
+
+def register_quart_metrics(app, service_name: str):
+    """为Quart应用(网关)注册请求指标采集和 /metrics 接口"""
+    from quart import request, g, Response
+
+    @app.before_request
+    async def _metrics_before_request():
+        route = _route_of(request)
+        g._metrics = (route, time.perf_counter())
+        _record(_request_started, (service_name, route))
+
+    @app.after_request
+    async def _metrics_after_request(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    async def _metrics_teardown_request(exc):
+        state = g.pop('_metrics', None)
+        if state is None:
+            return
+        route, start_time = state
+        status = g.pop('_metrics_status', 500)
+        _record(_request_finished, (service_name, route, request.method, status, time.perf_counter() - start_time))
+
+    @app.route('/metrics', methods=['GET'])
+    async def metrics():
+        """Prometheus指标"""
+        return Response(get_metrics_registry().render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,144 @@
+"""
+CPU推理精度
+各服务通过配置选择模型的推理精度:
+- fp32: 原始精度
+- int8_dynamic: 线性层权重量化为int8，激活在运行时动态量化，适合以线性层为主的Transformer(如CLIP)
+- int8_static: 静态量化，用校准数据确定激活的量化参数；可被torch.fx追踪的卷积网络整体以int8执行(quantize_static)，
+  Transformer只量化线性层(quantize_static_linear)
+- bf16: CPU autocast 到 bfloat16，仅在CPU支持bf16指令(AVX512-BF16/AMX)时启用
+
+量化只改变推理速度与数值精度，切换精度前应使用各服务的 bench_quantization.py 在留出集上对比与fp32的差异。
+"""
+import copy
+import logging
+import itertools
+import contextlib
+from typing import Any, Callable, Dict, Iterable, Optional, Sequence
+
+import torch
+import torch.nn as nn
+
+logger = logging.getLogger(__name__)
+
+PRECISIONS = ('fp32', 'int8_dynamic', 'int8_static', 'bf16')
+
+
+def bf16_supported() -> bool:
+    """当前CPU是否支持bf16计算(oneDNN检测AVX512-BF16/AMX等指令)"""
+    try:
+        return torch.backends.mkldnn.is_available() and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(precision: Optional[str], supported: Sequence[str] = PRECISIONS) -> str:
+    """
+    校验配置的推理精度，返回实际使用的精度
+
+    未知的精度抛出 ValueError；模型不支持的精度或CPU不支持bf16时记录警告并回退到fp32。
+    """
+    precision = (precision or 'fp32').strip().lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"未知的推理精度: {precision}，可选: {', '.join(PRECISIONS)}")
+    if precision not in supported:
+        logger.warning(f"该模型不支持推理精度 {precision}，使用fp32")
+        return 'fp32'
+    if precision == 'bf16' and not bf16_supported():
+        logger.warning("CPU不支持bf16计算，使用fp32")
+        return 'fp32'
+    return precision
+
+
+def quantize_dynamic(module: nn.Module, inplace: bool = False) -> nn.Module:
+    """将模块中的 nn.Linear 替换为int8动态量化实现"""
+    return torch.ao.quantization.quantize_dynamic(module, {nn.Linear}, dtype=torch.qint8, inplace=inplace)
+
+
+def quantize_static(module: nn.Module, calibration_batches: Iterable[torch.Tensor],
+                    backend: Optional[str] = None) -> nn.Module:
+    """
+    FX图模式静态量化: 在模块副本上插入观察器，用校准数据统计激活范围后转换为int8模块
+
+    module 的 forward 需可被 torch.fx 追踪，输入与输出均为fp32张量；原模块不受影响。
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    backend = backend or torch.backends.quantized.engine
+    batches = iter(calibration_batches)
+    first = next(batches, None)
+    if first is None:
+        raise ValueError("静态量化需要至少一批校准数据")
+
+    prepared = prepare_fx(copy.deepcopy(module).eval(), get_default_qconfig_mapping(backend), (first,))
+    count = 0
+    with torch.no_grad():
+        for batch in itertools.chain([first], batches):
+            prepared(batch)
+            count += batch.shape[0]
+    logger.info(f"静态量化校准完成，样本数: {count}，后端: {backend}")
+    return convert_fx(prepared)
+
+
+def quantize_static_linear(module: nn.Module, calibrate: Callable[[], Any], backend: Optional[str] = None) -> nn.Module:
+    """
+    Eager模式静态量化模块中的 nn.Linear，用于无法被torch.fx追踪的模型(如CLIP的Transformer)
+
+    每个线性层被包装为 量化 -> int8线性层 -> 反量化，calibrate() 在插入观察器后运行模型以统计各层输入范围；
+    LayerNorm、注意力等其余算子保持fp32。nn.MultiheadAttention 直接读取 out_proj 的权重，不做替换。
+    原地修改并返回 module。
+    """
+    from torch.ao.quantization import QuantWrapper, convert, get_default_qconfig, prepare
+
+    qconfig = get_default_qconfig(backend or torch.backends.quantized.engine)
+    wrapped = 0
+    for parent in list(module.modules()):
+        if isinstance(parent, nn.MultiheadAttention):
+            continue
+        for name, child in list(parent.named_children()):
+            if type(child) is nn.Linear:
+                wrapper = QuantWrapper(child)
+                wrapper.qconfig = qconfig
+                setattr(parent, name, wrapper)
+                wrapped += 1
+    if wrapped == 0:
+        raise ValueError("模块中没有可量化的线性层")
+
+    prepare(module, inplace=True)
+    with torch.no_grad():
+        calibrate()
+    convert(module, inplace=True)
+    logger.info(f"线性层静态量化完成，量化层数: {wrapped}")
+    return module
+
+
+def autocast(precision: str):
+    """按推理精度返回前向传播所用的autocast上下文，非bf16时不做任何转换"""
+    if precision == 'bf16':
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def compare_predictions(reference: torch.Tensor, candidate: torch.Tensor,
+                        labels: Optional[torch.Tensor] = None) -> Dict[str, Any]:
+    """
+    对比同一批样本在fp32(reference)与其他精度(candidate)下的类别概率([N, C])
+
+    返回预测一致率、概率的最大/平均绝对差；给定标签时同时返回两者的准确率及差值。
+    """
+    diff = (reference.float() - candidate.float()).abs()
+    report = {
+        'samples': reference.shape[0],
+        'agreement': (reference.argmax(dim=1) == candidate.argmax(dim=1)).float().mean().item(),
+        'max_prob_diff': diff.max().item(),
+        'mean_prob_diff': diff.mean().item()
+    }
+    if labels is not None:
+        reference_accuracy = (reference.argmax(dim=1) == labels).float().mean().item()
+        accuracy = (candidate.argmax(dim=1) == labels).float().mean().item()
+        report.update({
+            'reference_accuracy': reference_accuracy,
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - reference_accuracy
+        })
+    return report
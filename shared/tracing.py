@@ -0,0 +1,314 @@
+"""
+请求ID与链路追踪
+网关为每个请求生成请求ID并通过 X-Request-ID 请求头传递给下游服务，
+各服务按阶段记录耗时span，导出到本地文件或追踪收集器(Zipkin v2 JSON格式)，用于还原单个请求的瀑布图。
+出站调用同时携带B3请求头: X-B3-TraceId、为下游根span分配的 X-B3-SpanId 及调用方当前span X-B3-ParentSpanId，
+下游服务的根span据此挂到调用方的span之下
+
+通过环境变量配置导出方式:
+- TRACE_EXPORTER: 为空时只传递请求ID不记录span；file 写入本地文件；zipkin 发送到收集器
+- TRACE_FILE: 本地追踪文件路径(每行一个span)，默认 traces.jsonl
+- TRACE_COLLECTOR_URL: 收集器地址，默认 http://localhost:9411/api/v2/spans
+"""
+import os
+import re
+import json
+import time
+import uuid
+import queue
+import hashlib
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+TRACE_ID_HEADER = 'X-B3-TraceId'
+SPAN_ID_HEADER = 'X-B3-SpanId'
+PARENT_SPAN_ID_HEADER = 'X-B3-ParentSpanId'
+
+TRACE_EXPORTER = os.getenv('TRACE_EXPORTER', '')
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL', 'http://localhost:9411/api/v2/spans')
+
+# 导出队列上限，收集器不可用时丢弃新的追踪，不影响请求处理
+MAX_PENDING_TRACES = 1000
+
+_TRACE_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+_B3_TRACE_ID_PATTERN = re.compile(r'^(?:[0-9a-f]{16}|[0-9a-f]{32})$')
+_SPAN_ID_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+class _Trace:
+    """单个请求在当前服务内的追踪数据"""
+
+    __slots__ = ('request_id', 'trace_id', 'service', 'spans', 'root_span_id', 'remote_parent_id')
+
+    def __init__(self, request_id: str, service: str, trace_id: Optional[str] = None,
+                 root_span_id: Optional[str] = None, remote_parent_id: Optional[str] = None):
+        self.request_id = request_id
+        # 未收到上游traceId时，请求ID本身是32位十六进制则直接作为traceId，否则取其摘要，保证同一请求在各服务中的traceId一致
+        if trace_id is None:
+            trace_id = request_id if _TRACE_ID_PATTERN.match(request_id) else hashlib.md5(request_id.encode('utf-8')).hexdigest()
+        self.trace_id = trace_id
+        self.service = service
+        self.spans: List[Dict[str, Any]] = []
+        # 上游为本服务根span分配的ID及上游调用span的ID
+        self.root_span_id = root_span_id
+        self.remote_parent_id = remote_parent_id
+
+
+_current_trace: ContextVar[Optional[_Trace]] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar('current_span', default=None)
+
+
+def generate_request_id() -> str:
+    """生成请求ID"""
+    return uuid.uuid4().hex
+
+
+def _generate_span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+def current_request_id() -> Optional[str]:
+    """当前请求的请求ID，不在请求上下文中时返回None"""
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def start_trace(request_id: Optional[str], service: str, headers=None) -> str:
+    """
+    在当前上下文中开始追踪，返回使用的请求ID
+
+    headers 为上游请求的请求头，其中的B3头有效时沿用上游的traceId，并将本服务的根span挂到上游调用span之下。
+    """
+    def header(name, pattern):
+        value = (headers.get(name) or '').lower() if headers is not None else ''
+        return value if pattern.match(value) else None
+
+    trace = _Trace(
+        request_id or generate_request_id(), service,
+        trace_id=header(TRACE_ID_HEADER, _B3_TRACE_ID_PATTERN),
+        root_span_id=header(SPAN_ID_HEADER, _SPAN_ID_PATTERN),
+        remote_parent_id=header(PARENT_SPAN_ID_HEADER, _SPAN_ID_PATTERN)
+    )
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace.request_id
+
+
+def propagation_headers() -> Dict[str, str]:
+    """
+    出站调用携带的追踪请求头: 请求ID与B3头
+
+    X-B3-SpanId 为下游根span新分配的ID，X-B3-ParentSpanId 为当前span(如网关的 proxy span)，不在请求上下文中时返回空字典。
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return {}
+    headers = {
+        REQUEST_ID_HEADER: trace.request_id,
+        TRACE_ID_HEADER: trace.trace_id,
+        SPAN_ID_HEADER: _generate_span_id()
+    }
+    parent_id = _current_span.get()
+    if parent_id is not None:
+        headers[PARENT_SPAN_ID_HEADER] = parent_id
+    return headers
+
+
+def finish_trace():
+    """结束当前上下文的追踪并提交导出"""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    _current_trace.set(None)
+    _current_span.set(None)
+    if trace.spans:
+        _get_exporter().submit(trace.spans)
+
+
+class _Span:
+    """计时span，退出时记录到当前追踪"""
+
+    __slots__ = ('_trace', '_name', '_tags', '_id', '_parent', '_token', '_start', '_start_perf')
+
+    def __init__(self, trace: _Trace, name: str, tags: Dict[str, Any]):
+        self._trace = trace
+        self._name = name
+        self._tags = tags
+
+    def __enter__(self):
+        self._parent = _current_span.get()
+        if self._parent is None and self._trace.root_span_id is not None:
+            # 本服务的根span使用上游分配的ID，父span为上游的调用span
+            self._id, self._parent = self._trace.root_span_id, self._trace.remote_parent_id
+            self._trace.root_span_id = None
+        else:
+            self._id = _generate_span_id()
+        self._token = _current_span.set(self._id)
+        self._start = time.time()
+        self._start_perf = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self._start_perf
+        _current_span.reset(self._token)
+
+        tags = {key: str(value) for key, value in self._tags.items()}
+        tags['request_id'] = self._trace.request_id
+        if exc_type is not None:
+            tags['error'] = str(exc_value) or exc_type.__name__
+
+        span = {
+            'traceId': self._trace.trace_id,
+            'id': self._id,
+            'name': self._name,
+            'timestamp': int(self._start * 1_000_000),
+            'duration': max(int(duration * 1_000_000), 1),
+            'localEndpoint': {'serviceName': self._trace.service},
+            'tags': tags
+        }
+        if self._parent is not None:
+            span['parentId'] = self._parent
+        self._trace.spans.append(span)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **tags):
+    """
+    记录一个阶段的耗时
+
+    用法: with span('SAFEResNet.forward'): ...
+    未开启导出或不在请求上下文中时不做任何记录。
+    """
+    trace = _current_trace.get()
+    if trace is None or not TRACE_EXPORTER:
+        return _NOOP_SPAN
+    return _Span(trace, name, tags)
+
+
+class _TraceExporter:
+    """后台线程导出追踪数据，请求线程只负责入队"""
+
+    def __init__(self, exporter: str, file_path: str, collector_url: str):
+        self.exporter = exporter
+        self.file_path = file_path
+        self.collector_url = collector_url
+        self._queue: "queue.Queue[List[Dict[str, Any]]]" = queue.Queue(maxsize=MAX_PENDING_TRACES)
+        self._dropped = 0
+        self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+        self._thread.start()
+
+    def submit(self, spans: List[Dict[str, Any]]):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self._dropped += 1
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            # 合并已排队的追踪，减少写文件和网络请求次数
+            while len(batch) < 500:
+                try:
+                    batch = batch + self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+            except Exception as e:
+                logger.warning(f"导出追踪数据失败: {e}")
+
+    def _export(self, spans: List[Dict[str, Any]]):
+        if self.exporter == 'file':
+            with open(self.file_path, 'a', encoding='utf-8') as f:
+                for item in spans:
+                    f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        elif self.exporter == 'zipkin':
+            requests.post(self.collector_url, json=spans, timeout=5)
+
+
+# 全局导出器实例
+_trace_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def _get_exporter() -> _TraceExporter:
+    """获取追踪导出器实例 (单例模式)"""
+    global _trace_exporter
+    if _trace_exporter is None:
+        with _exporter_lock:
+            if _trace_exporter is None:
+                _trace_exporter = _TraceExporter(TRACE_EXPORTER, TRACE_FILE, TRACE_COLLECTOR_URL)
+    return _trace_exporter
+
+
+def register_flask_tracing(app, service_name: str):
+    """为Flask应用注册请求追踪：沿用上游传入的请求ID，记录整个请求的根span"""
+    from flask import request, g
+
+    @app.before_request
+    def _tracing_before_request():
+        request_id = start_trace(request.headers.get(REQUEST_ID_HEADER), service_name, request.headers)
+        g._trace_root = span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        g._trace_root.__enter__()
+        g._request_id = request_id
+
+    @app.after_request
+    def _tracing_after_request(response):
+        request_id = g.get('_request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _tracing_teardown_request(exc):
+        root = g.pop('_trace_root', None)
+        if root is not None:
+            root.__exit__(None, None, None)
+        finish_trace()
+
+
+def register_quart_tracing(app, service_name: str):
+    """为Quart应用(网关)注册请求追踪：生成或沿用请求ID，记录整个请求的根span"""
+    from quart import request, g
+
+    @app.before_request
+    async def _tracing_before_request():
+        request_id = start_trace(request.headers.get(REQUEST_ID_HEADER), service_name, request.headers)
+        g._trace_root = span(f"{request.method} {request.url_rule.rule if request.url_rule else request.path}")
+        g._trace_root.__enter__()
+        g._request_id = request_id
+
+    @app.after_request
+    async def _tracing_after_request(response):
+        request_id = g.get('_request_id')
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    async def _tracing_teardown_request(exc):
+        root = g.pop('_trace_root', None)
+        if root is not None:
+            root.__exit__(None, None, None)
+        finish_trace()
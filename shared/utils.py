@@ -5,8 +5,8 @@ import uuid
 import os
 import hashlib
 from typing import Optional, Dict, Any
-import requests
 from datetime import datetime
+from shared.tracing import propagation_headers
 
 
 def generate_task_id() -> str:
@@ -37,48 +37,9 @@ def format_file_size(size_bytes: int) -> str:
     return f"{size_bytes:.2f}{size_names[i]}"
 
 
-def check_service_health(service_url: str, timeout: int = 5) -> bool:
-    """检查服务健康状态"""
-    try:
-        response = requests.get(f"{service_url}/health", timeout=timeout)
-        return response.status_code == 200
-    except:
-        return False
-
-
-def call_service_api(
-    service_url: str, 
-    endpoint: str, 
-    method: str = "POST", 
-    data: Optional[Dict] = None,
-    files: Optional[Dict] = None,
-    timeout: int = 30
-) -> Dict[str, Any]:
-    """调用其他微服务API"""
-    url = f"{service_url.rstrip('/')}/{endpoint.lstrip('/')}"
-    
-    try:
-        if method.upper() == "POST":
-            if files:
-                response = requests.post(url, data=data, files=files, timeout=timeout)
-            else:
-                response = requests.post(url, json=data, timeout=timeout)
-        elif method.upper() == "GET":
-            response = requests.get(url, params=data, timeout=timeout)
-        else:
-            raise ValueError(f"不支持的HTTP方法: {method}")
-        
-        response.raise_for_status()
-        return response.json()
-        
-    except requests.exceptions.Timeout:
-        raise Exception("请求超时")
-    except requests.exceptions.ConnectionError:
-        raise Exception("服务连接失败")
-    except requests.exceptions.HTTPError as e:
-        raise Exception(f"HTTP错误: {e.response.status_code}")
-    except Exception as e:
-        raise Exception(f"请求失败: {str(e)}")
+def trace_headers() -> Dict[str, str]:
+    """向下游传递当前请求ID与span的请求头"""
+    return propagation_headers()
 
 
 def validate_image_file(file_path: str) -> tuple[bool, str]: